@@ -0,0 +1,66 @@
+# Copyright (c) 2013-2016, 2018  Benjamin Althues <benjamin@babab.nl>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+'''Tests of coroutine run methods, imported by tests.py on Python 3.5+'''
+
+import io
+import os
+
+from nose.tools import eq_
+
+import pycommand
+
+
+def test_async_run():
+    '''Coroutine run methods of (sub)commands run on a shared loop'''
+    import asyncio
+    loops = []
+
+    class AsyncCommand(pycommand.CommandBase):
+        async def run(self):
+            await asyncio.sleep(0)
+            loops.append(asyncio.get_event_loop())
+            return len(self.args)
+
+    class MainCommand(pycommand.CommandBase):
+        commands = {'async': AsyncCommand}
+
+        def run(self):
+            return super(MainCommand, self).run().run()
+
+    eq_(pycommand.awaitResult(MainCommand(['async', 'a', 'b']).run()), 2)
+    eq_(pycommand.awaitResult(AsyncCommand([]).run()), 0)
+    eq_(loops[0] is loops[1], True)
+    eq_(pycommand.awaitResult(3), 3)
+
+
+def test_async_interrupt():
+    '''An interrupt cancels the running task instead of raising'''
+    import asyncio
+    import signal
+    cancelled = []
+
+    class AsyncCommand(pycommand.CommandBase):
+        async def run(self):
+            os.kill(os.getpid(), signal.SIGINT)
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+            return 0
+
+    stdout = io.StringIO()
+    eq_(pycommand.execute(AsyncCommand, [], stdout), 130)
+    eq_((cancelled, stdout.getvalue()), ([True], '\n'))
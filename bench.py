@@ -0,0 +1,830 @@
+# Copyright (c) 2013-2016, 2018  Benjamin Althues <benjamin@babab.nl>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+'''
+Benchmarks for pycommand.
+
+Run all benchmarks with ``python bench.py`` or pass the names of the
+benchmarks to run, e.g. ``python bench.py parse_scaling``.
+
+The core benchmarks record their timings as metrics, which can be saved
+as a JSON baseline and compared with a later run::
+
+    $ python bench.py --save baseline.json
+    $ python bench.py --compare baseline.json --threshold 25
+
+Comparing exits with status 1 when a metric is slower than its baseline
+by more than the threshold, in percent, and by more than `NOISE_FLOOR`.
+When saving or comparing, the benchmarks are run three times, or
+``--repeat`` times, and the best time of every metric is kept. Before
+comparing, benchmarks with slower metrics are run up to as many times
+again, so a metric is only reported when all of its runs were slower.
+Only compare results of the same machine and version of Python, on an
+otherwise idle machine.
+'''
+
+from __future__ import absolute_import, print_function
+
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+import pycommand
+
+results = {}
+'''Dict of metric name -> time in microseconds of the benchmarks run'''
+
+NOISE_FLOOR = 0.5
+'''Microseconds. Smaller slowdowns are not reported as regressions'''
+
+
+def record(name, value):
+    '''Store the time `value` in microseconds as metric `name`
+
+    When a benchmark is repeated, the best time is kept.
+    '''
+    results[name] = min(value, results.get(name, value))
+    return value
+
+
+def makeCommand(size):
+    '''Create a CommandBase subclass with `size` options'''
+    optionList = []
+    for n in range(size):
+        if n % 2:
+            optionList.append(('option-{}'.format(n),
+                               ('', '<value>', 'option number {}'.format(n))))
+        else:
+            optionList.append(('option-{}'.format(n),
+                               ('', False, 'option number {}'.format(n))))
+
+    class BenchCommand(pycommand.CommandBase):
+        usagestr = 'usage: bench [options]'
+    BenchCommand.optionList = tuple(optionList)
+    return BenchCommand
+
+
+def timePerCall(func, number):
+    '''Return the best time of a single call to `func` in microseconds'''
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+def bench_parse_scaling():
+    '''Parse time of a fixed argv while optionList grows'''
+    print('{:>8}  {:>12}  {:>12}'.format('options', 'parse (us)',
+                                         'init (us)'))
+    for size in (1, 10, 100, 1000, 5000):
+        command = makeCommand(size)
+        argv = []
+        for n in range(min(size, 10)):
+            flag = '--option-{}'.format(size - 1 - n)
+            argv += [flag, 'value'] if (size - 1 - n) % 2 else [flag]
+        spec = command.getSpec()
+        parse = record('parse_scaling/{}/parse'.format(size),
+                       timePerCall(lambda: spec.parse(argv), 2000))
+        init = record('parse_scaling/{}/init'.format(size),
+                      timePerCall(lambda: command(argv), 2000))
+        print('{:>8}  {:>12.2f}  {:>12.2f}'.format(size, parse, init))
+
+
+def bench_long_argv():
+    '''Parse throughput of long command lines vs. getopt'''
+    import getopt
+
+    class Command(pycommand.CommandBase):
+        optionList = tuple(('opt-{:04d}-name'.format(n), ('', False, ''))
+                           for n in range(1000))
+    spec = Command.getSpec()
+    print('{:>8}  {:>12}  {:>12}  {:>12}'.format(
+        'tokens', 'getopt (us)', 'exact (us)', 'prefix (us)'))
+    for length in (10, 100, 1000):
+        exact = ['--opt-{:04d}-name'.format(n) for n in range(length)]
+        prefix = [opt[:-2] for opt in exact]
+        assert spec.parse(prefix)[2] is None
+
+        def withGetopt():
+            getopt.getopt(exact, spec.shortopts, spec.longopts)
+        print('{:>8}  {:>12.1f}  {:>12.1f}  {:>12.1f}'.format(
+            length, timePerCall(withGetopt, 20),
+            record('long_argv/{}/exact'.format(length),
+                   timePerCall(lambda: spec.parse(exact), 20)),
+            record('long_argv/{}/prefix'.format(length),
+                   timePerCall(lambda: spec.parse(prefix), 20))))
+
+
+def makeTree(depth):
+    '''Create a chain of `depth` nested commands, return the root'''
+    command = None
+    for level in reversed(range(depth)):
+        attrs = {
+            'optionList': (('flag-{}'.format(level), ('', False, '')),
+                           ('value-{}'.format(level), ('', '<v>', ''))),
+            'commands': {'sub': command} if command else {},
+        }
+        command = type('Level{}'.format(level), (pycommand.CommandBase, ),
+                       attrs)
+    return command
+
+
+def bench_subcommand_depth():
+    '''Resolving a chain of subcommands level by level vs. parseChain'''
+    print('{:>6}  {:>14}  {:>16}'.format('depth', 'dispatch (us)',
+                                         'parseChain (us)'))
+    for depth in (1, 4, 16):
+        root = makeTree(depth)
+        argv = []
+        for level in range(depth):
+            argv += ['--flag-{}'.format(level), '--value-{}'.format(level),
+                     'x', 'sub']
+        argv += ['arg'] * 20
+
+        def dispatch():
+            cmd = root(argv)
+            while cmd.args and cmd.args[0] in cmd.commands:
+                sub = super(type(cmd), cmd).run()
+                for flag, value in cmd.flags.items():
+                    sub.registerParentFlag(flag, value)
+                cmd = sub
+
+        def parseChain():
+            root.parseChain(argv)
+        print('{:>6}  {:>14.2f}  {:>16.2f}'.format(
+            depth,
+            record('subcommand_depth/{}/dispatch'.format(depth),
+                   timePerCall(dispatch, 2000)),
+            record('subcommand_depth/{}/parseChain'.format(depth),
+                   timePerCall(parseChain, 2000))))
+
+
+def bench_parse_many():
+    '''Throughput of CommandBase.parseMany vs. instantiating commands'''
+    command = makeCommand(20)
+    argvs = [['--option-0', '--option-1', 'value', 'arg{}'.format(n)]
+             for n in range(10000)]
+
+    def instantiate():
+        for argv in argvs:
+            cmd = command(argv)
+            cmd.flags, cmd.args, cmd.error
+
+    def parseMany():
+        for flags, args, error in command.parseMany(argvs):
+            pass
+
+    for name, func in (('instances', instantiate), ('parseMany', parseMany)):
+        usec = timePerCall(func, 1) / len(argvs)
+        print('{:>10}  {:>10.0f} argv/s'.format(name, 1e6 / usec))
+
+
+def bench_flags():
+    '''Memory and attribute access of slotted flags vs. dictobject'''
+    import tracemalloc
+    from pycommand.pycommand import dictobject
+    command = makeCommand(20)
+    flags = command(['--option-0', '--option-1', 'value']).flags
+    old = dictobject(flags)
+
+    def size(make):
+        tracemalloc.start()
+        objects = [make() for n in range(10000)]
+        size = tracemalloc.get_traced_memory()[0] / len(objects)
+        tracemalloc.stop()
+        return size
+
+    def access(obj):
+        def access():
+            obj.option_0, obj.option_1, obj.option_2, obj.option_3
+        return access
+
+    def accessDict(obj):
+        def access():
+            getattr(obj, 'option-0'), getattr(obj, 'option-1')
+            getattr(obj, 'option-2'), getattr(obj, 'option-3')
+        return access
+
+    print('{:>12}  {:>12}  {:>14}'.format('flags', 'bytes', 'access (ns)'))
+    for name, make, func in (
+        ('dictobject', lambda: dictobject(old), accessDict(old)),
+        ('slotted', flags.copy, access(flags)),
+    ):
+        print('{:>12}  {:>12.0f}  {:>14.1f}'.format(
+            name, size(make), record('flags/{}/access'.format(name),
+                                     timePerCall(func, 100000) / 4) * 1000))
+
+
+def bench_usage():
+    '''Rendering the usage text, streaming it and searching --help=<term>'''
+    import itertools
+    print('{:>8}  {:>12}  {:>12}  {:>12}  {:>12}'.format(
+        'options', 'render (us)', 'first (us)', 'search (us)', 'cached (us)'))
+    for size in (10, 100, 1000, 5000):
+        spec = makeCommand(size).getSpec()
+
+        def first():
+            # Time until the first line of options can be written
+            list(itertools.islice(spec.iterUsage(), 2))
+
+        def search():
+            spec._helpIndex = None
+            ''.join(spec.iterUsage('number 7'))
+        print('{:>8}  {:>12.1f}  {:>12.1f}  {:>12.1f}  {:>12.2f}'.format(
+            size,
+            record('usage/{}/render'.format(size),
+                   timePerCall(spec.renderUsage, 20)),
+            record('usage/{}/first'.format(size), timePerCall(first, 20)),
+            record('usage/{}/search'.format(size), timePerCall(search, 20)),
+            record('usage/{}/cached'.format(size),
+                   timePerCall(lambda: spec.usage, 10000))))
+
+
+def bench_startup():
+    '''Cold start of python -m pycommand --version vs. bare Python'''
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(
+        os.path.dirname(os.path.abspath(pycommand.__file__))))
+    for name, cmdline in (
+            ('--version', [sys.executable, '-m', 'pycommand', '--version']),
+            ('bare python', [sys.executable, '-c', 'pass']),
+    ):
+        usec = timePerCall(lambda: subprocess.check_call(
+            cmdline, env=env, stdout=subprocess.DEVNULL), 10)
+        if name == '--version':
+            record('startup/version', usec)
+        print('{:>12}  {:>8.1f} ms'.format(name, usec / 1000))
+
+
+def importTime(code, env):
+    '''Return (name, cumulative us) of the modules that `code` imports'''
+    output = subprocess.check_output(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        stderr=subprocess.STDOUT, env=env, universal_newlines=True)
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        if name.strip() == 'site':
+            modules = []
+        elif name[1] != ' ':
+            modules.append((name.strip(), int(cumulative)))
+    return modules
+
+
+def bench_import():
+    '''Time of importing pycommand and creating a command (-X importtime)'''
+    if sys.version_info < (3, 7):
+        print('skipped: -X importtime needs Python 3.7')
+        return
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(
+        os.path.dirname(os.path.abspath(pycommand.__file__))))
+    code = 'import pycommand.util; pycommand.CommandBase([])'
+    importTime(code, env)  # writes the bytecode cache
+    runs = [importTime(code, env) for run in range(5)]
+    usec = record('import/pycommand', min(
+        sum(cumulative for name, cumulative in modules) for modules in runs))
+    print('{:>12}  {:>8.1f} ms'.format('import', usec / 1000))
+    print('{:>12}  {}'.format('modules', ', '.join(
+        name for name, cumulative in runs[0])))
+
+
+FANOUT_TOOL = '''
+import hashlib
+import pycommand
+
+
+class Main(pycommand.CommandBase):
+    usagestr = 'usage: fanouttool [options] <item>...'
+
+    def runItem(self, item):
+        return hashlib.sha256(item.encode() * 1000).hexdigest()
+
+
+if __name__ == '__main__':
+    pycommand.run_and_exit(Main)
+'''
+
+
+def bench_fan_out():
+    '''Fan-out with --jobs vs. xargs starting one process per item'''
+    tmpdir = tempfile.mkdtemp()
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(
+        os.path.abspath(__file__)))
+    tool = os.path.join(tmpdir, 'fanouttool.py')
+    with open(tool, 'w') as script:
+        script.write(FANOUT_TOOL)
+    items = '\n'.join('item-{}'.format(n) for n in range(200)).encode()
+
+    def invoke(cmdline):
+        proc = subprocess.Popen(cmdline, stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE, env=env)
+        proc.communicate(items)
+    try:
+        for name, cmdline in (
+            ('xargs -P4', ['xargs', '-n1', '-P4', sys.executable, tool]),
+            ('--jobs 4', [sys.executable, tool, '--jobs', '4']),
+        ):
+            sec = min(timeit.repeat(lambda: invoke(cmdline), number=1,
+                                    repeat=3))
+            print('{:>10}  {:>8.1f} ms for 200 items'.format(name, sec * 1e3))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+SERVER_TOOL = '''
+import decimal, email.mime.multipart, http.client, json, xml.dom.minidom
+import pycommand
+
+
+class Main(pycommand.CommandBase):
+    usagestr = 'usage: benchtool [options]'
+    optionList = (('help', ('h', False, 'show this help information')), )
+
+    def run(self):
+        return 0
+
+
+if __name__ == '__main__':
+    pycommand.run_and_exit(Main)
+'''
+
+SERVER_CLIENT = '''
+from pycommand.server import forward_and_exit
+forward_and_exit('benchtool:Main')
+'''
+
+
+def bench_server():
+    '''Wall time of plain invocations vs. the resident server client'''
+    from pycommand import server
+    tmpdir = tempfile.mkdtemp()
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [tmpdir, os.path.dirname(os.path.abspath(__file__))]))
+    with open(os.path.join(tmpdir, 'benchtool.py'), 'w') as tool:
+        tool.write(SERVER_TOOL)
+    with open(os.path.join(tmpdir, 'client.py'), 'w') as client:
+        client.write(SERVER_CLIENT)
+
+    def invoke(script):
+        subprocess.check_call([sys.executable, os.path.join(tmpdir, script),
+                               '-h'], env=env)
+    try:
+        invoke('client.py')  # start the daemon
+        for script in ('benchtool.py', 'client.py'):
+            msec = timePerCall(lambda: invoke(script), 10) / 1000
+            print('{:>14}  {:>8.2f} ms'.format(script, msec))
+    finally:
+        conn = server.connect(server.socketPath('benchtool:Main'))
+        if conn is not None:
+            # A version mismatch makes the daemon exit
+            server.forward(conn, server.encodeRequest('stop', [], {}, '/'))
+            conn.close()
+        shutil.rmtree(tmpdir)
+
+
+def bench_completion():
+    '''Latency of a static bash completion vs. starting Python'''
+    from pycommand import completion
+    root = makeTree(4)
+    root.usagestr = 'usage: benchtool [options]'
+    script = completion.generate('bash', root)
+    words = 'benchtool sub --flag-1 sub --value-2 x sub --'
+    loop = script + '''
+COMP_WORDS=({words})
+COMP_CWORD=$((${{#COMP_WORDS[@]}} - 1))
+start=$EPOCHREALTIME
+for ((n = 0; n < 1000; n++)); do _benchtool; done
+echo $(( (${{EPOCHREALTIME/./}} - ${{start/./}}) / 1000 ))
+'''.format(words=words)
+    static = float(subprocess.check_output(['bash', '-c', loop]))
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(
+        os.path.abspath(__file__)))
+
+    def python():
+        subprocess.check_call([sys.executable, '-c', 'import pycommand'],
+                              env=env)
+    print('{:>8}  {:>8.3f} ms'.format('python',
+                                      timePerCall(python, 10) / 1000))
+    print('{:>8}  {:>8.3f} ms'.format('static', static / 1000))
+
+
+def bench_invoke():
+    '''Test invocations: subprocess vs. pycommand.testing.invoke'''
+    import threading
+    from pycommand.testing import invoke
+    tmpdir = tempfile.mkdtemp()
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(
+        os.path.abspath(__file__)))
+    tool = os.path.join(tmpdir, 'benchtool.py')
+    with open(tool, 'w') as script:
+        script.write(SERVER_TOOL)
+    namespace = {}
+    exec(SERVER_TOOL.replace("__name__ == '__main__'", 'False'), namespace)
+    command = namespace['Main']
+
+    def threaded(count):
+        def work():
+            for n in range(1000 // count):
+                invoke(command, ['-h'])
+        threads = [threading.Thread(target=work) for n in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    try:
+        print('{:>12}  {:>14.0f} invocations/min'.format(
+            'subprocess', 60e6 / timePerCall(
+                lambda: subprocess.check_call([sys.executable, tool, '-h'],
+                                              env=env), 3)))
+        print('{:>12}  {:>14.0f} invocations/min'.format(
+            'invoke', 60e6 / timePerCall(lambda: invoke(command, ['-h']),
+                                         1000)))
+        for count in (1, 8):
+            print('{:>12}  {:>14.0f} invocations/min'.format(
+                '{} threads'.format(count),
+                60e6 * 1000 / timePerCall(lambda: threaded(count), 1)))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def bench_repl():
+    '''Time per command: separate processes vs. lines in pycommand.repl'''
+    import io
+    from pycommand.repl import Repl
+    tmpdir = tempfile.mkdtemp()
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(
+        os.path.abspath(__file__)))
+    tool = os.path.join(tmpdir, 'benchtool.py')
+    with open(tool, 'w') as script:
+        script.write(SERVER_TOOL)
+    namespace = {}
+    exec(SERVER_TOOL.replace("__name__ == '__main__'", 'False'), namespace)
+    command = namespace['Main']
+
+    def session(lines):
+        Repl(command, stdin=io.StringIO('-h\n' * lines),
+             stdout=io.StringIO()).loop()
+    try:
+        print('{:>12}  {:>10.3f} ms per command'.format(
+            'subprocess', timePerCall(
+                lambda: subprocess.check_call([sys.executable, tool, '-h'],
+                                              env=env), 3) / 1e3))
+        print('{:>12}  {:>10.3f} ms per command'.format(
+            'repl line', timePerCall(lambda: session(1000), 1) / 1e6))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def bench_argfiles():
+    '''Streaming 1M paths from an @argfile vs. reading the whole list'''
+    import tracemalloc
+    import pycommand
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, 'args')
+    with open(path, 'w') as argfile:
+        for n in range(1000000):
+            argfile.write('src/package{}/module{}.py\0'.format(n % 97, n))
+
+    class Command(pycommand.CommandBase):
+        argFiles = True
+
+    def stream():
+        for arg in Command(['@' + path]).iterArgs():
+            pass
+
+    def readAll():
+        with open(path) as argfile:
+            for arg in argfile.read().split('\0'):
+                pass
+
+    def first():
+        next(Command(['@' + path]).iterArgs())
+    try:
+        print('{:>10}  {:>12}  {:>12}  {:>14}'.format(
+            '', 'total ms', 'first ms', 'peak memory'))
+        for name, func, start in (('stream', stream, first),
+                                  ('read all', readAll, readAll)):
+            total = timePerCall(func, 1) / 1e3
+            tracemalloc.start()
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print('{:>10}  {:>12.1f}  {:>12.3f}  {:>11.1f} MB'.format(
+                name, total, timePerCall(start, 1) / 1e3, peak / 1e6))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def bench_typed():
+    '''Converting option values in run() vs. once while parsing'''
+    import pycommand
+    from pycommand.converters import converters
+    argv = ['--size=64k', '--timeout=1m30s', '--ports=80,443,8080']
+    raw = (
+        ('size', ('', '<size>', 'size')),
+        ('timeout', ('', '<time>', 'timeout')),
+        ('ports', ('', '<ports>', 'ports')),
+    )
+
+    class Raw(pycommand.CommandBase):
+        optionList = raw
+
+    class Typed(pycommand.CommandBase):
+        optionList = tuple((flag, val + ({'type': name}, ))
+                           for (flag, val), name in zip(
+                               raw, ('bytes', 'duration', 'list')))
+
+    def rawLoop():
+        flags = Raw(argv).flags
+        for n in range(1000):
+            converters['bytes'](flags.size)
+            converters['duration'](flags.timeout)
+            converters['list'](flags.ports)
+
+    def typedLoop():
+        flags = Typed(argv).flags
+        for n in range(1000):
+            flags.size, flags.timeout, flags.ports
+
+    print('{:>8}  {:>10}  {:>20}'.format('', 'parse (us)',
+                                         '1000 reads (us)'))
+    for name, command, loop in (('raw', Raw, rawLoop),
+                                ('typed', Typed, typedLoop)):
+        print('{:>8}  {:>10.2f}  {:>20.1f}'.format(
+            name, timePerCall(lambda: command(argv), 10000),
+            timePerCall(loop, 20)))
+
+
+def bench_init_manifest():
+    '''Generating 1000 scripts from a manifest with init --manifest'''
+    import io
+    import json
+    from pycommand import util
+    tmpdir = tempfile.mkdtemp()
+    manifest = os.path.join(tmpdir, 'tools.json')
+    with open(manifest, 'w') as output:
+        json.dump([{'name': 'tool{}'.format(n), 'template': n % 4 + 1,
+                    'options': ['verbose v - more output',
+                                'file f <file> use <file>']}
+                   for n in range(1000)], output)
+
+    def generate(jobs):
+        util.PycommandGenerator(['-f', '-j', str(jobs), '-m', manifest,
+                                 '-o', os.path.join(tmpdir, 'out')],
+                                ).run()
+    try:
+        for jobs in (1, 2, 4, 8):
+            stdout = sys.stdout
+            sys.stdout = io.StringIO()
+            try:
+                msec = timePerCall(lambda: generate(jobs), 1) / 1e3
+            finally:
+                sys.stdout = stdout
+            print('{:>2} jobs  {:>8.1f} ms for 1000 scripts'.format(
+                jobs, msec))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def bench_bundle():
+    '''Cold start without __pycache__: script vs. pycommand bundle'''
+    import pycommand
+    from pycommand.bundle import build
+    from pycommand.manifest import renderScript
+    tmpdir = tempfile.mkdtemp()
+    script = os.path.join(tmpdir, 'benchtool')
+    with open(script, 'w') as output:
+        output.write(renderScript({'name': 'benchtool', 'template': 4}))
+    bundle = os.path.join(tmpdir, 'benchtool.pyz')
+    snapshot = os.path.join(tmpdir, 'snapshot.pyz')
+    build(script, bundle, sys.executable)
+    build(script, snapshot, sys.executable, snapshot=True)
+    # Like a fresh container: the program and pycommand are installed
+    # without __pycache__ and no bytecode can be written
+    shutil.copytree(os.path.dirname(os.path.abspath(pycommand.__file__)),
+                    os.path.join(tmpdir, 'pycommand'),
+                    ignore=shutil.ignore_patterns('__pycache__'))
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1', PYTHONPATH=tmpdir)
+    try:
+        for name, cmdline in (
+                ('script', [sys.executable, script, 'version']),
+                ('bundle', [sys.executable, bundle, 'version']),
+                ('snapshot', [sys.executable, snapshot, 'version']),
+                ('bare python', [sys.executable, '-c', 'pass']),
+        ):
+            msec = timePerCall(lambda: subprocess.check_call(
+                cmdline, env=env, stdout=subprocess.DEVNULL), 5) / 1e3
+            print('{:>12}  {:>8.1f} ms'.format(name, msec))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def bench_compiled():
+    '''Generic parser vs. parser generated by python -m pycommand compile'''
+    from pycommand.compiler import moduleSource
+    print('{:>8}  {:>14}  {:>14}'.format('options', 'generic (us)',
+                                         'compiled (us)'))
+    for size in (6, 20, 100):
+        command = makeCommand(size)
+        namespace = {}
+        exec(moduleSource([command], __name__), namespace)
+        parse = namespace['parse0']
+        spec = pycommand.CommandSpec(command)
+        argv = ['--option-0', '--option-1', 'x',
+                '--option-{}=y'.format(size - 1), 'a', 'b']
+        assert pycommand.CommandSpec.parse(spec, argv)[2] is None
+        print('{:>8}  {:>14.2f}  {:>14.2f}'.format(
+            size,
+            timePerCall(lambda: pycommand.CommandSpec.parse(spec, argv),
+                        20000),
+            timePerCall(lambda: parse(spec, argv), 20000)))
+
+
+def bench_execute_threads():
+    '''Throughput of pycommand.execute from many threads'''
+    import io
+    import threading
+
+    class Leaf(pycommand.CommandBase):
+        optionList = (('times', ('t', '<n>', '')), )
+
+        def run(self):
+            print(' '.join(self.args), file=self.stdout)
+            return 0
+
+    class Root(pycommand.CommandBase):
+        optionList = (('name', ('n', '<name>', '')), )
+        commands = {'leaf': Leaf}
+
+        def run(self):
+            return super(Root, self).run().run()
+
+    argv = ['-n', 'name', 'leaf', '-t', '2', 'arg']
+
+    def work():
+        for n in range(2000):
+            pycommand.execute(Root, argv, io.StringIO())
+
+    def threaded(count):
+        threads = [threading.Thread(target=work) for n in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    print('{:>8}  {:>14}'.format('threads', 'executions/s'))
+    for count in (1, 2, 4, 8, 32):
+        usec = timePerCall(lambda: threaded(count), 1)
+        print('{:>8}  {:>14.0f}'.format(count, count * 2000 / usec * 1e6))
+
+
+def isRegression(old, new, threshold):
+    '''Check if `new` is slower than `old` by more than `threshold`
+    percent and by more than `NOISE_FLOOR` microseconds'''
+    return new - old > max(old * threshold / 100, NOISE_FLOOR)
+
+
+def runSilently(benchmarks):
+    '''Run `benchmarks` to record their metrics, without output'''
+    stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+        for name in benchmarks:
+            globals()['bench_' + name]()
+    finally:
+        sys.stdout = stdout
+
+
+def compare(baseline, threshold):
+    '''Print the change of the results vs. `baseline`
+
+    Returns the names of the metrics that are regressions, see
+    `isRegression`.
+
+    :Parameters:
+        - `baseline`: Dict of metric name -> time in microseconds
+        - `threshold`: Float. Allowed slowdown in percent
+    '''
+    regressions = []
+    print('{:<32}  {:>14}  {:>14}  {:>8}'.format(
+        'metric', 'baseline (us)', 'current (us)', 'change'))
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        old, new = baseline[name], results[name]
+        change = (new - old) / old * 100 if old else 0.0
+        line = '{:<32}  {:>14.2f}  {:>14.2f}  {:>+7.1f}%'.format(
+            name, old, new, change)
+        if isRegression(old, new, threshold):
+            regressions.append(name)
+            line += '  regression'
+        print(line)
+    return regressions
+
+
+class Main(pycommand.CommandBase):
+    usagestr = 'usage: python bench.py [options] [<benchmark>...]'
+    description = 'Run the benchmarks of pycommand, or only <benchmark>...'
+    optionList = (
+        ('help', ('h', False, 'show this help information')),
+        ('list', ('l', False, 'list the benchmarks')),
+        ('save', ('s', '<file>', 'save the metrics as JSON baseline')),
+        ('compare', ('c', '<file>', 'compare the metrics with a baseline')),
+        ('threshold', ('t', '<percent>',
+                       'allowed slowdown [default: 25]', {'type': 'float'})),
+        ('repeat', ('r', '<n>', 'keep the best of n runs [default: 3]',
+                    {'type': 'int'})),
+    )
+
+    def run(self):
+        import json
+        if self.flags.help:
+            print(self.usage, file=self.stdout)
+            return 0
+        benchmarks = sorted(name[6:] for name in globals()
+                            if name.startswith('bench_'))
+        if self.flags.list:
+            for name in benchmarks:
+                print('{:<18}  {}'.format(
+                    name, globals()['bench_' + name].__doc__),
+                    file=self.stdout)
+            return 0
+        for name in self.args:
+            if name not in benchmarks:
+                print('error: benchmark {} does not exist'.format(name),
+                      file=self.stdout)
+                return 1
+        baseline = None
+        if self.flags.compare:
+            try:
+                with open(self.flags.compare) as stream:
+                    baseline = json.load(stream)
+            except (IOError, OSError, ValueError) as e:
+                print('error: cannot read baseline {}: {}'.format(
+                    self.flags.compare, e), file=self.stdout)
+                return 1
+            if baseline.get('python') != sys.version.split()[0]:
+                print('warning: baseline is of Python {}'.format(
+                    baseline.get('python')), file=self.stdout)
+
+        repeat = self.flags.repeat
+        if repeat is None:
+            repeat = 3 if self.flags.save or self.flags.compare else 1
+        for name in self.args or benchmarks:
+            print('## {}'.format(name), file=self.stdout)
+            globals()['bench_' + name]()
+            print('', file=self.stdout)
+        for run in range(1, repeat):
+            print('run {} of {}'.format(run + 1, repeat), file=self.stdout)
+            runSilently(self.args or benchmarks)
+
+        if self.flags.save:
+            with open(self.flags.save, 'w') as stream:
+                json.dump({
+                    'python': sys.version.split()[0],
+                    'pycommand': pycommand.__version__,
+                    'results': results,
+                }, stream, indent=2, sort_keys=True)
+        if baseline is not None:
+            threshold = self.flags.threshold
+            if threshold is None:
+                threshold = 25.0
+            # Noise of a busy machine comes in bursts, so benchmarks with
+            # slower metrics are run again later to confirm them
+            for run in range(repeat):
+                slower = sorted(set(
+                    name.split('/')[0] for name in results
+                    if name in baseline['results'] and isRegression(
+                        baseline['results'][name], results[name],
+                        threshold)))
+                if not slower:
+                    break
+                print('confirming {}'.format(' '.join(slower)),
+                      file=self.stdout)
+                runSilently(slower)
+            print('', file=self.stdout)
+            regressions = compare(baseline['results'], threshold)
+            if regressions:
+                print('\nerror: {} of the metrics are slower than the '
+                      'baseline by more than {:g}%'.format(
+                          len(regressions), threshold),
+                      file=self.stdout)
+                return 1
+        return 0
+
+
+if __name__ == '__main__':
+    pycommand.run_and_exit(Main)
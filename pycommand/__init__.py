@@ -22,11 +22,44 @@ __copyright__ = "Copyright (C) 2013-2016, 2018  Benjamin Althues"
 __version_info__ = (0, 4, 0, 'final', 0)
 __version__ = '0.4.0'
 
-from pycommand.pycommand import (
-    CommandBase,
-    CommandExit,
-    OptionError,
-    run_and_exit,
+import sys
+
+_exports = (
+    'CommandBase',
+    'CommandExit',
+    'CommandSpec',
+    'OptionError',
+    'awaitResult',
+    'execute',
+    'getEventLoop',
+    'run_and_exit',
 )
 
 __all__ = ('CommandBase', 'run_and_exit')
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        # Import pycommand.pycommand on first use of one of its exports,
+        # so that importing pycommand (e.g. for __version__) is free.
+        if name not in _exports and name != 'pycommand':
+            raise AttributeError("module 'pycommand' has no attribute '{}'"
+                                 .format(name))
+        __import__('pycommand.pycommand')
+        pycommand = sys.modules['pycommand.pycommand']
+        for export in _exports:
+            globals()[export] = getattr(pycommand, export)
+        return globals()[name]
+
+    def __dir__():
+        return sorted(set(globals()) | set(_exports))
+else:
+    from pycommand.pycommand import (  # noqa: F401
+        CommandBase,
+        CommandExit,
+        CommandSpec,
+        OptionError,
+        awaitResult,
+        execute,
+        getEventLoop,
+        run_and_exit,
+    )
@@ -0,0 +1,150 @@
+# Copyright (c) 2013-2016, 2018  Benjamin Althues <benjamin@babab.nl>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+from __future__ import absolute_import, print_function
+
+'''
+Argument files and stdin streaming of positional arguments.
+
+This is used by `CommandBase.iterArgs` for commands that set `argFiles`.
+A positional argument ``@<path>`` is replaced by the arguments in the file
+at `path`, and ``-`` by the arguments read from stdin, so any number of
+arguments can be passed without running into the ``ARG_MAX`` limit of the
+operating system::
+
+    $ find . -name '*.py' > files.txt
+    $ mytool check @files.txt
+    $ find . -name '*.py' -print0 | mytool check -
+
+Arguments are separated by newlines, or by NUL characters as written by
+``find -print0`` and ``xargs -0``. The separator is detected from the
+first block that is read, unless `CommandBase.argSeparator` is set.
+Empty arguments are skipped, and so is the carriage return of a CRLF
+line ending.
+
+Files are read in blocks of `BLOCKSIZE` bytes and arguments are yielded
+as soon as they are complete, so processing can start before a file is
+read completely and memory use does not grow with the number of
+arguments. Bytes are decoded like the operating system arguments in
+`sys.argv` are.
+'''
+
+import codecs
+import io
+import sys
+
+from pycommand.pycommand import CommandExit
+
+BLOCKSIZE = 1 << 16
+'''Number of bytes that are read at once'''
+
+SEPARATORS = ('\n', '\0')
+'''Supported separators of arguments'''
+
+
+def decoder(encoding=None):
+    '''Return an incremental decoder for `encoding`
+
+    Undecodable bytes are escaped like in `sys.argv`. On Python 2,
+    where `sys.argv` holds bytes, None is returned unless an `encoding`
+    is given.
+
+    :Parameters:
+        - `encoding`: String. Encoding of the bytes, or None for the
+          encoding of `sys.argv`
+    '''
+    if sys.version_info[0] < 3:
+        if encoding is None:
+            return None
+        return codecs.getincrementaldecoder(encoding)()
+    if encoding is None:
+        encoding = sys.getfilesystemencoding()
+    return codecs.getincrementaldecoder(encoding)('surrogateescape')
+
+
+def readArgs(stream, separator=None, blocksize=BLOCKSIZE, encoding=None):
+    '''Yield the arguments read from a binary or text stream
+
+    :Parameters:
+        - `stream`: File object to read from
+        - `separator`: String. '\\n' or '\\0', or None to detect it from
+          the first block
+        - `blocksize`: Integer. Number of bytes or characters to read at
+          once
+        - `encoding`: String. Encoding of a binary stream, or None for
+          the encoding of `sys.argv`
+    '''
+    if separator is not None and separator not in SEPARATORS:
+        raise ValueError('separator must be one of {!r}, not {!r}'
+                         .format(SEPARATORS, separator))
+    decode = None
+    remainder = ''
+    while True:
+        block = stream.read(blocksize)
+        if not block:
+            break
+        if isinstance(block, bytes):
+            if decode is None:
+                decode = getattr(decoder(encoding), 'decode', False)
+            if decode:
+                block = decode(block)
+        if separator is None:
+            separator = '\0' if '\0' in block else '\n'
+        args = (remainder + block).split(separator)
+        remainder = args.pop()
+        for arg in args:
+            if separator == '\n' and arg[-1:] == '\r':
+                arg = arg[:-1]
+            if arg:
+                yield arg
+    if decode:
+        remainder += decode(b'', True)
+    if separator == '\n' and remainder[-1:] == '\r':
+        remainder = remainder[:-1]
+    if remainder:
+        yield remainder
+
+
+def stdinStream():
+    '''Return the binary buffer of stdin, or stdin if it has none'''
+    return getattr(sys.stdin, 'buffer', sys.stdin)
+
+
+def iterArgs(command):
+    '''Yield the positional arguments of `command` with files expanded
+
+    Arguments ``@<path>`` and ``-`` are expanded when they are reached.
+    When a file cannot be read, an error is printed and `CommandExit` is
+    raised with exit status 2.
+
+    :Parameters:
+        - `command`: Instance of a `CommandBase` subclass
+    '''
+    separator = command.argSeparator
+    for arg in command.args:
+        if arg == '-':
+            for item in readArgs(stdinStream(), separator):
+                yield item
+        elif arg[:1] == '@' and len(arg) > 1:
+            try:
+                stream = io.open(arg[1:], 'rb')
+            except (IOError, OSError) as e:
+                print('error: cannot read argument file {}: {}'
+                      .format(arg[1:], e.strerror), file=command.stdout)
+                raise CommandExit(2)
+            with stream:
+                for item in readArgs(stream, separator):
+                    yield item
+        else:
+            yield arg
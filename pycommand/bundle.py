@@ -0,0 +1,239 @@
+# Copyright (c) 2013-2016, 2018  Benjamin Althues <benjamin@babab.nl>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+from __future__ import absolute_import
+
+'''
+Single file bundles of pycommand programs.
+
+`build` packs a command script, pycommand and every module that the
+script and its subcommands import (except for the standard library)
+into an executable zip file, like `zipapp` does::
+
+    $ python -m pycommand bundle -o mytool.pyz --snapshot mytool
+    $ ./mytool.pyz --help
+
+The bundle only contains bytecode, so a program never compiles source
+code when it starts, not even in a fresh container without writable
+``__pycache__`` directories. Modules are stored uncompressed, so that
+`zlib` is not imported, in the order in which they were imported when
+the bundle was built.
+
+With a snapshot, the compiled `CommandSpec` and usage text of every
+command of the tree are stored in the bundle as well, and loaded instead
+of being compiled. See `pycommand.cache`.
+
+The bytecode only works with the minor version of Python that built the
+bundle, which is why the default interpreter of the bundle is
+``python<major>.<minor>``. Modules that are not pure Python, such as C
+extensions, cannot be imported from a zip file and are left out, so
+they must be installed where the bundle runs.
+
+Bundles require Python 3.4 or later.
+'''
+
+import sys
+
+SCRIPT = '__pycommand_script__'
+'''Module name of the command script in a bundle'''
+
+SNAPSHOT = 'pycommand.snapshot'
+'''Name of the snapshot of compiled specs in a bundle'''
+
+BOOTSTRAP = '''from pycommand.bundle import run
+run(__loader__)
+'''
+'''Source of the ``__main__`` module of a bundle'''
+
+
+def run(loader):
+    '''Load the snapshot of a bundle, if any, and run its script
+
+    The script runs in the namespace of the ``__main__`` module.
+
+    :Parameters:
+        - `loader`: The zipimporter of the bundle
+    '''
+    from pycommand.pycommand import CommandSpec
+    if CommandSpec.cache is None:
+        try:
+            data = loader.get_data(SNAPSHOT)
+        except (IOError, OSError):
+            data = None
+        if data is not None:
+            from pycommand.cache import SpecCache, loadEntries
+            CommandSpec.cache = SpecCache(None, loadEntries(data))
+    code = loader.get_code(SCRIPT)
+    exec(code, sys.modules['__main__'].__dict__)
+
+
+def bytecode(source, path):
+    '''Return the contents of a .pyc file for `source`
+
+    The file is marked as unchecked, so that it is used without looking
+    for its source file (Python 3.7 and later).
+
+    :Parameters:
+        - `source`: Bytes of the source code
+        - `path`: String. File name that tracebacks show
+    '''
+    import importlib.util
+    import marshal
+    import struct
+    code = compile(source, path, 'exec', dont_inherit=True)
+    if hasattr(importlib.util, 'source_hash'):
+        header = struct.pack('<I', 0b01) + importlib.util.source_hash(source)
+    else:
+        header = struct.pack('<II', 0, len(source) & 0xFFFFFFFF)
+    return importlib.util.MAGIC_NUMBER + header + marshal.dumps(code)
+
+
+def isStandardLibrary(path):
+    '''Check if `path` is a module of the standard library'''
+    import os
+    import sysconfig
+    paths = sysconfig.get_paths()
+    path = os.path.realpath(path)
+
+    def within(name):
+        directory = os.path.realpath(paths[name])
+        return path.startswith(directory + os.sep)
+    if within('purelib') or within('platlib'):
+        return False
+    return within('stdlib') or within('platstdlib')
+
+
+def archiveName(name, path):
+    '''Return the path of the .pyc of a module in a bundle
+
+    :Parameters:
+        - `name`: String. Name of the module
+        - `path`: String. Path of the source of the module
+    '''
+    import os
+    name = name.replace('.', '/')
+    if os.path.basename(path) == '__init__.py':
+        name += '/__init__'
+    return name + '.pyc'
+
+
+def loadScript(script):
+    '''Run a command script as module and return its namespace
+
+    The script runs with a name other than ``'__main__'``, so it only
+    defines its commands. Its directory is added to `sys.path`, like
+    when the script runs.
+
+    :Parameters:
+        - `script`: String. Path of the script
+    '''
+    import os
+    import types
+    module = types.ModuleType(SCRIPT)
+    module.__file__ = script
+    sys.modules[SCRIPT] = module
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    with open(script, 'rb') as source:
+        exec(compile(source.read(), script, 'exec'), module.__dict__)
+    return module
+
+
+def build(script, output, python=None, snapshot=False):
+    '''Bundle a command script and the modules it uses
+
+    All `CommandBase` subclasses that the script defines are warmed with
+    `pycommand.cache.warm`, so that subcommands given as import paths
+    are imported and bundled too.
+
+    :Parameters:
+        - `script`: String. Path of the command script
+        - `output`: String. Path of the bundle to write
+        - `python`: String. Interpreter of the bundle, used in its ``#!``
+          line. Defaults to ``/usr/bin/env python<major>.<minor>``.
+        - `snapshot`: Bool. Store the compiled specs of all commands
+
+    Returns a tuple of (list of bundled module names, list of skipped
+    module names).
+    '''
+    import os
+    import stat
+    import zipfile
+    import pycommand
+    from pycommand import cache
+    from pycommand.pycommand import CommandBase, CommandSpec
+
+    before = set(sys.modules)
+    previousCache = CommandSpec.cache
+    CommandSpec.cache = specCache = cache.SpecCache(None, {})
+    try:
+        module = loadScript(script)
+        commands = [value for value in vars(module).values()
+                    if isinstance(value, type)
+                    and issubclass(value, CommandBase)
+                    and value.__module__ == SCRIPT]
+        for command in commands:
+            cache.warm(command)
+    finally:
+        CommandSpec.cache = previousCache
+        del sys.modules[SCRIPT]
+        sys.path.pop(0)
+
+    # pycommand itself is included as a whole, because it imports most
+    # of its modules on first use. Modules are stored in the order in
+    # which a bundle imports them: the modules of `run`, the modules
+    # imported by the script and then the rest of pycommand.
+    package = os.path.dirname(os.path.abspath(pycommand.__file__))
+    rest = dict(('pycommand.' + name[:-3], os.path.join(package, name))
+                for name in os.listdir(package) if name.endswith('.py')
+                and name not in ('__init__.py', '__main__.py'))
+    modules = [('pycommand', os.path.join(package, '__init__.py'))]
+    modules += [(name, rest.pop(name)) for name in
+                ('pycommand.pycommand', 'pycommand.bundle', 'pycommand.cache')]
+    skipped = []
+    for name in list(sys.modules):
+        path = getattr(sys.modules[name], '__file__', None)
+        if name in rest and name not in before:
+            modules.append((name, rest.pop(name)))
+        elif (name in before or name == SCRIPT or path is None
+                or name.split('.')[0] == 'pycommand'
+                or isStandardLibrary(path)):
+            continue
+        elif path.endswith('.py'):
+            modules.append((name, path))
+        else:
+            skipped.append(name)
+    modules += sorted(rest.items())
+
+    if python is None:
+        python = '/usr/bin/env python{}.{}'.format(*sys.version_info[:2])
+    with open(output, 'wb') as bundle:
+        bundle.write('#!{}\n'.format(python).encode('utf-8'))
+        with zipfile.ZipFile(bundle, 'w', zipfile.ZIP_STORED) as archive:
+            archive.writestr('__main__.pyc', bytecode(
+                BOOTSTRAP.encode('utf-8'), '__main__.py'))
+            with open(script, 'rb') as source:
+                archive.writestr(SCRIPT + '.pyc', bytecode(
+                    source.read(), os.path.basename(script)))
+            for name, path in modules:
+                with open(path, 'rb') as source:
+                    archive.writestr(archiveName(name, path),
+                                     bytecode(source.read(), path))
+            if snapshot:
+                entries = dict(
+                    (key.replace(SCRIPT + ':', '__main__:', 1), entry)
+                    for key, entry in specCache.collect().items())
+                archive.writestr(SNAPSHOT, cache.dumpEntries(entries))
+    os.chmod(output, os.stat(output).st_mode | stat.S_IXUSR | stat.S_IXGRP
+             | stat.S_IXOTH)
+    return [name for name, path in modules], skipped
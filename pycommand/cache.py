@@ -0,0 +1,222 @@
+# Copyright (c) 2013-2016, 2018  Benjamin Althues <benjamin@babab.nl>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+from __future__ import absolute_import
+
+'''
+Persistent on-disk cache of compiled command specs.
+
+The cache is opt-in. Enable it by setting the ``PYCOMMAND_CACHE``
+environment variable to the path of a cache file, or by calling
+`enable` before the first command is instantiated::
+
+    import pycommand.cache
+    pycommand.cache.enable('/var/cache/mytool/pycommand.cache')
+
+The option tables and rendered usage of every command that is used by
+the process are written to the file with `marshal` when the interpreter
+exits. On the next start they are loaded instead of being compiled.
+
+Each entry stores the class attributes it was compiled from. An entry
+is only used when these are still equal to the attributes of the class,
+so changed commands are recompiled automatically. The whole file is
+discarded when it was written by another version of pycommand or
+Python.
+'''
+
+import atexit
+import marshal
+import os
+import sys
+
+from pycommand.pycommand import (
+    CommandSpec,
+    __version__,
+)
+
+MAGIC = 'pycommand-cache-1'
+'''String. Identifies the file format of the cache'''
+
+
+def fileVersion():
+    '''Return the versions that cache files are only valid for'''
+    return (MAGIC, __version__, tuple(sys.version_info[:2]),
+            marshal.version)
+
+
+def commandName(command_class):
+    '''Return the name of the entry of `command_class` in the cache'''
+    return '{}:{}'.format(command_class.__module__,
+                          getattr(command_class, '__qualname__',
+                                  command_class.__name__))
+
+
+def sourceKey(command_class):
+    '''Return the definition of `command_class` in marshallable form
+
+    :Parameters:
+        - `command_class`: A `CommandBase` subclass
+    '''
+    sources = list(CommandSpec.sourcesOf(command_class))
+    optionList = sources[CommandSpec.sourceAttributes.index('optionList')]
+    if isinstance(optionList, dict):
+        optionList = optionList.items()
+    sources[CommandSpec.sourceAttributes.index('optionList')] = tuple(
+        (flag, tuple(val)) for flag, val in optionList
+    )
+    runItem = CommandSpec.sourceAttributes.index('runItem')
+    sources[runItem] = sources[runItem] is not None
+    return tuple(sources)
+
+
+def dumpEntries(entries):
+    '''Return cache entries in the format of cache files'''
+    return marshal.dumps((fileVersion(), entries))
+
+
+def loadEntries(data):
+    '''Return the entries of cache file data, or an empty dict when the
+    data is invalid or written by another version'''
+    try:
+        version, entries = marshal.loads(data)
+    except (EOFError, ValueError, TypeError):
+        return {}
+    if version != fileVersion() or not isinstance(entries, dict):
+        return {}
+    return entries
+
+
+class SpecCache(object):
+    '''Cache of compiled specs, stored in a single file
+
+    :Parameters:
+        - `path`: String. Path of the cache file, or None for a cache
+          that is never saved
+        - `entries`: Dict of entries to use instead of reading `path`
+    '''
+
+    def __init__(self, path, entries=None):
+        self.path = path
+        '''String. Path of the cache file'''
+
+        self.entries = self.read() if entries is None else entries
+        '''Dict of command name -> (source key, dumped spec) from file'''
+
+        self.specs = {}
+        '''Dict of command name -> (source key, spec) used by the process'''
+
+    def read(self):
+        '''Return the entries of the cache file, or an empty dict'''
+        if self.path is None:
+            return {}
+        try:
+            with open(self.path, 'rb') as cachefile:
+                return loadEntries(cachefile.read())
+        except (IOError, OSError):
+            return {}
+
+    def getSpec(self, command_class):
+        '''Load the spec of `command_class`, or compile it when stale
+
+        :Parameters:
+            - `command_class`: A `CommandBase` subclass
+        '''
+        name = commandName(command_class)
+        key = sourceKey(command_class)
+        entry = self.entries.get(name)
+        if entry is not None and entry[0] == key:
+            spec = CommandSpec.fromDump(command_class, entry[1])
+        else:
+            spec = CommandSpec(command_class)
+        self.specs[name] = (key, spec)
+        return spec
+
+    def collect(self):
+        '''Return the entries of the file and of all used specs
+
+        Specs that cannot be marshalled are left out.
+        '''
+        entries = dict(self.entries)
+        for name, (key, spec) in self.specs.items():
+            entry = (key, spec.dump())
+            try:
+                marshal.dumps(entry)
+            except ValueError:
+                continue
+            entries[name] = entry
+        return entries
+
+    def save(self):
+        '''Write the cache file if any of the used specs changed
+
+        The file is replaced atomically, so concurrent processes never
+        read a partially written cache.
+        '''
+        entries = self.collect()
+        if self.path is None or entries == self.entries:
+            return False
+
+        import tempfile
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            fd, tmppath = tempfile.mkstemp(dir=directory,
+                                           prefix='.pycommand-cache-')
+        except (IOError, OSError):
+            return False
+        try:
+            with os.fdopen(fd, 'wb') as cachefile:
+                cachefile.write(dumpEntries(entries))
+            getattr(os, 'replace', os.rename)(tmppath, self.path)
+        except (IOError, OSError):
+            os.unlink(tmppath)
+            return False
+        self.entries = entries
+        return True
+
+
+def enable(path):
+    '''Use the cache file at `path` for compiling command specs
+
+    The cache is saved when the interpreter exits.
+
+    :Parameters:
+        - `path`: String. Path of the cache file
+    '''
+    CommandSpec.cache = SpecCache(path)
+    atexit.register(CommandSpec.cache.save)
+    return CommandSpec.cache
+
+
+def disable():
+    '''Save the current cache, if any, and stop using it'''
+    if CommandSpec.cache is not None:
+        CommandSpec.cache.save()
+        CommandSpec.cache = None
+
+
+def warm(command_class):
+    '''Compile the specs and usage of a whole command tree
+
+    Subcommands given as import paths are imported, so that the cache
+    holds every command of the tree after the next `SpecCache.save`.
+
+    :Parameters:
+        - `command_class`: The main `CommandBase` subclass of the tree
+    '''
+    seen = set()
+    for path, command in command_class.iterCommandTree():
+        if command not in seen:
+            seen.add(command)
+            command.getSpec().usage
+    return len(seen)
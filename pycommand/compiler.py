@@ -0,0 +1,244 @@
+# Copyright (c) 2013-2016, 2018  Benjamin Althues <benjamin@babab.nl>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+from __future__ import absolute_import
+
+'''
+Generated parsers that are specialized to the options of a command.
+
+``python -m pycommand compile mytool.cli:MainCommand`` generates a
+parser function for every command of the tree, with the options of the
+command written out as comparisons, and writes them to a module next to
+the module of the commands (``mytool/cli_pycommand.py``, see
+`pycommand.pycommand.compiledModule`). The rendered usage text is
+stored as well.
+
+The parsers are used automatically when a `CommandSpec` is compiled,
+but only while they are up to date: when they were generated by the
+same version of pycommand, for the same `usagestr`, `description`,
+`optionList` and `usageTextExtra`. Otherwise they are ignored, so
+forgetting to run ``compile`` after changing a command only makes
+parsing slower.
+
+A generated parser handles the usual forms of options: ``--long``,
+``--long=value``, ``--long value``, ``-s``, ``-svalue`` and ``-s value``.
+Anything else, such as clustered short options, abbreviated long
+options and all errors, is handed to `CommandSpec.parse`, which starts
+over. So a generated parser always returns the same flags, arguments
+and error as the generic parser.
+'''
+
+import os
+
+from pycommand.pycommand import (
+    CommandSpec,
+    __version__,
+    compiledModule,
+)
+
+HEADER = '''# Parsers of {source}
+# Generated by python -m pycommand compile. Do not edit.
+
+from pycommand.pycommand import CommandSpec
+
+fallback = CommandSpec.parse
+version = {version!r}
+'''
+
+
+def commandTree(command_class):
+    '''Return all commands of a tree, importing subcommands if needed'''
+    commands = []
+    for path, command in command_class.iterCommandTree():
+        if command not in commands:
+            commands.append(command)
+    return commands
+
+
+def sourceRepr(command_class):
+    '''Return the source key of a command as Python source
+
+    Raises ValueError when the key cannot be written as source, e.g.
+    for options with a callable as type.
+    '''
+    from pycommand.cache import sourceKey
+    key = sourceKey(command_class)
+    text = repr(key)
+    try:
+        equal = eval(text, {}) == key
+    except Exception:
+        equal = False
+    if not equal:
+        raise ValueError('{} cannot be compiled: its options cannot be '
+                         'written as source'.format(command_class.__name__))
+    return text
+
+
+def branches(leaves, indent):
+    '''Return lines of a balanced if-tree that selects a leaf by `code`
+
+    :Parameters:
+        - `leaves`: List of (code, lines) sorted by code
+        - `indent`: String. Indentation of the tree
+    '''
+    if len(leaves) == 1:
+        return [indent + line for line in leaves[0][1]]
+    middle = len(leaves) // 2
+    return (['{}if code < {}:'.format(indent, leaves[middle][0])]
+            + branches(leaves[:middle], indent + '    ')
+            + ['{}else:'.format(indent)]
+            + branches(leaves[middle:], indent + '    '))
+
+
+def parserSource(spec, name):
+    '''Return the source of a specialized parser function
+
+    Options are looked up in two dicts that are generated with the
+    function: one of the exact arguments like ``--file`` and ``-f``, and
+    one of the options that take an argument, for ``--file=<value>`` and
+    ``-f<value>``. Both map to a number that selects the code of the
+    option in a balanced tree of comparisons.
+
+    :Parameters:
+        - `spec`: `CommandSpec` to generate the parser for
+        - `name`: String. Name of the function
+    '''
+    slots = spec.flagsClass._slots
+    converters = spec.converters
+
+    def store(flag, value):
+        if flag in converters:
+            return 'storeValue(flags, {!r}, {})'.format(flag, value)
+        return 'flags.{} = {}'.format(slots[flag], value)
+
+    exact = {}
+    joined = {}
+    leaves = []
+    for flag, hasArg in sorted(spec.longIndex.values()):
+        code = len(leaves)
+        exact['--' + flag] = code
+        for opt, target in sorted(spec.shortIndex.items()):
+            if target[0] == flag and opt != '-':
+                exact['-' + opt] = code
+                if hasArg:
+                    joined['-' + opt] = code + 1
+        if hasArg:
+            joined['--' + flag] = code + 1
+            leaves.append((code, [
+                'if i == argc:',
+                '    return fallback(spec, argv, start)',
+                store(flag, 'argv[i]'),
+                'i += 1',
+            ]))
+            leaves.append((code + 1, [store(flag, 'value')]))
+        else:
+            leaves.append((code, [store(flag, 'True')]))
+
+    lines = [
+        '{}_exact = {!r}'.format(name, exact),
+        '{}_joined = {!r}'.format(name, joined),
+        '',
+        '',
+        'def {}(spec, argv, start=0, exact={}_exact, joined={}_joined):'
+        .format(name, name, name),
+        '    flags = spec.flagsClass()',
+    ]
+    if converters:
+        lines.append('    storeValue = spec.storeValue')
+    lines += [
+        '    argc = len(argv)',
+        '    i = start',
+        '    try:',
+        '        while i < argc:',
+        '            arg = argv[i]',
+        "            if arg[:1] != '-' or arg == '-':",
+        '                break',
+        '            i += 1',
+        "            if arg == '--':",
+        '                break',
+        '            code = exact.get(arg)',
+        '            if code is None:',
+        "                if arg[1] == '-':",
+        "                    opt, sep, value = arg.partition('=')",
+        '                    if sep:',
+        '                        code = joined.get(opt)',
+        '                else:',
+        '                    code = joined.get(arg[:2])',
+        '                    value = arg[2:]',
+        '                if code is None:',
+        '                    return fallback(spec, argv, start)',
+    ]
+    if leaves:
+        lines += branches(leaves, '            ')
+    lines += [
+        '    except Exception:',
+        '        return fallback(spec, argv, start)',
+        '    return flags, argv[i:], None',
+    ]
+    return '\n'.join(lines) + '\n'
+
+
+def moduleSource(commands, source):
+    '''Return the source of a module with parsers for `commands`
+
+    :Parameters:
+        - `commands`: List of command classes of the same module
+        - `source`: String. Name of the module, for the header
+    '''
+    parts = [HEADER.format(source=source, version=__version__)]
+    entries = []
+    for n, command in enumerate(commands):
+        spec = CommandSpec(command)
+        name = 'parse{}'.format(n)
+        parts.append('\n' + parserSource(spec, name))
+        entries.append('    {!r}: (\n        {},\n        {},\n        {!r},'
+                       '\n    ),\n'.format(
+                           getattr(command, '__qualname__', command.__name__),
+                           sourceRepr(command), name, spec.usage))
+    parts.append('\nparsers = {\n' + ''.join(entries) + '}\n')
+    return '\n'.join(parts)
+
+
+def generate(command_class, modules=None):
+    '''Write the parser modules for a command tree
+
+    One module is written for every module that defines commands of the
+    tree. Modules that are not importable as files are left out.
+
+    :Parameters:
+        - `command_class`: The main `CommandBase` subclass
+        - `modules`: Dict of module name -> module object, used instead of
+          `sys.modules`, e.g. for a script that was not imported by name
+
+    Returns a list of the paths that were written.
+    '''
+    import sys
+    modules = modules or {}
+    byModule = {}
+    for command in commandTree(command_class):
+        byModule.setdefault(command.__module__, []).append(command)
+
+    written = []
+    for moduleName, commands in byModule.items():
+        module = modules.get(moduleName) or sys.modules.get(moduleName)
+        if not getattr(module, '__file__', None):
+            continue
+        path = compiledModule(module)[0]
+        text = moduleSource(commands, moduleName)
+        tmppath = path + '.tmp'
+        with open(tmppath, 'w') as output:
+            output.write(text)
+        getattr(os, 'replace', os.rename)(tmppath, path)
+        written.append(path)
+    return written
@@ -0,0 +1,416 @@
+# Copyright (c) 2013-2016, 2018  Benjamin Althues <benjamin@babab.nl>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+from __future__ import absolute_import
+
+'''
+Static shell completion scripts for pycommand programs.
+
+The scripts are generated once from the command tree, so completing a
+command line runs only shell code and never starts Python::
+
+    $ python -m pycommand completion bash mytool.cli:MainCommand \\
+        > /etc/bash_completion.d/mytool
+    $ python -m pycommand completion zsh mytool.cli:MainCommand > _mytool
+    $ python -m pycommand completion fish mytool.cli:MainCommand \\
+        > ~/.config/fish/completions/mytool.fish
+
+Subcommands and options are completed at every level of the tree. The
+arguments of options, and positional arguments of commands without
+subcommands, are completed as file names unless a command defines
+`CommandBase.completers`.
+'''
+
+from pycommand.pycommand import __version__
+
+
+def commandTree(command_class):
+    '''Return a list of (path, command class) of a whole command tree
+
+    `path` is a tuple of subcommand names, which is empty for
+    `command_class`. See `CommandBase.iterCommandTree`.
+
+    :Parameters:
+        - `command_class`: The main `CommandBase` subclass of the tree
+    '''
+    return list(command_class.iterCommandTree())
+
+
+def defaultName(command_class):
+    '''Return the executable name from `usagestr`, or the class name'''
+    words = command_class.usagestr.split()
+    if len(words) > 1 and words[0] == 'usage:':
+        return words[1]
+    return command_class.__name__.lower()
+
+
+def pathKey(path):
+    '''Return the key of a subcommand path in scripts, e.g. /deploy/'''
+    return '/'.join(('', ) + path + ('', ))
+
+
+def identifier(name):
+    '''Return `name` as a shell function name'''
+    return '_' + ''.join(c if c.isalnum() else '_' for c in name)
+
+
+def quote(string):
+    '''Quote `string` for bash and zsh'''
+    return "'" + string.replace("'", "'\\''") + "'"
+
+
+def fishQuote(string):
+    '''Quote `string` for fish'''
+    return "'" + string.replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+
+def options(command):
+    '''Return a list of (flag, short, argument, description) of `command`'''
+    return [(flag, val[0], val[1], val[2])
+            for flag, val in command.getSpec().optionList.items()]
+
+
+def bashCompleter(completer):
+    '''Return bash code that fills COMPREPLY for a completer'''
+    if completer is None:
+        return 'COMPREPLY=($(compgen -f -- "$cur"))'
+    if isinstance(completer, (list, tuple)):
+        return 'COMPREPLY=($(compgen -W {} -- "$cur"))'.format(
+            quote(' '.join(completer)))
+    return 'COMPREPLY=($(compgen -W "$({})" -- "$cur"))'.format(completer)
+
+
+def bashScript(name, command_class):
+    '''Return a bash completion script for `command_class`
+
+    :Parameters:
+        - `name`: String. Name of the executable
+        - `command_class`: The main `CommandBase` subclass of the tree
+    '''
+    tree = commandTree(command_class)
+    function = identifier(name)
+    walk = []
+    values = []
+    words = []
+    for path, command in tree:
+        key = pathKey(path)
+        for flag, short, argument, description in options(command):
+            if not argument:
+                continue
+            patterns = [quote('{} --{}'.format(key, flag))]
+            if short:
+                patterns += [quote('{} -{}'.format(key, short)),
+                             quote('{} -'.format(key)) + "[!-]*" +
+                             quote(short)]
+            walk.append('            {}) arg={} ;;'.format(
+                '|'.join(patterns), quote(flag)))
+            if flag in command.completers:
+                values.append('            {}) {} ;;'.format(
+                    quote(key + flag),
+                    bashCompleter(command.completers[flag])))
+        for sub in sorted(command.commands):
+            walk.append('            {}) path={} ;;'.format(
+                quote('{} {}'.format(key, sub)),
+                quote(pathKey(path + (sub, )))))
+        walk.append('            {}*) ;;'.format(quote(key + ' -')))
+        walk.append('            {}*) path={} ;;'.format(
+            quote(key + ' '), quote(key + '#')))
+
+        flags = []
+        for flag, short, argument, description in options(command):
+            flags += ['-' + short] if short else []
+            flags.append('--{}{}'.format(flag, '=' if argument else ''))
+        if command.commands:
+            positional = 'COMPREPLY=($(compgen -W {} -- "$cur"))'.format(
+                quote(' '.join(sorted(command.commands))))
+        else:
+            positional = bashCompleter(command.completers.get(None))
+        words.append('''\
+        {key})
+            if [[ $cur == -* ]]; then
+                COMPREPLY=($(compgen -W {flags} -- "$cur"))
+            else
+                {positional}
+            fi ;;
+        {keyArgs})
+            {arguments} ;;'''.format(
+            key=quote(key), flags=quote(' '.join(flags)),
+            positional=positional, keyArgs=quote(key + '#'),
+            arguments=bashCompleter(command.completers.get(None))))
+
+    return '''\
+# bash completion for {name}, generated by pycommand {version}
+# Load it with `source <file>`, or install it as a bash-completion file.
+
+{function}() {{
+    local cur=${{COMP_WORDS[COMP_CWORD]}} path=/ arg= word i
+    for ((i = 1; i < COMP_CWORD; i++)); do
+        word=${{COMP_WORDS[i]}}
+        if [[ $word == = ]]; then
+            # --option=value is split at the = sign
+            continue
+        elif [[ -n $arg ]]; then
+            arg=
+            continue
+        fi
+        case "$path $word" in
+{walk}
+        esac
+    done
+    if [[ $cur == = ]]; then
+        cur=
+    fi
+
+    if [[ -n $arg ]]; then
+        case "$path$arg" in
+{values}
+            *) COMPREPLY=($(compgen -f -- "$cur")) ;;
+        esac
+        return 0
+    fi
+    case $path in
+{words}
+    esac
+    if [[ ${{#COMPREPLY[@]}} == 1 && ${{COMPREPLY[0]}} == *= ]]; then
+        compopt -o nospace 2> /dev/null
+    fi
+    return 0
+}}
+
+complete -F {function} -o filenames {name}
+'''.format(name=name, version=__version__, function=function,
+           walk='\n'.join(walk), values='\n'.join(values),
+           words='\n'.join(words))
+
+
+def zshEscape(string):
+    '''Escape `string` for descriptions and messages of `_arguments`'''
+    for char in '\\[]:':
+        string = string.replace(char, '\\' + char)
+    return string
+
+
+def zshCompleter(completer):
+    '''Return the `_arguments` action of a completer'''
+    if completer is None:
+        return '_files'
+    if isinstance(completer, (list, tuple)):
+        return '({})'.format(' '.join(
+            word.replace('\\', '\\\\').replace(' ', '\\ ')
+            for word in completer))
+    return '{{compadd -- ${{(f)"$({})"}}}}'.format(completer)
+
+
+def zshScript(name, command_class):
+    '''Return a zsh completion script for `command_class`
+
+    :Parameters:
+        - `name`: String. Name of the executable
+        - `command_class`: The main `CommandBase` subclass of the tree
+    '''
+    tree = commandTree(command_class)
+    prefix = identifier(name)
+    functions = {}
+    for n, (path, command) in enumerate(tree):
+        functions[path] = '{}_{}'.format(prefix, n)
+
+    definitions = []
+    for path, command in tree:
+        specs = []
+        for flag, short, argument, description in options(command):
+            description = zshEscape(description)
+            action = ''
+            if argument:
+                action = ':{}:{}'.format(
+                    zshEscape(argument),
+                    zshCompleter(command.completers.get(flag)))
+            if short:
+                spec = quote('(-{0} --{1})'.format(short, flag))
+                spec += '{{-{0}{1},--{2}{3}}}'.format(
+                    short, '+' if argument else '', flag,
+                    '=' if argument else '')
+                spec += quote('[{}]{}'.format(description, action))
+            else:
+                spec = quote('--{}{}[{}]{}'.format(
+                    flag, '=' if argument else '', description, action))
+            specs.append(spec)
+
+        if command.commands:
+            specs += [quote('1:command:->command'),
+                      quote('*::argument:->argument')]
+            commands = ' '.join(
+                quote('{}:{}'.format(sub.replace(':', '\\:'),
+                                     description.replace('\n', ' ')))
+                for sub, description in command.commandList())
+            dispatch = '\n'.join(
+                '                {}) {} ;;'.format(
+                    quote(sub), functions[path + (sub, )])
+                for sub in sorted(command.commands)
+                if path + (sub, ) in functions)
+            states = '''
+    case $state in
+        command)
+            local -a commands
+            commands=({commands})
+            _describe command commands ;;
+        argument)
+            case $words[1] in
+{dispatch}
+            esac ;;
+    esac'''.format(commands=commands, dispatch=dispatch)
+        else:
+            specs.append(quote('*:argument:{}'.format(
+                zshCompleter(command.completers.get(None)))))
+            states = ''
+
+        definitions.append('''\
+{function}() {{
+    local context state state_descr line
+    typeset -A opt_args
+    _arguments -s -S \\
+        {specs} && return 0{states}
+}}'''.format(function=functions[path],
+             specs=' \\\n        '.join(specs), states=states))
+
+    return '''\
+#compdef {name}
+# zsh completion for {name}, generated by pycommand {version}
+# Install it as _{name} in a directory of $fpath.
+
+{definitions}
+
+if [[ $funcstack[1] == _{name} ]]; then
+    {main} "$@"
+else
+    compdef {main} {name}
+fi
+'''.format(name=name, version=__version__,
+           definitions='\n\n'.join(definitions), main=functions[()])
+
+
+def fishCompleter(completer):
+    '''Return the arguments of `complete` for a completer'''
+    if completer is None:
+        return '-r'
+    if isinstance(completer, (list, tuple)):
+        return '-x -a {}'.format(fishQuote(' '.join(completer)))
+    command = '(sh -c {})'.format(fishQuote(completer))
+    return '-x -a {}'.format(fishQuote(command))
+
+
+def fishScript(name, command_class):
+    '''Return a fish completion script for `command_class`
+
+    :Parameters:
+        - `name`: String. Name of the executable
+        - `command_class`: The main `CommandBase` subclass of the tree
+    '''
+    tree = commandTree(command_class)
+    function = identifier(name)
+    walk = []
+    completions = []
+    for path, command in tree:
+        key = pathKey(path)
+        condition = fishQuote('{}_at {}'.format(function, key))
+        longs, shorts = [], []
+        for flag, short, argument, description in options(command):
+            if argument:
+                longs.append(fishQuote('{} --{}'.format(key, flag)))
+                if short:
+                    shorts += [fishQuote('{} -{}'.format(key, short)),
+                               fishQuote('{} -*{}'.format(key, short))]
+            line = 'complete -c {} -n {}'.format(name, condition)
+            if short:
+                line += ' -s ' + short
+            line += ' -l {} -d {}'.format(flag, fishQuote(description))
+            if argument:
+                line += ' ' + fishCompleter(command.completers.get(flag))
+            completions.append(line)
+        if longs:
+            walk.append('            case {}\n                set arg 1'
+                        .format(' '.join(longs)))
+        walk.append('            case {}'.format(fishQuote(key + ' --*')))
+        if shorts:
+            walk.append('            case {}\n                set arg 1'
+                        .format(' '.join(shorts)))
+        for sub in sorted(command.commands):
+            walk.append('            case {}\n                set path {}'
+                        .format(fishQuote('{} {}'.format(key, sub)),
+                                fishQuote(pathKey(path + (sub, )))))
+        walk.append('            case {}'.format(fishQuote(key + ' -*')))
+        walk.append('            case {}\n                set path {}'
+                    .format(fishQuote(key + ' *'), fishQuote(key + '#')))
+
+        if command.commands:
+            completions.append('complete -c {} -n {} -f'.format(
+                name, condition))
+            for sub, description in command.commandList():
+                completions.append('complete -c {} -n {} -a {} -d {}'.format(
+                    name, condition, fishQuote(sub),
+                    fishQuote(description.split('\n')[0])))
+        completer = command.completers.get(None)
+        if completer is not None:
+            completions.append('complete -c {} -n {} {}'.format(
+                name, fishQuote('{}_at {} {}'.format(
+                    function, key, key + '#')),
+                fishCompleter(completer)))
+
+    return '''\
+# fish completion for {name}, generated by pycommand {version}
+# Install it as ~/.config/fish/completions/{name}.fish
+
+function {function}_path
+    set -l words (commandline -opc)
+    set -e words[1]
+    set -l path /
+    set -l arg 0
+    for word in $words
+        if test $arg = 1
+            set arg 0
+            continue
+        end
+        switch "$path $word"
+{walk}
+        end
+    end
+    echo $path
+end
+
+function {function}_at
+    contains -- ({function}_path) $argv
+end
+
+complete -c {name} -e
+{completions}
+'''.format(name=name, version=__version__, function=function,
+           walk='\n'.join(walk), completions='\n'.join(completions))
+
+
+shells = {
+    'bash': bashScript,
+    'fish': fishScript,
+    'zsh': zshScript,
+}
+'''Dict of shell name -> function that generates its script'''
+
+
+def generate(shell, command_class, name=None):
+    '''Return the completion script of `command_class` for `shell`
+
+    :Parameters:
+        - `shell`: String. One of the keys of `shells`
+        - `command_class`: The main `CommandBase` subclass of the tree
+        - `name`: String. Name of the executable, see `defaultName`
+    '''
+    return shells[shell](name or defaultName(command_class), command_class)
@@ -0,0 +1,164 @@
+# Copyright (c) 2013-2016, 2018  Benjamin Althues <benjamin@babab.nl>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+from __future__ import absolute_import
+
+'''
+Converters of option values.
+
+An option in `CommandBase.optionList` can declare a type as the 'type'
+key of a dict after its description. Values of the option are then
+converted once while parsing, and an invalid value is reported through
+`CommandBase.error` like any other parse error::
+
+    optionList = (
+        ('jobs', ('j', '<n>', 'number of jobs', {'type': 'int'})),
+        ('timeout', ('', '<time>', 'e.g. 1m30s', {'type': 'duration'})),
+        ('tag', ('t', '<tag>', 'add a tag', {'action': 'append'})),
+        ('verbose', ('v', False, 'more output', {'action': 'count'})),
+    )
+
+A type is the name of a converter in `converters`, or any callable that
+takes the string value and returns the converted value. It raises
+`ValueError` or `TypeError` for invalid values.
+
+The 'action' key sets what happens when an option is given more than
+once. See `actions`.
+'''
+
+actions = ('store', 'append', 'count')
+'''Tuple of accumulate modes of repeated options
+
+    store   Keep the last value (the default)
+    append  Collect all values in a list
+    count   Count how often an option without argument is given
+'''
+
+
+class Duration(object):
+    '''Convert durations like '90', '1.5h', '2m30s' or '250ms' to seconds
+
+    A number without a unit is a number of seconds. Returns a float.
+    '''
+
+    name = 'duration'
+    units = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600, 'd': 86400,
+             'w': 604800}
+
+    def __call__(self, value):
+        text = value.strip().lower()
+        if not text:
+            raise ValueError(value)
+        total = 0.0
+        while text:
+            end = 0
+            while end < len(text) and (text[end].isdigit()
+                                       or text[end] == '.'):
+                end += 1
+            number, text = text[:end], text[end:]
+            end = 0
+            while end < len(text) and text[end].isalpha():
+                end += 1
+            unit, text = text[:end], text[end:]
+            factor = self.units.get(unit or 's')
+            if not number or factor is None:
+                raise ValueError(value)
+            total += float(number) * factor
+        return total
+
+
+class ByteSize(object):
+    '''Convert sizes like '512', '64k', '1.5MiB' or '2GB' to bytes
+
+    The units K, M, G, T and P, with or without 'iB', are powers of
+    1024, like in ``dd`` and ``sort -S``. KB, MB, GB, TB and PB are
+    powers of 1000. Returns an integer.
+    '''
+
+    name = 'bytes'
+    prefixes = 'kmgtp'
+
+    def __call__(self, value):
+        text = value.strip().lower()
+        number = text.rstrip('abcdefghijklmnopqrstuvwxyz')
+        unit = text[len(number):]
+        if unit in ('', 'b'):
+            factor = 1
+        elif unit[0] in self.prefixes and unit[1:] in ('', 'ib', 'b'):
+            base = 1000 if unit[1:] == 'b' else 1024
+            factor = base ** (self.prefixes.index(unit[0]) + 1)
+        else:
+            raise ValueError(value)
+        return int(float(number) * factor)
+
+
+class CommaList(object):
+    '''Convert comma separated values like 'a,b, c' to a list
+
+    Empty items are left out.
+
+    :Parameters:
+        - `convert`: Optional converter of every item
+    '''
+
+    name = 'list'
+
+    def __init__(self, convert=None):
+        self.convert = convert
+
+    def __call__(self, value):
+        items = [item.strip() for item in value.split(',')]
+        if self.convert is None:
+            return [item for item in items if item]
+        return [self.convert(item) for item in items if item]
+
+
+converters = {
+    'int': int,
+    'float': float,
+    'duration': Duration(),
+    'bytes': ByteSize(),
+    'list': CommaList(),
+}
+'''Dict of the names of built-in types -> converter'''
+
+
+def typeName(convert):
+    '''Return the name of a converter for error messages'''
+    return getattr(convert, 'name', getattr(convert, '__name__',
+                                            type(convert).__name__))
+
+
+def getConverter(option, settings):
+    '''Return the (converter, action, type name) of an option
+
+    Converters given by name are looked up in `converters`, so the same
+    instance is shared by all commands.
+
+    :Parameters:
+        - `option`: String. Name of the option, for error messages
+        - `settings`: Dict of the 'type' and 'action' of the option
+    '''
+    convert = settings.get('type')
+    if convert is not None and not callable(convert):
+        try:
+            convert = converters[convert]
+        except KeyError:
+            raise ValueError('option --{}: unknown type {!r}'
+                             .format(option, convert))
+    action = settings.get('action', 'store')
+    if action not in actions:
+        raise ValueError('option --{}: unknown action {!r}'
+                         .format(option, action))
+    return convert, action, convert and typeName(convert)
@@ -0,0 +1,162 @@
+# Copyright (c) 2013-2016, 2018  Benjamin Althues <benjamin@babab.nl>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+from __future__ import absolute_import, print_function
+
+'''
+Fan-out mode: run `CommandBase.runItem` over many items in parallel.
+
+This is used by `CommandBase.fanOut`. Items are handed to a thread or
+process pool, sized by the ``--jobs`` option. At most a few items per
+job are in flight at any time, so any number of items from stdin is
+processed in constant memory.
+'''
+
+from collections import deque
+import sys
+
+from pycommand.pycommand import CommandExit
+
+WINDOW = 4
+'''Number of items per job that are submitted ahead of their results'''
+
+_workerCommand = None
+
+
+def stdinItems():
+    '''Yield the non-empty lines of stdin'''
+    for line in sys.stdin:
+        line = line.rstrip('\r\n')
+        if line:
+            yield line
+
+
+def callItem(command, item):
+    '''Call `command.runItem` and return (item, output, status, message)'''
+    try:
+        return item, command.runItem(item), 0, None
+    except CommandExit as e:
+        return item, None, e.err if isinstance(e.err, int) else 1, None
+    except Exception as e:
+        return item, None, 1, '{}: {}'.format(type(e).__name__, e)
+
+
+def initWorker(command):
+    '''Store the command of a process pool worker'''
+    global _workerCommand
+    _workerCommand = command
+
+
+def callWorkerItem(item):
+    '''Call `callItem` for the command of a process pool worker'''
+    return callItem(_workerCommand, item)
+
+
+def results(command, items, jobs):
+    '''Yield the result tuple of `callItem` for every item'''
+    if jobs == 1:
+        for item in items:
+            yield callItem(command, item)
+        return
+
+    from concurrent import futures
+    if command.fanOutExecutor == 'process' and sys.version_info < (3, 7):
+        # Without an initializer, the command is sent with every item
+        executor = futures.ProcessPoolExecutor(jobs)
+
+        def submit(item):
+            return executor.submit(callItem, command, item)
+    elif command.fanOutExecutor == 'process':
+        executor = futures.ProcessPoolExecutor(
+            jobs, initializer=initWorker, initargs=(command, ))
+
+        def submit(item):
+            return executor.submit(callWorkerItem, item)
+    else:
+        executor = futures.ThreadPoolExecutor(jobs)
+
+        def submit(item):
+            return executor.submit(callItem, command, item)
+
+    ordered = command.fanOutOrdered
+    pending = deque() if ordered else set()
+    items = iter(items)
+    try:
+        while True:
+            for item in items:
+                if ordered:
+                    pending.append(submit(item))
+                else:
+                    pending.add(submit(item))
+                if len(pending) >= jobs * WINDOW:
+                    break
+            if not pending:
+                return
+            if ordered:
+                yield pending.popleft().result()
+            else:
+                done, _ = futures.wait(pending,
+                                       return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    pending.discard(future)
+                    yield future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def fanOut(command, items=None):
+    '''Run `command.runItem` for every item and return the exit status
+
+    :Parameters:
+        - `command`: Instance of a `CommandBase` subclass with `runItem`
+        - `items`: Iterable of items. Defaults to the positional
+          arguments with argument files expanded, or the lines of stdin.
+    '''
+    if items is None:
+        if command.argFiles and command.args:
+            items = command.iterArgs()
+        elif command.args and command.args != ['-']:
+            items = command.args
+        else:
+            items = stdinItems()
+    try:
+        jobs = int(command.flags.jobs or 1)
+        if jobs < 1:
+            raise ValueError
+    except ValueError:
+        print('error: --jobs must be a positive number, not {}'
+              .format(command.flags.jobs), file=command.stdout)
+        return 2
+    if jobs > 1:
+        try:
+            import concurrent.futures  # noqa: F401
+        except ImportError:
+            print('error: --jobs needs concurrent.futures, install the '
+                  'futures package on Python 2', file=command.stdout)
+            return 2
+
+    status = 0
+    for item, output, itemStatus, message in results(command, items, jobs):
+        if output is not None:
+            print(output, file=command.stdout)
+        if itemStatus:
+            if message:
+                print('error: {}: {}'.format(item, message),
+                      file=command.stdout)
+            status = max(status, itemStatus)
+            if command.fanOutFailFast:
+                break
+    return status
@@ -0,0 +1,283 @@
+# Copyright (c) 2013-2016, 2018  Benjamin Althues <benjamin@babab.nl>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+from __future__ import absolute_import
+
+'''
+Batch generation of scripts from a manifest.
+
+This is used by ``python -m pycommand init --manifest=<file>``, which
+generates every script that the manifest describes without asking any
+questions. A manifest is a JSON, INI or YAML file (YAML needs PyYAML).
+In JSON and YAML it is a list of scripts, or a dict with a list of
+'scripts' and a dict of 'defaults' for all scripts::
+
+    {
+        "defaults": {"template": 2},
+        "scripts": [
+            {"name": "deploy", "classname": "DeployCommand",
+             "options": ["env e <env> environment to deploy to",
+                         ["force", "f", false, "do not ask"]]},
+            {"name": "status", "template": "full-no-comments",
+             "path": "bin/status"}
+        ]
+    }
+
+In INI files every section is a script named after the section, and
+the DEFAULT section holds the defaults. Options are given one per line::
+
+    [DEFAULT]
+    template = 2
+
+    [deploy]
+    classname = DeployCommand
+    options =
+        env e <env> environment to deploy to
+        force f - do not ask
+
+Scripts have these keys:
+
+    name       Name of executable, and of the file by default (required)
+    classname  Name of the main command class [default: Command]
+    template   Template number 1-4 as in the interactive generator, or
+               the name of a template [default: 1]
+    options    List of options that are added to the main command, as
+               "<long> <short> <argument> <help>" strings (use - for no
+               short option or argument) or as lists of these 4 values
+    path       Path of the file, relative to the output directory
+               [default: name]
+
+Every template is compiled once and shared by all scripts. Scripts are
+rendered and written in parallel threads, and every file is written to
+a temporary file first and then renamed, so a script is never left
+half written.
+'''
+
+import io
+import json
+import os
+import stat
+import tempfile
+import threading
+
+templateNumbers = {
+    '1': 'basic-with-comments',
+    '2': 'basic-no-comments',
+    '3': 'full-with-comments',
+    '4': 'full-no-comments',
+}
+'''Dict of template number -> template name'''
+
+_templates = {}
+_lock = threading.Lock()
+
+
+def getTemplate(template):
+    '''Return the compiled `string.Template` of a template
+
+    Templates are compiled on first use and then cached.
+
+    :Parameters:
+        - `template`: Template number or name, see `templateNumbers`
+    '''
+    name = templateNumbers.get(str(template), template)
+    try:
+        return _templates[name]
+    except KeyError:
+        pass
+    import string
+    from pycommand.templates import templates
+    if name not in templates:
+        raise ValueError('template "{}" does not exist'.format(template))
+    with _lock:
+        return _templates.setdefault(name, string.Template(templates[name]))
+
+
+def parseOption(option):
+    '''Return an option of a manifest as (long, short, argument, help)
+
+    :Parameters:
+        - `option`: String "<long> <short> <argument> <help>", or a list
+          of these 4 values
+    '''
+    if isinstance(option, (list, tuple)):
+        values = list(option)
+    else:
+        values = str(option).split(None, 3)
+        values[1:3] = ['' if value == '-' else value for value in values[1:3]]
+        if len(values) > 2 and not values[2]:
+            values[2] = False
+    if len(values) == 3:
+        values.append('')
+    if len(values) != 4 or not values[0]:
+        raise ValueError('invalid option {!r}'.format(option))
+    return (values[0], values[1] or '', values[2] or False, values[3])
+
+
+def renderOptions(options):
+    '''Return the source code of options for the optionList of a script'''
+    return ''.join(
+        '        ({!r}, ({!r}, {!r}, {!r})),\n'.format(*parseOption(option))
+        for option in options
+    )
+
+
+def loadManifest(path):
+    '''Return the list of scripts of a manifest file
+
+    The format is chosen by the extension of `path`: '.ini' or '.cfg'
+    for INI, '.yaml' or '.yml' for YAML and JSON otherwise. The
+    defaults are applied to every script.
+    '''
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.ini', '.cfg'):
+        try:
+            from configparser import RawConfigParser
+        except ImportError:
+            from ConfigParser import RawConfigParser
+        parser = RawConfigParser()
+        parser.optionxform = str
+        if not parser.read(path):
+            raise IOError('cannot read manifest "{}"'.format(path))
+        scripts = []
+        for section in parser.sections():
+            script = dict(parser.items(section), name=section)
+            if 'options' in script:
+                script['options'] = [line for line in
+                                     script['options'].splitlines()
+                                     if line.strip()]
+            scripts.append(script)
+        return scripts
+
+    with io.open(path, encoding='utf-8') as manifest:
+        if extension in ('.yaml', '.yml'):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError('PyYAML is needed to read "{}"'.format(path))
+            data = yaml.safe_load(manifest)
+        else:
+            data = json.load(manifest)
+    if isinstance(data, dict):
+        defaults = data.get('defaults') or {}
+        data = data.get('scripts') or []
+    else:
+        defaults = {}
+    if not isinstance(data, list):
+        raise ValueError('manifest "{}" has no list of scripts'.format(path))
+    return [dict(defaults, **script) for script in data]
+
+
+def renderScript(script):
+    '''Return the source code of a script of a manifest'''
+    if not script.get('name'):
+        raise ValueError('script has no name')
+    template = getTemplate(script.get('template', 1))
+    return template.substitute({
+        'name': script['name'],
+        'classname': script.get('classname') or 'Command',
+        'options': renderOptions(script.get('options') or ()),
+    })
+
+
+def writeAtomic(path, text, mode):
+    '''Write a file at once by renaming a temporary file
+
+    :Parameters:
+        - `path`: String. Path of the file
+        - `text`: String. Contents of the file
+        - `mode`: Integer. Permissions of the file
+    '''
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+    if isinstance(text, bytes):  # str on Python 2
+        text = text.decode('utf-8')
+    fd, tmppath = tempfile.mkstemp(dir=directory or '.',
+                                   prefix='.pycommand-init-')
+    try:
+        with io.open(fd, 'w', encoding='utf-8') as output:
+            output.write(text)
+        os.chmod(tmppath, mode)
+        getattr(os, 'replace', os.rename)(tmppath, path)
+    except BaseException:
+        os.unlink(tmppath)
+        raise
+
+
+def scriptMode():
+    '''Return the permissions of new executable scripts
+
+    This is the mode of new files with the umask of the process applied,
+    with all execute bits set like the interactive generator does. The
+    umask can only be read by setting it, so this should not be called
+    while other threads create files.
+    '''
+    mask = os.umask(0)
+    os.umask(mask)
+    return 0o666 & ~mask | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
+
+
+def generateScript(script, directory, mode, force=False):
+    '''Render and write one script and return (path, error)
+
+    :Parameters:
+        - `script`: Dict of a script of a manifest
+        - `directory`: String. Output directory
+        - `mode`: Integer. Permissions of the file, see `scriptMode`
+        - `force`: Bool. Replace existing files
+    '''
+    path = os.path.join(directory, script.get('path') or
+                        script.get('name') or '')
+    try:
+        text = renderScript(script)
+        if not force and os.path.exists(path):
+            return path, 'file already exists'
+        writeAtomic(path, text, mode)
+    except (ValueError, KeyError, IOError, OSError) as e:
+        return path, str(e)
+    return path, None
+
+
+def generate(scripts, directory='.', force=False, jobs=None):
+    '''Generate scripts in parallel and yield (path, error) in order
+
+    :Parameters:
+        - `scripts`: List of dicts of scripts, see `loadManifest`
+        - `directory`: String. Output directory
+        - `force`: Bool. Replace existing files
+        - `jobs`: Integer. Number of threads, defaults to the number of
+          CPUs up to 8. Rendering holds the GIL, so more threads than
+          CPUs only add contention.
+    '''
+    if jobs is None:
+        try:
+            jobs = min(8, os.cpu_count() or 1)
+        except AttributeError:
+            jobs = 1
+    mode = scriptMode()
+    if jobs == 1 or len(scripts) < 2:
+        for script in scripts:
+            yield generateScript(script, directory, mode, force)
+        return
+    from concurrent import futures
+    with futures.ThreadPoolExecutor(jobs) as executor:
+        for result in executor.map(
+                lambda script: generateScript(script, directory, mode, force),
+                scripts):
+            yield result
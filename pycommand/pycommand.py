@@ -14,7 +14,7 @@
 # ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
 # OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
-from __future__ import absolute_import
+from __future__ import absolute_import, print_function
 
 __docformat__ = 'restructuredtext'
 __author__ = "Benjamin Althues"
@@ -23,9 +23,27 @@ __version_info__ = (0, 4, 0, 'final', 0)
 __version__ = '0.4.0'
 
 
-from collections import OrderedDict
-import getopt
+import keyword
+import os
 import sys
+import time
+
+# Only modules that are already loaded at interpreter startup, or are
+# tiny, are imported here. getopt (which imports gettext and re),
+# collections, importlib and asyncio are imported on first use, because
+# the import time of pycommand adds to the startup time of every program.
+if sys.version_info >= (3, 7):
+    OrderedDict = dict
+else:
+    from collections import OrderedDict
+
+importedAt = time.time()
+'''Time at which pycommand was imported'''
+
+try:
+    basestring
+except NameError:
+    basestring = str
 
 
 class CommandExit(Exception):
@@ -40,6 +58,20 @@ class OptionError(AttributeError):
     '''Options/Flags AttributeError exception'''
 
 
+IDENTIFIER_CHARS = frozenset('_abcdefghijklmnopqrstuvwxyz'
+                             'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789')
+
+
+def isIdentifier(name):
+    '''Check if `name` is an ASCII identifier
+
+    This works on Python 2 as well, where `str` has no `isidentifier`,
+    and does not need `re` (see the imports above).
+    '''
+    return (bool(name) and not name[0].isdigit()
+            and IDENTIFIER_CHARS.issuperset(name))
+
+
 class dictobject(dict):
     '''A dictionary with getters by attribute, used for flags '''
     def __getattr__(self, name):
@@ -49,6 +81,684 @@ class dictobject(dict):
             raise OptionError("Option '{}' is not defined".format(name))
 
 
+class flagsobject(object):
+    '''Base class of the flags types generated by `CommandSpec`
+
+    Every command class gets a subclass with one slot per long option,
+    see `CommandSpec.buildFlagsClass`. Flags are read as attributes with
+    normalized names (``flags.dry_run`` for ``dry-run``), by their
+    option name (``getattr(flags, 'dry-run')``) or by key
+    (``flags['dry-run']``).
+    '''
+    __slots__ = ()
+
+    _slots = {}
+    '''Dict of long option -> name of the slot holding its value'''
+
+    _command = None
+    '''Command class the flags type is generated for'''
+
+    def __getattr__(self, name):
+        # Only called for names that are not slots, like 'dry-run'
+        slot = self._slots.get(name)
+        if slot is None or slot == name:
+            raise OptionError("Option '{}' is not defined".format(name))
+        return getattr(self, slot)
+
+    def __getitem__(self, flag):
+        return getattr(self, self._slots[flag])
+
+    def __setitem__(self, flag, value):
+        setattr(self, self._slots[flag], value)
+
+    def __contains__(self, flag):
+        return flag in self._slots
+
+    def __iter__(self):
+        return iter(self._slots)
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __eq__(self, other):
+        try:
+            return dict(self.items()) == dict(other.items())
+        except AttributeError:
+            return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def get(self, flag, default=None):
+        '''Return the value of `flag`, or `default` if it is undefined'''
+        slot = self._slots.get(flag)
+        return default if slot is None else getattr(self, slot)
+
+    def keys(self):
+        '''Return the names of all flags'''
+        return self._slots.keys()
+
+    def values(self):
+        '''Return a list of the values of all flags'''
+        return [getattr(self, slot) for slot in self.__slots__]
+
+    def items(self):
+        '''Return a list of (flag, value) pairs of all flags'''
+        return list(zip(self._slots, self.values()))
+
+    def asDict(self):
+        '''Return a dict of all flags, e.g. for `json.dumps`
+
+        Flags objects are not `dict` instances, so use this where a real
+        dict is needed.
+        '''
+        return dict(self.items())
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def __reduce__(self):
+        return restoreFlags, (self._command, tuple(self.values()))
+
+    def update(self, *args, **kwargs):
+        '''Set flags from a mapping or iterable of pairs, like `dict`'''
+        for flag, value in dict(*args, **kwargs).items():
+            self[flag] = value
+
+    def copy(self):
+        '''Return a shallow copy'''
+        flags = type(self)()
+        for slot in self.__slots__:
+            setattr(flags, slot, getattr(self, slot))
+        return flags
+
+
+def restoreFlags(command_class, values):
+    '''Recreate a flags object of `command_class` when unpickling'''
+    flags = command_class.getSpec().flagsClass()
+    for slot, value in zip(flags.__slots__, values):
+        setattr(flags, slot, value)
+    return flags
+
+
+def getoptError(msg, opt):
+    '''Return a `getopt.GetoptError`, importing getopt on first use'''
+    from getopt import GetoptError
+    return GetoptError(msg, opt)
+
+
+class usagedescriptor(object):
+    '''Lazy `usage` attribute of `CommandBase` classes and instances'''
+    def __get__(self, obj, objtype=None):
+        if objtype is None:
+            objtype = type(obj)
+        return objtype.getSpec().usage
+
+
+class CommandSpec(object):
+    '''Compiled option tables and usage text of a `CommandBase` class
+
+    Everything that only depends on the class attributes is computed
+    once per class, so that instantiating a command only has to parse
+    its arguments.
+    '''
+
+    sourceAttributes = ('usagestr', 'description', 'optionList',
+                        'usageTextExtra', 'runItem', 'optionGroups')
+    '''Tuple of class attributes that the spec is compiled from'''
+
+    dumpAttributes = ('shortopts', 'longopts', 'shortIndex', 'longIndex',
+                      '_usage')
+    '''Tuple of compiled attributes that are stored by `dump`'''
+
+    cache = None
+    '''Persistent cache of compiled specs, see `pycommand.cache`'''
+
+    profiler = None
+    '''Recorder of phase timings, see `pycommand.timing`'''
+
+    @classmethod
+    def compile(cls, command_class):
+        '''Compile the spec of `command_class`, or load it from `cache`
+
+        :Parameters:
+            - `command_class`: Class to compile the spec for
+        '''
+        if cls.cache is not None:
+            spec = cls.cache.getSpec(command_class)
+        else:
+            spec = cls(command_class)
+        parsers = compiledParsers(command_class)
+        if parsers is not None:
+            spec.useCompiledParser(command_class, parsers)
+        return spec
+
+    def __init__(self, command_class):
+        '''Compile the spec of a `CommandBase` subclass
+
+        :Parameters:
+            - `command_class`: Class to compile the spec for
+        '''
+        self.name = command_class.__name__
+        '''String. Name of the class the spec is compiled for'''
+
+        self.sources = self.sourcesOf(command_class)
+        '''Values of `sourceAttributes` the spec is compiled from'''
+
+        self.optionList = OrderedDict(command_class.optionList)
+        '''OrderedDict of options (a dict on Python 3.7 and later)'''
+
+        if command_class.runItem is not None and 'jobs' not in self.optionList:
+            shorts = set(val[0] for val in self.optionList.values())
+            self.optionList['jobs'] = (
+                '' if 'j' in shorts else 'j', '<n>',
+                'process up to <n> items in parallel'
+            )
+
+        self.defaults = dict.fromkeys(self.optionList)
+        '''Dict of all flags, set to None'''
+
+        self.flagsClass = self.buildFlagsClass(command_class)
+        '''Subclass of `flagsobject` that parsed flags are stored in'''
+
+        self.converters = self.buildConverters()
+        '''Dict of flag -> (converter, action, type name) of the options
+        that declare a type or action, see `pycommand.converters`'''
+
+        self.searchFlags = self.findSearchFlags()
+        '''Frozenset of the options that accept ``--<flag>=<term>`` to
+        search the usage information, see `CommandBase.printHelp`'''
+
+        self.checkOptionGroups()
+
+        self.shortopts = ''
+        '''Short options in `getopt` format'''
+
+        self.longopts = []
+        '''Long options in `getopt` format'''
+
+        self.shortIndex = {}
+        '''Dict of short option -> (flag, bool whether it takes an argument)'''
+
+        self.longIndex = {}
+        '''Dict of long option -> (flag, bool whether it takes an argument)'''
+
+        # Build getopt specifications and option indexes
+        for flag, val in self.optionList.items():
+            self.longopts.append(flag + '=' if val[1] else flag)
+            self.longIndex[flag] = (flag, bool(val[1]))
+            if val[0]:
+                self.shortopts += val[0] + ':' if val[1] else val[0]
+                self.shortIndex.setdefault(val[0], (flag, bool(val[1])))
+
+        self._usage = None
+        self._prefixTrie = None
+        self._helpIndex = None
+
+    @property
+    def usage(self):
+        '''String with usage information, rendered on first access'''
+        if self._usage is None:
+            profiler = CommandSpec.profiler
+            if profiler is None:
+                self._usage = self.renderUsage()
+            else:
+                start = profiler.start()
+                self._usage = self.renderUsage()
+                profiler.stop('usage', self.name, start)
+        return self._usage
+
+    def renderUsage(self):
+        '''Compile the usage information string
+
+        The string is compiled using the values found for `usagestr`,
+        `description`, `optionList`, `optionGroups` and `usageTextExtra`.
+        See `iterUsage`.
+        '''
+        return ''.join(self.iterUsage())
+
+    def iterUsage(self, search=None):
+        '''Yield the usage information in pieces while rendering it
+
+        Options are listed under "Options:", followed by a section for
+        every group in `optionGroups`. When searching, only the options
+        that match `search` are listed (see `searchOptions`), without the
+        description and `usageTextExtra`.
+
+        :Parameters:
+            - `search`: String. Search term, or None for the full text
+        '''
+        sources = dict(zip(self.sourceAttributes, self.sources))
+        sections = self.optionSections()
+        yield sources['usagestr']
+        if search is None:
+            if sources['description']:
+                yield '\n\n{desc}'.format(desc=sources['description'])
+        else:
+            matches = set(self.searchOptions(search))
+            sections = [(title, [flag for flag in flags if flag in matches])
+                        for title, flags in sections]
+            sections = [section for section in sections if section[1]]
+            if not matches:
+                yield '\n\nNo options match {!r}.\n'.format(search)
+                return
+            yield '\n\n{} of {} options match {!r}.'.format(
+                len(matches), len(self.optionList), search)
+
+        # Calculate padding needed for option arguments in usage info
+        optionList = self.optionList
+        padding = 0
+        for title, flags in sections:
+            for flag in flags:
+                val = optionList[flag]
+                optlen = len(flag) + 2
+                optlen += 4 if val[0] else 0
+                optlen += len(val[1]) + 1 if val[0] and val[1] else 0
+                optlen += len(val[1]) + 1 if val[1] else 0
+                padding = optlen if optlen > padding else padding
+
+        line = '{{:{}}}  {{}}\n'.format(padding).format
+        optionString = self.optionString
+        separator = '\n\n'
+        for title, flags in sections:
+            yield '{}{}:\n'.format(separator, title)
+            separator = '\n'
+            for flag in flags:
+                yield line(optionString(flag), optionList[flag][2])
+        if search is None and sources['usageTextExtra']:
+            yield '\n{help}'.format(help=sources['usageTextExtra'])
+
+    def optionString(self, flag):
+        '''Return the options column of `flag` in the usage information
+
+        E.g. ``-f <filename>, --file=<filename>``
+        '''
+        val = self.optionList[flag]
+        if val[1]:
+            flagstring_long = ('{flag}={argument}'
+                               .format(flag=flag, argument=val[1]))
+            if val[0]:
+                flagstring_short = ('{flag} {argument}'
+                                    .format(flag=val[0], argument=val[1]))
+        else:
+            flagstring_long = flag
+            flagstring_short = val[0]
+
+        if val[0]:
+            return ('-{short}, --{flag}'
+                    .format(short=flagstring_short, flag=flagstring_long))
+        return '--{flag}'.format(flag=flagstring_long)
+
+    def optionSections(self):
+        '''Return the sections of options as a list of (title, flags)
+
+        The first section, "Options", holds the options that are not in
+        one of the `optionGroups`, in the order of `optionList`. Empty
+        sections are left out.
+        '''
+        groups = self.sources[self.sourceAttributes.index('optionGroups')]
+        grouped = set(flag for title, flags in groups for flag in flags)
+        sections = [('Options', [flag for flag in self.optionList
+                                 if flag not in grouped])]
+        sections += [(title, list(flags)) for title, flags in groups]
+        return [section for section in sections if section[1]]
+
+    def searchOptions(self, search):
+        '''Return the options that match a search term of ``--help``
+
+        An option matches when every word of `search` occurs in its
+        long or short option, argument, description or group title,
+        ignoring case. The searched text of all options is indexed on the
+        first search.
+
+        :Parameters:
+            - `search`: String. Search term
+        '''
+        if self._helpIndex is None:
+            index = []
+            for title, flags in self.optionSections():
+                for flag in flags:
+                    val = self.optionList[flag]
+                    index.append((flag, '--{} -{} {} {} {}'.format(
+                        flag, val[0], val[1] or '', val[2], title).lower()))
+            self._helpIndex = index
+        words = search.lower().split()
+        return [flag for flag, text in self._helpIndex
+                if all(word in text for word in words)]
+
+    def dump(self):
+        '''Return the compiled tables as a dict of marshallable values'''
+        data = dict((name, getattr(self, name))
+                    for name in self.dumpAttributes)
+        data['optionList'] = tuple(self.optionList.items())
+        return data
+
+    @classmethod
+    def fromDump(cls, command_class, data):
+        '''Create a spec from the result of `dump` without compiling it
+
+        :Parameters:
+            - `command_class`: Class the dumped spec was compiled for
+            - `data`: Dict returned by `dump`
+        '''
+        spec = cls.__new__(cls)
+        spec.name = command_class.__name__
+        spec.sources = cls.sourcesOf(command_class)
+        spec.optionList = OrderedDict(data['optionList'])
+        spec.defaults = dict.fromkeys(spec.optionList)
+        spec.flagsClass = spec.buildFlagsClass(command_class)
+        spec.converters = spec.buildConverters()
+        spec.searchFlags = spec.findSearchFlags()
+        spec.checkOptionGroups()
+        for name in cls.dumpAttributes:
+            setattr(spec, name, data[name])
+        spec._prefixTrie = None
+        spec._helpIndex = None
+        return spec
+
+    def buildFlagsClass(self, command_class):
+        '''Generate the `flagsobject` subclass of `command_class`
+
+        Every long option gets a slot named after the option, with
+        characters that are not valid in identifiers replaced by
+        underscores. Options whose normalized name is not a valid,
+        unique attribute name (a keyword, or a method such as ``items``)
+        get a private slot and are only accessible by option name.
+        '''
+        reserved = set(dir(flagsobject))
+        slots = OrderedDict()
+        for n, flag in enumerate(self.optionList):
+            slot = ''.join(c if c.isalnum() or c == '_' else '_'
+                           for c in flag)
+            if (not isIdentifier(slot) or keyword.iskeyword(slot)
+                    or slot in reserved):
+                slot = '_flag{}'.format(n)
+            while slot in reserved:
+                slot += '_'
+            reserved.add(slot)
+            slots[flag] = slot
+
+        # A generated __init__ sets all slots without looping in Python
+        source = 'def __init__(self):\n'
+        source += ''.join('    self.{} = None\n'.format(slot)
+                          for slot in slots.values()) or '    pass\n'
+        namespace = {
+            '__slots__': tuple(slots.values()),
+            '__module__': command_class.__module__,
+            '_slots': slots,
+            '_command': command_class,
+        }
+        exec(source, namespace)
+        return type(command_class.__name__ + 'Flags', (flagsobject, ),
+                    namespace)
+
+    def buildConverters(self):
+        '''Look up the converters of options with a type or action
+
+        Options declare these in a dict after their description. The
+        converters are looked up once per class, and
+        `pycommand.converters` is only imported when needed.
+        '''
+        options = [(flag, val) for flag, val in self.optionList.items()
+                   if len(val) > 3 and val[3]
+                   and ('type' in val[3] or 'action' in val[3])]
+        if not options:
+            return {}
+        from pycommand.converters import getConverter
+        converters = {}
+        for flag, val in options:
+            converters[flag] = getConverter(flag, val[3])
+            if converters[flag][1] == 'count' and val[1]:
+                raise ValueError('option --{}: only options without an '
+                                 'argument can be counted'.format(flag))
+        return converters
+
+    def findSearchFlags(self):
+        '''Return the options that set 'search' in their dict
+
+        Only options without an argument can search.
+        '''
+        searchFlags = set()
+        for flag, val in self.optionList.items():
+            if len(val) > 3 and val[3] and val[3].get('search'):
+                if val[1]:
+                    raise ValueError('option --{}: only options without an '
+                                     'argument can search'.format(flag))
+                searchFlags.add(flag)
+        return frozenset(searchFlags)
+
+    def checkOptionGroups(self):
+        '''Raise ValueError when `optionGroups` names an unknown option'''
+        groups = self.sources[self.sourceAttributes.index('optionGroups')]
+        for title, flags in groups:
+            for flag in flags:
+                if flag not in self.optionList:
+                    raise ValueError('option group {!r}: option --{} does '
+                                     'not exist'.format(title, flag))
+
+    @classmethod
+    def sourcesOf(cls, command_class):
+        '''Return the values of `sourceAttributes` of `command_class`
+
+        Methods like `runItem` are taken as their function, because on
+        Python 2 every access of a method creates a new method object.
+        '''
+        sources = []
+        for name in cls.sourceAttributes:
+            value = getattr(command_class, name)
+            sources.append(getattr(value, '__func__', value))
+        return tuple(sources)
+
+    def isCompiledFrom(self, command_class):
+        '''Check if the spec is up to date with `command_class`
+
+        :Parameters:
+            - `command_class`: Class the spec was compiled for
+        '''
+        for name, source in zip(self.sourceAttributes, self.sources):
+            value = getattr(command_class, name)
+            if (value is not source
+                    and getattr(value, '__func__', None) is not source):
+                return False
+        return True
+
+    def parse(self, argv, start=0):
+        '''Parse a list of arguments
+
+        This is a single pass replacement for `getopt.getopt`, with the
+        same rules and errors, except that options in `searchFlags` also
+        accept ``--<flag>=<term>`` (see `CommandBase.printHelp`). Options
+        are looked up in `shortIndex` and `longIndex`, so each one is
+        resolved in constant time regardless of the size of `optionList`.
+        See `resolveLong` for abbreviated long options. Values of options
+        in `converters` are converted and collected by `storeValue`.
+
+        :Parameters:
+            - `argv`: List of arguments. E.g. `sys.argv[1:]`
+            - `start`: Index in `argv` of the first argument to parse
+
+        Returns a tuple of (flags, args, error), where `flags` is a
+        `flagsClass` object of all flags, `args` a list of positional arguments
+        and `error` a `getopt.GetoptError` or None.
+        '''
+        flags = self.flagsClass()
+        slots = flags._slots
+        shortIndex = self.shortIndex
+        converters = self.converters
+        argc = len(argv)
+        i = start
+        try:
+            while i < argc:
+                arg = argv[i]
+                if arg == '--':
+                    i += 1
+                    break
+                if arg[:1] != '-' or arg == '-':
+                    break
+                i += 1
+
+                if arg[1] == '-':
+                    # Long tags
+                    opt, sep, value = arg[2:].partition('=')
+                    flag, hasArg = self.resolveLong(opt)
+                    if hasArg:
+                        if not sep:
+                            if i == argc:
+                                raise getoptError(
+                                    'option --%s requires argument' % flag,
+                                    flag)
+                            value = argv[i]
+                            i += 1
+                    elif sep:
+                        if flag not in self.searchFlags:
+                            raise getoptError(
+                                'option --%s must not have an argument'
+                                % flag, flag)
+                        value = value or True
+                    else:
+                        value = True
+                    if flag in converters:
+                        self.storeValue(flags, flag, value)
+                    else:
+                        setattr(flags, slots[flag], value)
+                    continue
+
+                # Short tags, possibly clustered like -hvf <filename>
+                pos = 1
+                while pos < len(arg):
+                    opt = arg[pos]
+                    pos += 1
+                    try:
+                        flag, hasArg = shortIndex[opt]
+                    except KeyError:
+                        raise getoptError(
+                            'option -%s not recognized' % opt, opt)
+                    if not hasArg:
+                        value = True
+                    elif pos < len(arg):
+                        value = arg[pos:]
+                        pos = len(arg)
+                    elif i < argc:
+                        value = argv[i]
+                        i += 1
+                    else:
+                        raise getoptError(
+                            'option -%s requires argument' % opt, opt)
+                    if flag in converters:
+                        self.storeValue(flags, flag, value)
+                    else:
+                        setattr(flags, slots[flag], value)
+        except Exception as err:
+            getopt = sys.modules.get('getopt')
+            if getopt is None or not isinstance(err, getopt.GetoptError):
+                raise
+            return self.flagsClass(), [], err
+        return flags, argv[i:], None
+
+    def useCompiledParser(self, command_class, parsers):
+        '''Parse with a generated parser of `command_class`, if up to date
+
+        The parser replaces `parse` for this spec, and its usage text is
+        used instead of rendering it. See `pycommand.compiler`.
+
+        :Parameters:
+            - `command_class`: Class the spec was compiled for
+            - `parsers`: Dict of the generated module, see
+              `compiledParsers`
+        '''
+        entry = parsers.get(getattr(command_class, '__qualname__',
+                                    command_class.__name__))
+        if entry is None:
+            return False
+        from pycommand.cache import sourceKey
+        if entry[0] != sourceKey(command_class):
+            return False
+        parse = entry[1]
+        self.parse = lambda argv, start=0: parse(self, argv, start)
+        if self._usage is None:
+            self._usage = entry[2]
+        return True
+
+    def storeValue(self, flags, flag, value):
+        '''Convert and store a value of an option in `converters`
+
+        :Parameters:
+            - `flags`: `flagsClass` object to store the value in
+            - `flag`: String. Long option
+            - `value`: String argument of the option, or True
+        '''
+        convert, action, typeName = self.converters[flag]
+        if convert is not None and value is not True:
+            try:
+                value = convert(value)
+            except (ValueError, TypeError):
+                raise getoptError('option --%s: invalid %s value %r'
+                                  % (flag, typeName, value), flag)
+        slot = flags._slots[flag]
+        if action == 'append':
+            values = getattr(flags, slot)
+            if values is None:
+                setattr(flags, slot, [value])
+            else:
+                values.append(value)
+        elif action == 'count':
+            setattr(flags, slot, (getattr(flags, slot) or 0) + 1)
+        else:
+            setattr(flags, slot, value)
+
+    def resolveLong(self, opt):
+        '''Resolve a (possibly abbreviated) long option
+
+        Exact names are looked up in `longIndex`. Abbreviations are
+        resolved by walking `prefixTrie`, in time proportional to the
+        length of `opt`.
+
+        :Parameters:
+            - `opt`: String. Long option without leading dashes
+
+        Returns a tuple of (flag, bool whether it takes an argument).
+        Raises `getopt.GetoptError` for unknown or ambiguous options.
+        '''
+        try:
+            return self.longIndex[opt]
+        except KeyError:
+            pass
+        node = self.prefixTrie
+        for char in opt:
+            try:
+                node = node[char]
+            except KeyError:
+                raise getoptError('option --%s not recognized' % opt, opt)
+        if None not in node:  # only the empty root of an empty trie
+            raise getoptError('option --%s not recognized' % opt, opt)
+        flag = node[None]
+        if flag is None:
+            raise getoptError('option --%s not a unique prefix' % opt, opt)
+        return self.longIndex[flag]
+
+    @property
+    def prefixTrie(self):
+        '''Trie of long options, built when an option is first abbreviated
+
+        Every node is a dict mapping the next character to a child node.
+        The None key holds the only flag that starts with the prefix of
+        the node, or None when more flags start with it.
+        '''
+        if self._prefixTrie is None:
+            root = {}
+            for flag in self.longIndex:
+                node = root
+                node[None] = flag if None not in node else None
+                for char in flag:
+                    node = node.setdefault(char, {})
+                    node[None] = flag if None not in node else None
+            self._prefixTrie = root
+        return self._prefixTrie
+
+
 class CommandBase(object):
     '''Base class for (sub)commands'''
 
@@ -60,12 +770,17 @@ class CommandBase(object):
 
     optionList = {}
     '''Dictionary of options (as a tuple of 2-tuples).
-    This will be transformed to an OrderedDict when initializing the object.
+    This will be transformed to an OrderedDict when the class is first
+    instantiated. Reassign it rather than changing it in place, so that
+    the compiled `CommandSpec` of the class gets rebuilt.
 
     Example::
 
         optionList = (
-            ('help', ('h', False, 'show this help information')),
+            # With 'search', --help=<term> searches the options (see
+            # printHelp)
+            ('help', ('h', False, 'show this help information',
+                      {'search': True})),
             ('dry-run', ('n', False,
                          'only print output without actually running')),
 
@@ -75,6 +790,28 @@ class CommandBase(object):
 
             # Use an empty string to ommit short option
             ('debug', ('', False, 'show debug information')),
+
+            # Add a dict to convert values while parsing, or to collect
+            # the values of repeated options (see pycommand.converters)
+            ('jobs', ('j', '<n>', 'number of jobs', {'type': 'int'})),
+            ('tag', ('t', '<tag>', 'add a tag', {'action': 'append'})),
+            ('verbose', ('v', False, 'more output', {'action': 'count'})),
+        )
+
+    '''
+
+    optionGroups = ()
+    '''Tuple of (title, tuple of long options) sections of the usage text
+
+    Options in a group are listed in a section with its title, after the
+    options that are not in a group. The order of the options in the
+    groups is kept.
+
+    Example::
+
+        optionGroups = (
+            ('Network', ('host', 'port', 'timeout')),
+            ('Output', ('format', 'verbose')),
         )
 
     '''
@@ -82,15 +819,145 @@ class CommandBase(object):
     usageTextExtra = ''
     '''String. Optional extra usage information'''
 
+    runItem = None
+    '''Method that processes a single item in fan-out mode
+
+    Define ``runItem(self, item)`` to turn a command into a fan-out
+    command. Its `run` method then calls `fanOut`, which passes every
+    positional argument (see `iterArgs`), or every line of stdin when
+    there are none or when the only argument is ``-``, to `runItem`.
+    A ``-j <n>, --jobs=<n>`` option is added to `optionList` to set the
+    number of parallel jobs.
+
+    `runItem` returns a string to print or None. Raise `CommandExit` or
+    any other exception to report a failed item.
+    '''
+
+    argFiles = False
+    '''Bool. Expand argument files and stdin in `iterArgs`
+
+    When True, a positional argument ``@<path>`` stands for the
+    arguments in the file at `path` and ``-`` for the arguments read
+    from stdin, one per line or separated by NUL characters. See
+    `pycommand.argfiles`.
+    '''
+
+    argSeparator = None
+    '''String. Separator of arguments in argument files and stdin,
+    '\\n' or '\\0'. It is detected from the input when None.'''
+
+    fanOutExecutor = 'thread'
+    '''String. Run items in a 'thread' or a 'process' pool'''
+
+    fanOutOrdered = True
+    '''Bool. Print results in the order of the items'''
+
+    fanOutFailFast = False
+    '''Bool. Stop processing items after the first failure'''
+
+    completers = {}
+    '''Dictionary of values to complete in shell completion scripts.
+
+    Keys are long options that take an argument, or None for positional
+    arguments. Values are either a list of words, or a string with a
+    shell command that prints the words, one per line, when completing.
+    Arguments are completed as file names by default. See
+    `pycommand.completion`.
+
+    Example::
+
+        completers = {
+            'format': ['json', 'text'],
+            'branch': 'git branch --format="%(refname:short)"',
+        }
+
+    '''
+
     commands = {}
-    '''Dictionary of commands and the callables they invoke.'''
+    '''Dictionary of commands and the callables they invoke.
+
+    Instead of a callable, a dotted import path can be given as a string.
+    The module is only imported when the command is dispatched to. Use a
+    2-tuple of (callable or path, description) to let `commandList`
+    describe a command without importing it.
+
+    Example::
+
+        commands = {
+            'help': HelpCommand,
+            'deploy': 'mytool.deploy:DeployCommand',
+            'status': ('mytool.status:StatusCommand', 'show status'),
+        }
+
+    '''
+
+    usage = usagedescriptor()
+    '''String with usage information
+
+    The string is compiled using the values found for
+    `usagestr`, `description`, `optionList`, `optionGroups` and
+    `usageTextExtra`. It is only rendered when it is first read and is
+    cached per class. Assigning to it on an instance overrides it for
+    that instance. See `printHelp` for large commands.
+    '''
+
+    @property
+    def stdout(self):
+        '''Stream to write output to, `sys.stdout` unless set
+
+        It is set per invocation by `execute` and passed on to
+        subcommands, so write output with ``print(..., file=self.stdout)``
+        rather than to `sys.stdout`.
+        '''
+        stream = self.__dict__.get('_stdout')
+        return sys.stdout if stream is None else stream
+
+    @stdout.setter
+    def stdout(self, stream):
+        self._stdout = stream
+
+    def __getstate__(self):
+        '''Leave out `stdout` and the parsed subcommand when pickling
+
+        Process pools of fan-out mode pickle the command for their
+        workers, which return their output instead of writing it.
+        '''
+        state = self.__dict__.copy()
+        state.pop('_stdout', None)
+        state.pop('_subcommand', None)
+        return state
 
-    def __init__(self, argv=sys.argv[1:]):
+    @classmethod
+    def getSpec(cls):
+        '''Return the `CommandSpec` of this class
+
+        The spec is compiled on first use and shared by all instances.
+        It is compiled again when one of the attributes it is built
+        from is reassigned, e.g. ``MyCommand.optionList = (...)``.
+        '''
+        spec = cls.__dict__.get('_spec')
+        if spec is None or not spec.isCompiledFrom(cls):
+            profiler = CommandSpec.profiler
+            if profiler is None:
+                spec = CommandSpec.compile(cls)
+            else:
+                start = profiler.start()
+                spec = CommandSpec.compile(cls)
+                profiler.stop('spec', cls, start)
+            cls._spec = spec
+        return spec
+
+    def __init__(self, argv=None, start=0):
         '''Initialize (sub)command object
 
         :Parameters:
-            - `argv`: List of arguments. E.g. `sys.argv[1:]`
+            - `argv`: List of arguments. Defaults to `sys.argv[1:]` at
+              the time of the call
+            - `start`: Index in `argv` of the first argument to parse
         '''
+        if argv is None:
+            argv = sys.argv[1:]
+        spec = self.getSpec()
 
         # Instance vars
         self.error = None
@@ -103,103 +970,273 @@ class CommandBase(object):
         '''List of parsed postional arguments'''
 
         self.parentFlags = {}
-        '''Dict of registered `flags` of parent Command object.'''
+        '''Dict of registered `flags` of parent Command object.
 
-        self.usage = ''
-        '''String with usage information
+        When the command is dispatched to by a parent command, this is
+        a layered view of the registered flags over the `flags` of the
+        parent, see `layerFlags`.
+        '''
+
+        self.optionList = spec.optionList
+
+        # Parse arguments and options into a flags object
+        profiler = CommandSpec.profiler
+        if profiler is None:
+            self.flags, self.args, self.error = spec.parse(argv, start)
+        else:
+            started = profiler.start()
+            self.flags, self.args, self.error = spec.parse(argv, start)
+            profiler.stop('parse', self, started)
+
+    def printHelp(self):
+        '''Write the usage information to `stdout`
 
-        The string is compiled using the values found for
-        `usagestr`, `description`, `optionList` and `usageTextExtra`.
+        With ``--help=<term>``, only the options that match the term are
+        listed, see `CommandSpec.searchOptions`. This needs a ``help``
+        option that sets ``'search': True`` in its dict. The text is written
+        while it is rendered, so the help of commands with thousands of
+        options starts right away. When `sys.stdout` is a terminal and
+        the text does not fit on the screen, it is shown in a pager
+        (``PAGER``, see `pydoc.pager`).
         '''
+        search = self.flags.get('help') if self.flags else None
+        if not isinstance(search, str):
+            search = None
+        spec = self.getSpec()
+        if search is None and ('usage' in self.__dict__
+                               or spec._usage is not None):
+            chunks = [self.usage]
+        else:
+            chunks = spec.iterUsage(search)
 
-        self.optionList = OrderedDict(self.optionList)
+        stream = self.stdout
+        if stream is sys.stdout and stream.isatty():
+            import shutil
+            text = ''.join(chunks)
+            if hasattr(shutil, 'get_terminal_size'):
+                lines = shutil.get_terminal_size().lines
+            else:  # Python 2, same fallback as get_terminal_size
+                lines = os.environ.get('LINES', '')
+                lines = int(lines) if lines.isdigit() else 24
+            if text.count('\n') + 2 > lines:
+                import pydoc
+                pydoc.pager(text)
+                return
+            chunks = [text]
+        for chunk in chunks:
+            stream.write(chunk)
+        stream.write('\n')
 
-        # Local vars
-        longopts = []
-        padding = 0
-        shortopts = ''
+    @classmethod
+    def parseChain(cls, argv):
+        '''Parse a command and the whole chain of its subcommands
 
-        # Calculate padding needed for option arguments in usage info
-        for flag, val in self.optionList.items():
-            optlen = len(flag) + 2
-            optlen += 4 if val[0] else 0
-            optlen += len(val[1]) + 1 if val[0] and val[1] else 0
-            optlen += len(val[1]) + 1 if val[1] else 0
-            padding = optlen if optlen > padding else padding
-
-        # Create usage information and build dict of possible flags
-        opthelp = ''
-        for flag, val in self.optionList.items():
-            spec = flag + '=' if val[1] else flag
-            longopts.append(spec)
-            self.flags.update({flag: None})
-
-            if val[1]:
-                flagstring_long = ('{flag}={argument}'
-                                   .format(flag=flag, argument=val[1]))
-                if val[0]:
-                    flagstring_short = ('{flag} {argument}'
-                                        .format(flag=val[0], argument=val[1]))
-            else:
-                flagstring_long = flag
-                flagstring_short = val[0]
+        The arguments are parsed in a single pass over `argv`: every
+        subcommand continues parsing where its parent stopped. The
+        subcommands are reused when `run` dispatches to them, so every
+        level is only parsed once.
 
-            if val[0]:
-                shortopts += val[0] + ':' if val[1] else val[0]
-                optline = ('-{short}, --{flag}'
-                           .format(short=flagstring_short,
-                                   flag=flagstring_long))
-            else:
-                optline = '--{flag}'.format(flag=flagstring_long)
+        Subcommands are found in `commands`, just like `run` does. Only
+        `CommandBase` subclasses that do not override `__init__` are
+        parsed ahead, because creating them has no other effects. The
+        chain ends at any other callable, which `run` calls when it
+        dispatches to it, after the parent has checked its flags.
 
-            opthelp += ('{options:{padding}}  {desc}\n'
-                        .format(options=optline, padding=padding, desc=val[2]))
+        Subcommands given as import paths are resolved eagerly: the
+        module of the selected subcommand of every level is imported
+        here, before the `run` method of its parent, instead of when
+        `run` dispatches to it. Only the selected subcommands are
+        imported, and import errors are raised from here.
 
-        self.usage = self.usagestr
-        if self.description:
-            self.usage += '\n\n{desc}'.format(desc=self.description)
-        if self.optionList:
-            self.usage += '\n\nOptions:\n{opts}'.format(opts=opthelp)
-        if self.usageTextExtra:
-            self.usage += '\n{help}'.format(help=self.usageTextExtra)
+        :Parameters:
+            - `argv`: List of arguments. E.g. `sys.argv[1:]`
 
-        # Parse arguments and options
+        Returns a list of command objects, starting with the instance of
+        `cls` followed by the subcommand of every level.
+        '''
+        cmd = cls(argv)
+        chain = [cmd]
+        profiler = CommandSpec.profiler
+        level = profiler.level if profiler is not None else 0
         try:
-            opts, self.args = getopt.getopt(argv, shortopts, longopts)
-        except getopt.GetoptError as err:
-            self.error = err
-            return  # Stop when an invalid option is parsed
-
-        for opt in opts:
-            # Compare each option with optionList and set values for flags
-            for flag, val in self.optionList.items():
-                if opt[0][1] != '-':
-                    # Short tags
-                    if opt[0][1] == val[0]:
-                        if val[1]:
-                            self.flags[flag] = opt[1]
-                        else:
-                            self.flags[flag] = True
-                else:
-                    # Long tags
-                    if opt[0][2:] == flag:
-                        if val[1]:
-                            self.flags[flag] = opt[1]
-                        else:
-                            self.flags[flag] = True
+            while not cmd.error and cmd.args and cmd.args[0] in cmd.commands:
+                command_class = cmd.getCommand(cmd.args[0])
+                if not (isinstance(command_class, type)
+                        and issubclass(command_class, CommandBase)):
+                    break
+                # Python 2 creates a new unbound method on every access
+                init = command_class.__init__
+                if getattr(init, '__func__', init) is not _baseInit:
+                    break
+                start = len(argv) - len(cmd.args) + 1
+                if profiler is not None:
+                    # Record the parse time at the level of the subcommand
+                    profiler.level = level + len(chain)
+                child = command_class(argv, start)
+                child.parentFlags = cmd.layerFlags(child.parentFlags)
+                cmd._subcommand = (cmd.args, child)
+                chain.append(child)
+                cmd = child
+        finally:
+            if profiler is not None:
+                profiler.level = level
+        return chain
+
+    def layerFlags(self, flags):
+        '''Return a view of `flags` layered over the flags of this command
+
+        No flags are copied. Lookups fall through from `flags` to the
+        `flags` of this command, so a subcommand sees the options that
+        its parent declares and the flags registered with
+        `registerParentFlag`, but not the flags of commands further up
+        the chain unless they are registered.
+
+        :Parameters:
+            - `flags`: Dict of (registered) flags of a subcommand
+        '''
+        try:
+            from collections import ChainMap
+        except ImportError:
+            layered = dict(self.flags)
+            layered.update(flags)
+            return layered
+        return ChainMap(flags, self.flags)
+
+    def createSubcommand(self, name):
+        '''Instantiate subcommand `name` with the remaining arguments
+
+        A subcommand that was already parsed by `parseChain` is reused.
+        The `parentFlags` of the subcommand are layered over the flags
+        of this command, see `layerFlags`.
+
+        :Parameters:
+            - `name`: String. Name of subcommand in `commands`
+        '''
+        parsed = self.__dict__.get('_subcommand')
+        if (parsed is not None and parsed[0] is self.args
+                and name == self.args[0]):
+            cmd = parsed[1]
+        else:
+            cmd = self.getCommand(name)(argv=self.args[1:])
+            if isinstance(cmd, CommandBase):
+                cmd.parentFlags = self.layerFlags(cmd.parentFlags)
+        if isinstance(cmd, CommandBase):
+            cmd.stdout = self.stdout
+        return cmd
+
+    @classmethod
+    def parseMany(cls, argvs):
+        '''Parse many lists of arguments without instantiating commands
 
-        # Convert to dictobject to allow getting flags by attribute name
-        self.flags = dictobject(self.flags)
+        This is a generator that parses each list of arguments with the
+        compiled spec of the class, without rendering usage information
+        or creating command objects. Any iterable can be passed, so any
+        number of command lines can be parsed in constant memory.
+
+        :Parameters:
+            - `argvs`: Iterable of lists of arguments
+
+        Yields a tuple of (flags, args, error) for every list of
+        arguments, see `CommandSpec.parse`.
+        '''
+        parse = cls.getSpec().parse
+        for argv in argvs:
+            yield parse(argv)
+
+    def iterArgs(self):
+        '''Return an iterator of the positional arguments
+
+        When `argFiles` is set, argument files and ``-`` are expanded
+        while iterating, so `run` can process the first arguments before
+        the rest is read, in constant memory. Otherwise this iterates
+        over `args`.
+        '''
+        if not self.argFiles:
+            return iter(self.args)
+        from pycommand.argfiles import iterArgs
+        return iterArgs(self)
+
+    @classmethod
+    def getCommand(cls, name):
+        '''Return the callable of subcommand `name`
+
+        Import paths are imported on first use.
+
+        :Parameters:
+            - `name`: String. Name of subcommand in `commands`
+        '''
+        target = cls.commands[name]
+        if isinstance(target, tuple):
+            target = target[0]
+        if isinstance(target, basestring):
+            target = importCommand(target)
+        return target
+
+    @classmethod
+    def iterCommandTree(cls):
+        '''Yield (path, command class) of the whole command tree
+
+        The tree is walked breadth-first with subcommands sorted by name.
+        `path` is a tuple of subcommand names, which is empty for `cls`.
+        Subcommands given as import paths are imported. Subcommands that
+        are not `CommandBase` classes and subcommands that refer back to
+        one of their parents are left out.
+        '''
+        todo = [((), cls, ())]
+        while todo:
+            path, command, parents = todo.pop(0)
+            if (not isinstance(command, type)
+                    or not issubclass(command, CommandBase)
+                    or command in parents):
+                continue
+            yield path, command
+            for name in sorted(command.commands):
+                todo.append((path + (name, ), command.getCommand(name),
+                             parents + (command, )))
+
+    @classmethod
+    def commandList(cls):
+        '''Return a sorted list of (name, description) of subcommands
+
+        Descriptions are taken from `commands` when given as a 2-tuple,
+        or else from the `description` of commands that are already
+        imported. No modules are imported.
+        '''
+        commandList = []
+        for name, target in sorted(cls.commands.items()):
+            if isinstance(target, tuple):
+                description = target[1]
+            else:
+                description = getattr(target, 'description', '')
+            commandList.append((name, description))
+        return commandList
+
+    def fanOut(self, items=None):
+        '''Run `runItem` for many items and return the exit status
+
+        The exit status is 0 when all items succeeded, or else the
+        highest exit status of the failed items.
+
+        :Parameters:
+            - `items`: Iterable of items. Defaults to the positional
+              arguments, or the lines of stdin.
+        '''
+        from pycommand.fanout import fanOut
+        return fanOut(self, items)
 
     def run(self):
+        if self.runItem is not None:
+            return self.fanOut()
         if not self.args:
-            print(self.usage)
+            print(self.usage, file=self.stdout)
             raise CommandExit(2)
         elif self.args[0] in self.commands:
-            return self.commands[self.args[0]](argv=self.args[1:])
+            if CommandSpec.profiler is not None:
+                return CommandSpec.profiler.dispatch(self, self.args[0])
+            return self.createSubcommand(self.args[0])
         else:
             print('error: command {cmd} does not exist'
-                  .format(cmd=self.args[0]))
+                  .format(cmd=self.args[0]), file=self.stdout)
             raise CommandExit(1)
 
     def registerParentFlag(self, optionName, value):
@@ -209,15 +1246,249 @@ class CommandBase(object):
             - `optionName`: String. Name of option
             - `value`: Mixed. Value of parsed flag`
         '''
-        self.parentFlags.update({optionName: value})
+        profiler = CommandSpec.profiler
+        if profiler is None:
+            self.parentFlags.update({optionName: value})
+        else:
+            start = profiler.start()
+            self.parentFlags.update({optionName: value})
+            profiler.stop('registerParentFlag', self, start)
         return self
 
 
-def run_and_exit(command_class):
-    '''A shortcut for reading from sys.argv and exiting the interpreter'''
-    cmd = command_class(sys.argv[1:])
+_baseInit = CommandBase.__dict__['__init__']
+'''Function of `CommandBase.__init__`, see `CommandBase.parseChain`'''
+
+_compiledModules = {}
+
+
+def compiledModule(module):
+    '''Return the (path, module name) of the generated parsers of a module
+
+    Parsers generated by ``python -m pycommand compile`` are written to
+    a module next to the module of the commands, named after it with
+    ``_pycommand`` appended.
+
+    :Parameters:
+        - `module`: Module object
+    '''
+    path = module.__file__
+    stem = os.path.splitext(os.path.basename(path))[0]
+    stem = ''.join(c if c.isalnum() or c == '_' else '_' for c in stem)
+    name = stem + '_pycommand'
+    package = getattr(module, '__package__', None)
+    return (os.path.join(os.path.dirname(path), name + '.py'),
+            package + '.' + name if package else name)
+
+
+def compiledParsers(command_class):
+    '''Return the dict of generated parsers for the module of a class
+
+    Returns None when no parsers were generated, or when they were
+    generated by another version of pycommand. Only one `os.stat` is
+    done per module when there are none.
+    '''
+    moduleName = command_class.__module__
+    try:
+        return _compiledModules[moduleName]
+    except KeyError:
+        pass
+    parsers = None
+    module = sys.modules.get(moduleName)
+    if getattr(module, '__file__', None):
+        path, name = compiledModule(module)
+        if os.path.exists(path):
+            try:
+                __import__(name)
+                generated = sys.modules[name]
+            except ImportError:
+                generated = None
+            if getattr(generated, 'version', None) == __version__:
+                parsers = generated.parsers
+    _compiledModules[moduleName] = parsers
+    return parsers
+
+
+_importedCommands = {}
+
+
+def importCommand(path):
+    '''Import a command by its path and cache it
+
+    :Parameters:
+        - `path`: String. Import path, either like ``package.module:Class``
+          or ``package.module.Class``
+    '''
+    try:
+        return _importedCommands[path]
+    except KeyError:
+        pass
+    if ':' in path:
+        moduleName, _, attr = path.partition(':')
+    else:
+        moduleName, _, attr = path.rpartition('.')
+    import importlib
+    command = importlib.import_module(moduleName)
+    for name in attr.split('.'):
+        command = getattr(command, name)
+    _importedCommands[path] = command
+    return command
+
+
+_eventLoops = None
+
+
+def getEventLoop():
+    '''Return the event loop that is shared by all commands of a thread
+
+    The loop is created on first use, so programs without coroutines
+    never import `asyncio`.
+    '''
+    global _eventLoops
+    if _eventLoops is None:
+        import threading
+        _eventLoops = threading.local()
+    loop = getattr(_eventLoops, 'loop', None)
+    if loop is None or loop.is_closed():
+        import asyncio
+        loop = _eventLoops.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+    return loop
+
+
+def closeEventLoop():
+    '''Close the event loop of the current thread, if it has one'''
+    loop = getattr(_eventLoops, 'loop', None)
+    if loop is not None:
+        _eventLoops.loop = None
+        loop.close()
+
+
+def awaitResult(result, stdout=None):
+    '''Run `result` on the shared event loop if it is awaitable
+
+    This makes ``async def run(self)`` work for commands and for
+    subcommands, whose coroutine is usually returned by the `run` method
+    of their parent. An interrupt cancels the running task, which gets
+    the chance to clean up, and results in exit status 130.
+
+    :Parameters:
+        - `result`: Return value of a `run` method
+        - `stdout`: Stream to end the line of ``^C`` on after an
+          interrupt, defaults to `sys.stdout`
+
+    Returns `result`, or the result of awaiting it.
+    '''
+    while hasattr(result, '__await__'):
+        import asyncio
+        import signal
+        loop = getEventLoop()
+        task = asyncio.ensure_future(result, loop=loop)
+        interrupted = []
+
+        def interrupt():
+            interrupted.append(True)
+            task.cancel()
+        try:
+            loop.add_signal_handler(signal.SIGINT, interrupt)
+            handled = True
+        except (NotImplementedError, RuntimeError, ValueError):
+            handled = False
+        try:
+            result = loop.run_until_complete(task)
+        except KeyboardInterrupt:
+            interrupt()
+        except asyncio.CancelledError:
+            if not interrupted:
+                raise
+        finally:
+            if handled:
+                loop.remove_signal_handler(signal.SIGINT)
+        if interrupted:
+            if not task.done():
+                try:
+                    loop.run_until_complete(task)
+                except (asyncio.CancelledError, KeyboardInterrupt):
+                    pass
+            print('', file=sys.stdout if stdout is None else stdout)
+            return 130
+    return result
+
+
+def execute(command_class, argv, stdout=None):
+    '''Parse `argv` and run the command without exiting the interpreter
+
+    This is what `run_and_exit` does after reading `sys.argv`.
+
+    `execute` is reentrant and may be called from many threads at once.
+    Parsing only depends on `command_class` and `argv`: the compiled
+    `CommandSpec` of a class is shared, but never changed after it is
+    compiled, and every command object gets its own flags. Output of
+    pycommand goes to `stdout`, which is also set as the `stdout`
+    attribute of the command and its subcommands. Commands that write
+    to it instead of `sys.stdout` can be run concurrently with separate
+    output streams.
+
+    :Parameters:
+        - `command_class`: The main `CommandBase` subclass
+        - `argv`: List of arguments. E.g. `sys.argv[1:]`
+        - `stdout`: Stream to write output to, defaults to `sys.stdout`
+
+    Returns the (awaited) return value of `run`, or 1 when the arguments
+    could not be parsed. See `exitStatus`.
+    '''
+    stdout = sys.stdout if stdout is None else stdout
+    profiler = CommandSpec.profiler
+    if profiler is not None:
+        profiler.startup()
+    chain = command_class.parseChain(argv)
+    for cmd in chain:
+        cmd.stdout = stdout
+    cmd = chain[0]
     if cmd.error:
-        print('error: {0}'.format(cmd.error))
-        sys.exit(1)
+        print('error: {0}'.format(cmd.error), file=stdout)
+        return 1
+    elif profiler is None:
+        return awaitResult(cmd.run(), stdout)
     else:
-        sys.exit(cmd.run())
+        start = profiler.start()
+        status = awaitResult(cmd.run(), stdout)
+        profiler.stop('run', cmd, start)
+        return status
+
+
+def exitStatus(code):
+    '''Convert the argument of `sys.exit` to an exit status
+
+    Like the interpreter does, strings are written to stderr and
+    result in exit status 1.
+    '''
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    sys.stderr.write('{}\n'.format(code))
+    return 1
+
+
+def run_and_exit(command_class):
+    '''A shortcut for reading from sys.argv and exiting the interpreter
+
+    When the first argument is ``--pycommand-profile[=<path>]``, it is
+    removed and phase timings are recorded, see `pycommand.timing`.
+    '''
+    argv = sys.argv[1:]
+    if argv and argv[0].partition('=')[0] == '--pycommand-profile':
+        from pycommand import timing
+        timing.enable(argv.pop(0).partition('=')[2] or '-')
+    sys.exit(execute(command_class, argv))
+
+
+if os.environ.get('PYCOMMAND_CACHE'):
+    from pycommand.cache import enable
+    enable(os.environ['PYCOMMAND_CACHE'])
+
+if os.environ.get('PYCOMMAND_PROFILE'):
+    from pycommand.timing import enable
+    enable('-' if os.environ['PYCOMMAND_PROFILE'] == '1'
+           else os.environ['PYCOMMAND_PROFILE'])
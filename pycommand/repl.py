@@ -0,0 +1,248 @@
+# Copyright (c) 2013-2016, 2018  Benjamin Althues <benjamin@babab.nl>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+from __future__ import absolute_import, print_function
+
+'''
+Interactive REPL for pycommand programs.
+
+The REPL keeps a command tree and its imported subcommands in memory and
+runs every line that is entered as the arguments of the main command, so
+only the first command pays for starting Python and importing modules::
+
+    $ python -m pycommand repl mytool.cli:MainCommand
+    mytool> deploy --env staging
+    ...
+    mytool> status
+    ...
+    mytool> exit
+
+Or start it from a program with `repl_and_exit`. Lines are split with
+shell quoting rules by `shlex` and run with `pycommand.execute`, just
+like `run_and_exit` runs a command line. Errors and `CommandExit` end
+the command, not the REPL. When the `readline` module is available,
+lines are kept in a history file and subcommands and options are
+completed with the tab key.
+'''
+
+import os
+import shlex
+import sys
+
+from pycommand.pycommand import (
+    CommandExit,
+    execute,
+    exitStatus,
+)
+
+try:
+    input = raw_input
+except NameError:
+    pass
+
+
+class Repl(object):
+    '''Read-eval-print loop for a command tree
+
+    :Parameters:
+        - `command_class`: The main `CommandBase` subclass
+        - `name`: String. Name of the program, used for the prompt and
+          the default history file. Defaults to the name in `usagestr`.
+        - `historyFile`: String. Path of the history file, or None to
+          only keep history in memory
+        - `stdin`: Stream to read lines from instead of the terminal
+        - `stdout`: Stream to write output to, defaults to `sys.stdout`
+    '''
+
+    exitCommands = ('exit', 'quit')
+    '''Tuple of lines that end the REPL, like end of input does'''
+
+    def __init__(self, command_class, name=None, historyFile=None,
+                 stdin=None, stdout=None):
+        from pycommand.completion import defaultName
+        self.command_class = command_class
+        self.name = name or defaultName(command_class)
+        self.prompt = '{}> '.format(self.name)
+        self.historyFile = historyFile
+        self.stdin = stdin
+        self.stdout = stdout
+        self.status = 0
+        '''Integer. Exit status of the last command'''
+
+        self.matches = []
+        '''List of completions of the word that is being completed'''
+
+    def readLine(self):
+        '''Return the next line, raise EOFError at the end of input'''
+        if self.stdin is None:
+            return input(self.prompt)
+        line = self.stdin.readline()
+        if not line:
+            raise EOFError
+        return line.rstrip('\r\n')
+
+    def runLine(self, line):
+        '''Run a line of input and return the exit status
+
+        Returns None for lines that end the REPL.
+        '''
+        stdout = self.stdout or sys.stdout
+        try:
+            argv = shlex.split(line)
+        except ValueError as e:
+            print('error: {}'.format(e), file=stdout)
+            return 2
+        if not argv:
+            return self.status
+        if len(argv) == 1 and argv[0] in self.exitCommands:
+            return None
+        try:
+            return exitStatus(execute(self.command_class, argv, stdout))
+        except CommandExit as e:
+            return e.err if isinstance(e.err, int) else 1
+        except SystemExit as e:
+            return exitStatus(e.code)
+        except KeyboardInterrupt:
+            print('', file=stdout)
+            return 130
+        except Exception as e:
+            print('error: {}: {}'.format(type(e).__name__, e), file=stdout)
+            return 1
+
+    def loop(self):
+        '''Run lines until the end of input and return the last status'''
+        readline = self.setupReadline()
+        try:
+            while True:
+                try:
+                    line = self.readLine()
+                except EOFError:
+                    if self.stdin is None:
+                        print('')
+                    break
+                except KeyboardInterrupt:
+                    print('')
+                    continue
+                status = self.runLine(line)
+                if status is None:
+                    break
+                self.status = status
+        finally:
+            if readline is not None and self.historyFile:
+                try:
+                    readline.write_history_file(self.historyFile)
+                except (IOError, OSError):
+                    pass
+        return self.status
+
+    def setupReadline(self):
+        '''Enable history and completion, return the readline module'''
+        if self.stdin is not None:
+            return None
+        try:
+            import readline
+        except ImportError:
+            return None
+        if self.historyFile:
+            try:
+                readline.read_history_file(self.historyFile)
+            except (IOError, OSError):
+                pass
+        readline.set_completer_delims(' \t\n')
+        readline.set_completer(self.complete)
+        readline.parse_and_bind('tab: complete')
+        return readline
+
+    def complete(self, text, state):
+        '''Completer function for `readline.set_completer`'''
+        if state == 0:
+            import readline
+            line = readline.get_line_buffer()[:readline.get_endidx()]
+            self.matches = self.completions(line)
+        try:
+            return self.matches[state]
+        except IndexError:
+            return None
+
+    def completions(self, line):
+        '''Return the completions of the last word of `line`
+
+        Subcommands are looked up in `commands` and options in the
+        `optionList` of the (sub)command that the word belongs to.
+        '''
+        try:
+            words = shlex.split(line)
+        except ValueError:
+            return []
+        text = ''
+        if words and line and not line[-1].isspace():
+            text = words.pop()
+
+        command = self.command_class
+        subcommands = True
+        needsArgument = False
+        for word in words:
+            spec = command.getSpec()
+            if needsArgument:
+                needsArgument = False
+            elif word.startswith('--'):
+                opt, sep, value = word[2:].partition('=')
+                try:
+                    flag, hasArg = spec.resolveLong(opt)
+                except Exception:
+                    continue
+                needsArgument = hasArg and not sep
+            elif word.startswith('-') and word != '-':
+                for pos, char in enumerate(word[1:]):
+                    if spec.shortIndex.get(char, (None, False))[1]:
+                        needsArgument = pos == len(word) - 2
+                        break
+            elif subcommands and word in command.commands:
+                target = command.getCommand(word)
+                if not hasattr(target, 'getSpec'):
+                    return []
+                command = target
+            else:
+                subcommands = False
+        if needsArgument:
+            return []
+
+        if text.startswith('-'):
+            words = []
+            for flag, val in command.getSpec().optionList.items():
+                if val[0]:
+                    words.append('-' + val[0])
+                words.append('--{}{}'.format(flag, '=' if val[1] else ''))
+        elif subcommands:
+            words = sorted(command.commands)
+        else:
+            words = []
+        return [word for word in words if word.startswith(text)]
+
+
+def repl_and_exit(command_class, name=None, historyFile=None):
+    '''Run a `Repl` for `command_class` and exit with its last status
+
+    :Parameters:
+        - `command_class`: The main `CommandBase` subclass
+        - `name`: String. Name of the program, see `Repl`
+        - `historyFile`: String. Path of the history file, defaults to
+          ``~/.<name>_history``
+    '''
+    repl = Repl(command_class, name)
+    if historyFile is None:
+        historyFile = os.path.join(os.path.expanduser('~'),
+                                   '.{}_history'.format(repl.name))
+    repl.historyFile = historyFile
+    sys.exit(repl.loop())
@@ -0,0 +1,475 @@
+# Copyright (c) 2013-2016, 2018  Benjamin Althues <benjamin@babab.nl>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+from __future__ import absolute_import
+
+'''
+Resident server mode for pycommand programs.
+
+Most of the time of a short command is spent starting the interpreter
+and importing modules. In server mode a daemon keeps the command tree
+imported and listens on a UNIX socket. The executable of the program
+becomes a small client that forwards its argv, environment, working
+directory and stdin/stdout/stderr file descriptors to the daemon. The
+daemon forks a worker that runs the command with `run_and_exit` and
+relays its exit status back to the client.
+
+The executable of a program that uses server mode looks like this::
+
+    #!/usr/bin/env python
+    from pycommand.server import forward_and_exit
+    forward_and_exit('mytool.cli:MainCommand', version='1.2.0')
+
+The daemon is started on first use and shuts down after being idle for
+`IDLE_TIMEOUT` seconds. When the client and daemon disagree about the
+version of the program, pycommand or Python, the daemon exits and a new
+one is started. Set ``PYCOMMAND_SERVER=0`` to run commands in-process,
+which is also done on platforms without UNIX sockets.
+
+Sockets are created in a directory that only the user can access, see
+`socketDirectory`, and both sides check that the other end of the
+connection runs as the same user where the platform supports it.
+
+Server mode requires Python 3.3 or later.
+'''
+
+import os
+import socket
+import struct
+import sys
+
+from pycommand.pycommand import (
+    __version__,
+    exitStatus,
+    importCommand,
+    run_and_exit,
+)
+
+IDLE_TIMEOUT = 600
+'''Number of seconds after which an idle daemon exits'''
+
+HEADER = struct.Struct('!I')
+STATUS = struct.Struct('!ci')
+
+
+def socketDirectory():
+    '''Return the private directory of the sockets of the user
+
+    This is ``$XDG_RUNTIME_DIR/pycommand``, or ``pycommand-<uid>`` in
+    the temporary directory (``/tmp``) when ``XDG_RUNTIME_DIR`` is not
+    set. The directory is created with mode 0700. Raises OSError when it
+    is not a directory that is owned by the user and that only the user
+    can access, because a socket in it could belong to someone else.
+    '''
+    import stat
+    import tempfile
+    runtime = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime:
+        directory = os.path.join(runtime, 'pycommand')
+    else:
+        directory = os.path.join(tempfile.gettempdir(),
+                                 'pycommand-{}'.format(os.getuid()))
+    try:
+        os.mkdir(directory, 0o700)
+    except OSError:
+        pass
+    info = os.lstat(directory)
+    if (not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid()
+            or info.st_mode & 0o077):
+        raise OSError('{} is not a private directory of the user'
+                      .format(directory))
+    return directory
+
+
+def socketPath(target):
+    '''Return the default socket path of the daemon for `target`
+
+    The path is in `socketDirectory`, which is created if needed.
+
+    :Parameters:
+        - `target`: String. Import path of the main command class
+    '''
+    name = ''.join(c if c.isalnum() else '-' for c in target)
+    return os.path.join(socketDirectory(), name + '.sock')
+
+
+def peerUid(conn):
+    '''Return the user id of the process at the other end of `conn`
+
+    Returns None when the platform cannot tell (no ``SO_PEERCRED``).
+    '''
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                            struct.calcsize('3i'))
+    return struct.unpack('3i', creds)[1]
+
+
+def isSameUser(conn):
+    '''Check that the other end of `conn` is not another user'''
+    return peerUid(conn) in (None, os.getuid())
+
+
+def versionToken(target, version=''):
+    '''Return the string that client and daemon must agree on
+
+    :Parameters:
+        - `target`: String. Import path of the main command class
+        - `version`: String. Version of the program
+    '''
+    return '{} {} pycommand-{} {} {}'.format(target, version, __version__,
+                                             sys.executable,
+                                             sys.version.split()[0])
+
+
+def encodeRequest(token, argv, environ, cwd):
+    '''Encode a request of the client as bytes'''
+    fields = [token, cwd, str(len(argv))] + list(argv)
+    fields += ['{}={}'.format(key, val) for key, val in environ.items()]
+    payload = b'\0'.join(os.fsencode(field) for field in fields)
+    return HEADER.pack(len(payload)) + payload
+
+
+def decodeRequest(payload):
+    '''Decode a request to a tuple of (token, argv, environ, cwd)'''
+    fields = [os.fsdecode(field) for field in payload.split(b'\0')]
+    token, cwd, argc = fields[:3]
+    argv = fields[3:3 + int(argc)]
+    environ = dict(field.split('=', 1) for field in fields[3 + int(argc):])
+    return token, argv, environ, cwd
+
+
+def recvRequest(conn):
+    '''Receive a request and its stdio file descriptors'''
+    import array
+    fds = array.array('i')
+    data, ancdata, flags, addr = conn.recvmsg(
+        65536, socket.CMSG_SPACE(3 * fds.itemsize))
+    for level, ctype, cdata in ancdata:
+        if level == socket.SOL_SOCKET and ctype == socket.SCM_RIGHTS:
+            fds.frombytes(cdata[:len(cdata) - len(cdata) % fds.itemsize])
+    while len(data) < HEADER.size or (
+            len(data) < HEADER.size + HEADER.unpack(data[:HEADER.size])[0]):
+        chunk = conn.recv(65536)
+        if not chunk:
+            raise EOFError('incomplete request')
+        data += chunk
+    return data[HEADER.size:], list(fds)
+
+
+class Daemon(object):
+    '''Daemon that runs commands of a command tree in forked workers
+
+    :Parameters:
+        - `target`: String. Import path of the main command class
+        - `path`: String. Path of the UNIX socket to listen on
+        - `token`: String. Version token, see `versionToken`
+        - `idleTimeout`: Number of seconds after which an idle daemon exits
+    '''
+
+    def __init__(self, target, path, token, idleTimeout=IDLE_TIMEOUT):
+        self.target = target
+        self.path = path
+        self.token = token
+        self.idleTimeout = idleTimeout
+        self.workers = set()
+        self.listener = None
+        self.command_class = importCommand(target)
+        self.command_class.getSpec()
+
+    def listen(self):
+        '''Bind the socket, unless another daemon is already listening'''
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+        except (IOError, OSError):
+            pass
+        else:
+            return None
+        finally:
+            probe.close()
+
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # No one else may connect between bind and chmod
+        mask = os.umask(0o077)
+        try:
+            listener.bind(self.path)
+        finally:
+            os.umask(mask)
+        os.chmod(self.path, 0o600)
+        listener.listen(64)
+        listener.settimeout(self.idleTimeout)
+        return listener
+
+    def serve(self):
+        '''Accept requests until the daemon is idle or replaced'''
+        self.listener = self.listen()
+        if self.listener is None:
+            return 0
+        try:
+            while True:
+                try:
+                    conn, addr = self.listener.accept()
+                except socket.timeout:
+                    self.reap()
+                    if not self.workers:
+                        return 0
+                    continue
+                conn.settimeout(None)
+                try:
+                    if not isSameUser(conn):
+                        continue
+                    if not self.handle(conn):
+                        return 0
+                finally:
+                    conn.close()
+                self.reap()
+        finally:
+            self.close()
+
+    def close(self):
+        '''Stop listening, so that clients start a new daemon'''
+        if self.listener is None:
+            return
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        self.listener.close()
+        self.listener = None
+
+    def handle(self, conn):
+        '''Fork a worker for the request on `conn`
+
+        Returns False when the daemon should stop because the client
+        expects another version.
+        '''
+        try:
+            payload, fds = recvRequest(conn)
+        except (IOError, OSError, EOFError, struct.error):
+            return True
+        try:
+            token, argv, environ, cwd = decodeRequest(payload)
+            if token != self.token:
+                self.close()
+                conn.sendall(STATUS.pack(b'R', 0))
+                return False
+            sys.stdout.flush()
+            sys.stderr.flush()
+            pid = os.fork()
+            if pid == 0:
+                self.listener.close()
+                self.work(conn, fds, argv, environ, cwd)
+            self.workers.add(pid)
+        finally:
+            for fd in fds:
+                os.close(fd)
+        return True
+
+    def work(self, conn, fds, argv, environ, cwd):
+        '''Run the command in the forked worker process and exit'''
+        status = 1
+        try:
+            conn.sendall(STATUS.pack(b'P', os.getpid()))
+            for target, fd in enumerate(fds[:3]):
+                os.dup2(fd, target)
+            os.chdir(cwd)
+            os.environ.clear()
+            os.environ.update(environ)
+            sys.argv = argv
+            try:
+                run_and_exit(self.command_class)
+            except SystemExit as exit:
+                status = exitStatus(exit.code)
+            except KeyboardInterrupt:
+                sys.stderr.write('\n')
+                status = 130
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                conn.sendall(STATUS.pack(b'X', status))
+            finally:
+                os._exit(status)
+
+    def reap(self):
+        '''Collect exited worker processes'''
+        for pid in list(self.workers):
+            try:
+                done, _ = os.waitpid(pid, os.WNOHANG)
+            except OSError:
+                done = pid
+            if done:
+                self.workers.discard(pid)
+
+
+def serve(target, path=None, version='', idleTimeout=IDLE_TIMEOUT):
+    '''Run the daemon for `target` in the current process
+
+    :Parameters:
+        - `target`: String. Import path of the main command class
+        - `path`: String. Socket path, defaults to `socketPath`
+        - `version`: String. Version of the program
+        - `idleTimeout`: Number of seconds after which an idle daemon exits
+    '''
+    daemon = Daemon(target, path or socketPath(target),
+                    versionToken(target, version), idleTimeout)
+    return daemon.serve()
+
+
+def spawn(target, path, version, idleTimeout):
+    '''Start a detached daemon process and return its `subprocess.Popen`
+
+    The daemon gets the `sys.path` of the client as ``PYTHONPATH``, so
+    that it can import the commands from wherever the client can, e.g.
+    from the directory of the script.
+    '''
+    import subprocess
+    paths = [os.path.abspath(entry) for entry in sys.path]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(paths))
+    devnull = open(os.devnull, 'r+b')
+    try:
+        return subprocess.Popen(
+            [sys.executable, '-m', 'pycommand.server', target, path,
+             version, str(idleTimeout)],
+            stdin=devnull, stdout=devnull, stderr=devnull, env=env,
+            close_fds=True, start_new_session=True,
+        )
+    finally:
+        devnull.close()
+
+
+def connect(path, attempts=1, process=None):
+    '''Connect to the socket at `path`, or return None
+
+    Raises OSError when the socket belongs to another user.
+
+    :Parameters:
+        - `path`: String. Path of the socket
+        - `attempts`: Integer. Number of tries, 10 ms apart
+        - `process`: `subprocess.Popen` of a spawned daemon. Gives up
+          as soon as it has exited, e.g. when it cannot import the
+          commands.
+    '''
+    import time
+    for attempt in range(attempts):
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            conn.connect(path)
+        except (IOError, OSError):
+            conn.close()
+            if process is not None and process.poll() is not None:
+                break
+            if attempt + 1 < attempts:
+                time.sleep(0.01)
+            continue
+        if not isSameUser(conn):
+            conn.close()
+            raise OSError('socket {} belongs to another user'.format(path))
+        return conn
+    return None
+
+
+def forward(conn, request):
+    '''Send `request` to the daemon and wait for the exit status
+
+    Interrupts of the client are passed on to the worker. Returns None
+    when the request should be retried with a new daemon, because the
+    daemon expects another version or went away before starting a
+    worker.
+    '''
+    import signal
+    fds = [sys.stdin.fileno(), sys.stdout.fileno(), sys.stderr.fileno()]
+    pid = None
+    data = b''
+    try:
+        conn.sendmsg([request], [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                                  struct.pack('3i', *fds))])
+    except (IOError, OSError):
+        return None
+    while True:
+        try:
+            chunk = conn.recv(STATUS.size - len(data))
+        except KeyboardInterrupt:
+            if pid:
+                os.kill(pid, signal.SIGINT)
+            continue
+        except (IOError, OSError):
+            chunk = b''
+        if not chunk:
+            return 1 if pid else None
+        data += chunk
+        if len(data) < STATUS.size:
+            continue
+        kind, value = STATUS.unpack(data)
+        data = b''
+        if kind == b'P':
+            pid = value
+        elif kind == b'R':
+            return None
+        else:
+            return value
+
+
+def forward_and_exit(target, version='', path=None, idleTimeout=IDLE_TIMEOUT):
+    '''Run `target` in a resident daemon and exit with its exit status
+
+    Falls back to running the command in-process when server mode is
+    disabled with ``PYCOMMAND_SERVER=0`` or not supported.
+
+    :Parameters:
+        - `target`: String. Import path of the main command class
+        - `version`: String. Version of the program
+        - `path`: String. Socket path, defaults to `socketPath`
+        - `idleTimeout`: Number of seconds after which an idle daemon exits
+    '''
+    if (os.environ.get('PYCOMMAND_SERVER') == '0'
+            or not hasattr(socket, 'AF_UNIX')
+            or not hasattr(socket.socket, 'sendmsg')):
+        run_and_exit(importCommand(target))
+
+    request = encodeRequest(versionToken(target, version), sys.argv,
+                            os.environ, os.getcwd())
+    sys.stdout.flush()
+    sys.stderr.flush()
+    for attempt in range(2):
+        try:
+            path = path or socketPath(target)
+            conn = connect(path)
+            if conn is None:
+                process = spawn(target, path, version, idleTimeout)
+                conn = connect(path, attempts=200, process=process)
+        except (IOError, OSError):
+            conn = None
+        if conn is None:
+            break
+        try:
+            status = forward(conn, request)
+        finally:
+            conn.close()
+        if status is not None:
+            sys.exit(status)
+    run_and_exit(importCommand(target))
+
+
+if __name__ == '__main__':
+    sys.exit(serve(sys.argv[1], sys.argv[2], sys.argv[3],
+                   float(sys.argv[4])))
@@ -29,8 +29,9 @@ class $classname(pycommand.CommandBase):
     # The order in which you define the options will be the order
     # in which they will appear in the usage message
     optionList = (
-        ('help', ('h', False, 'show this help information')),
-
+        ('help', ('h', False, 'show this help information',
+                  {'search': True})),
+$options
         # To specify that an option requires an argument just add a
         # string that describes it
 
@@ -66,7 +67,7 @@ class $classname(pycommand.CommandBase):
 
         '''
         if self.flags.help:
-            print(self.usage)
+            self.printHelp()
             return 0
         # elif self.flags.version:
         #     print('Python version ' + sys.version.split()[0])
@@ -101,14 +102,15 @@ class $classname(pycommand.CommandBase):
     usagestr = 'usage: $name [options]'
     description = __doc__
     optionList = (
-        ('help', ('h', False, 'show this help information')),
-        # ('file', ('f', '<filename>', 'use specified file')),
+        ('help', ('h', False, 'show this help information',
+                  {'search': True})),
+$options        # ('file', ('f', '<filename>', 'use specified file')),
         # ('version', ('', False, 'show version information')),
     )
 
     def run(self):
         if self.flags.help:
-            print(self.usage)
+            self.printHelp()
             return 0
         # elif self.flags.version:
         #     print('Python version ' + sys.version.split()[0])
@@ -172,7 +174,9 @@ class $classname(pycommand.CommandBase):
     commands = {'help': HelpCommand,
                 'version': VersionCommand}
 
-    optionList = (('file', ('f', '<filename>', 'use specified file')), )
+    optionList = (
+        ('file', ('f', '<filename>', 'use specified file')),
+$options    )
 
     # Optional extra usage information
     usageTextExtra = (
@@ -264,7 +268,9 @@ class $classname(pycommand.CommandBase):
 
     commands = {'help': HelpCommand,
                 'version': VersionCommand}
-    optionList = (('file', ('f', '<filename>', 'use specified file')), )
+    optionList = (
+        ('file', ('f', '<filename>', 'use specified file')),
+$options    )
     usageTextExtra = (
         "See '$name help <command>' for more information on a "
         "specific command."
@@ -0,0 +1,179 @@
+# Copyright (c) 2013-2016, 2018  Benjamin Althues <benjamin@babab.nl>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+from __future__ import absolute_import
+
+'''
+In-process invocation of pycommand programs, for testing.
+
+`invoke` runs a command class like `run_and_exit` does, but returns the
+exit status and the captured stdout and stderr instead of exiting the
+interpreter. This is much faster than running a program with
+`subprocess`::
+
+    from pycommand.testing import invoke
+
+    def test_version():
+        result = invoke(MainCommand, ['--version'])
+        assert result.status == 0
+        assert result.stdout == 'mytool 1.2.0\\n'
+
+Invocations may run concurrently in threads. While any invocation is
+running, `sys.stdin`, `sys.stdout` and `sys.stderr` are replaced by
+proxies that use the streams of the invocation of the current thread,
+and the original streams in other threads. Every invocation gets its own
+event loop for coroutine `run` methods.
+
+`sys.argv` is set to the program name and the arguments of an invocation
+while it runs, and restored when no invocation is running anymore. It is
+shared by all threads, so during concurrent invocations it holds the
+arguments of the invocation that started last.
+
+Process-wide state that commands change themselves, such as the working
+directory, environment variables or class attributes, is not isolated.
+Invoking commands concurrently that change the working directory or the
+environment is unsafe.
+Output written by other threads that a command starts itself, e.g. the
+pool threads of `CommandBase.runItem`, is not captured.
+'''
+
+import sys
+import threading
+
+try:
+    from StringIO import StringIO  # Python 2, accepts str and unicode
+except ImportError:
+    from io import StringIO
+
+from pycommand.pycommand import (
+    CommandExit,
+    closeEventLoop,
+    execute,
+    exitStatus,
+)
+
+_lock = threading.Lock()
+_local = threading.local()
+_active = 0
+_originals = None
+
+
+class Result(object):
+    '''Outcome of an invocation, see `invoke`'''
+
+    def __init__(self, status, stdout, stderr, exception):
+        self.status = status
+        '''Integer. Exit status that `run_and_exit` would exit with'''
+
+        self.stdout = stdout
+        '''String. Everything written to stdout'''
+
+        self.stderr = stderr
+        '''String. Everything written to stderr'''
+
+        self.exception = exception
+        '''The `CommandExit` raised by the command, or None'''
+
+    def __repr__(self):
+        return 'Result(status={!r}, stdout={!r}, stderr={!r})'.format(
+            self.status, self.stdout, self.stderr)
+
+
+class ThreadStream(object):
+    '''Proxy of a standard stream that is redirected per thread
+
+    :Parameters:
+        - `stream`: String. 'stdin', 'stdout' or 'stderr'
+        - `original`: Stream used by threads that are not invoking
+    '''
+
+    def __init__(self, stream, original):
+        self.stream = stream
+        self.original = original
+
+    def target(self):
+        '''Return the stream of the current thread'''
+        streams = getattr(_local, 'streams', None)
+        if streams is None:
+            return self.original
+        return streams[self.stream]
+
+    def __getattr__(self, name):
+        return getattr(self.target(), name)
+
+    def __iter__(self):
+        return iter(self.target())
+
+
+def install(argv):
+    '''Replace the standard streams by `ThreadStream` proxies
+
+    `sys.argv` is set to the program name followed by `argv`.
+    '''
+    global _active, _originals
+    with _lock:
+        if not _active:
+            _originals = (sys.stdin, sys.stdout, sys.stderr, sys.argv)
+            sys.stdin = ThreadStream('stdin', sys.stdin)
+            sys.stdout = ThreadStream('stdout', sys.stdout)
+            sys.stderr = ThreadStream('stderr', sys.stderr)
+        sys.argv = _originals[3][:1] + list(argv)
+        _active += 1
+
+
+def uninstall():
+    '''Restore the streams and `sys.argv` when no invocation is running'''
+    global _active, _originals
+    with _lock:
+        _active -= 1
+        if not _active:
+            sys.stdin, sys.stdout, sys.stderr, sys.argv = _originals
+            _originals = None
+
+
+def invoke(command_class, argv=(), stdin=''):
+    '''Run a command in-process and return a `Result`
+
+    The arguments are parsed and the command is run like `run_and_exit`
+    does, but calls to `sys.exit` and raised `CommandExit` exceptions
+    end the invocation instead of the interpreter. Other exceptions are
+    not caught. `sys.argv` holds the program name and `argv` while the
+    command runs.
+
+    :Parameters:
+        - `command_class`: The main `CommandBase` subclass
+        - `argv`: List of arguments, without the program name
+        - `stdin`: String. Input that the command reads from stdin
+    '''
+    stdout = StringIO()
+    stderr = StringIO()
+    exception = None
+    install(argv)
+    previous = getattr(_local, 'streams', None)
+    _local.streams = {'stdin': StringIO(stdin), 'stdout': stdout,
+                      'stderr': stderr}
+    try:
+        try:
+            status = exitStatus(execute(command_class, list(argv), stdout))
+        except CommandExit as e:
+            exception = e
+            status = e.err if isinstance(e.err, int) else 1
+        except SystemExit as e:
+            status = exitStatus(e.code)
+        finally:
+            closeEventLoop()
+    finally:
+        _local.streams = previous
+        uninstall()
+    return Result(status, stdout.getvalue(), stderr.getvalue(), exception)
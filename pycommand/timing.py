@@ -0,0 +1,224 @@
+# Copyright (c) 2013-2016, 2018  Benjamin Althues <benjamin@babab.nl>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+from __future__ import absolute_import, print_function
+
+'''
+Phase timing of pycommand programs.
+
+When enabled, the wall and CPU time of these phases is recorded for
+every level of the subcommand chain (the main command is level 0):
+
+    startup             From importing pycommand until `run_and_exit`
+                        (CPU time is counted from the start of the
+                        process, so it includes interpreter startup)
+    spec                Compiling the `CommandSpec` of a class
+    usage               Rendering usage information
+    parse               Parsing arguments
+    dispatch            Looking up and instantiating a subcommand
+    registerParentFlag  Registering a flag of a parent command
+    run                 Running the `run` method of a command
+
+Enable timing for a single invocation of a program with::
+
+    $ PYCOMMAND_PROFILE=1 mytool <args>               # print a breakdown
+    $ PYCOMMAND_PROFILE=profile.json mytool <args>    # write JSON
+    $ mytool --pycommand-profile[=profile.json] <args>
+
+The ``--pycommand-profile`` flag is only recognized as the first
+argument and is handled by `run_and_exit`. From Python, call `enable`
+and use `addHook` to receive every record as it is made. When timing is
+disabled, pycommand only checks ``CommandSpec.profiler is None``.
+'''
+
+from collections import OrderedDict
+import atexit
+import json
+import sys
+import time
+
+from pycommand.pycommand import (
+    CommandSpec,
+    importedAt,
+)
+
+try:
+    processTime = time.process_time
+except AttributeError:  # Python 2
+    processTime = time.clock
+
+_outputs = []
+'''List of outputs of `writeOutputs` at exit, see `enable`'''
+
+
+def commandName(command):
+    '''Return the name of a command given as string, class or object'''
+    if isinstance(command, str):
+        return command
+    return getattr(command, '__name__', type(command).__name__)
+
+
+class Profiler(object):
+    '''Records the timing of pycommand phases'''
+
+    def __init__(self):
+        self.records = []
+        '''List of records, see `stop`'''
+
+        self.hooks = []
+        '''List of callables that are called with every record'''
+
+        self.level = 0
+        '''Level in the subcommand chain of the current phase'''
+
+    def start(self):
+        '''Return the start times of a phase'''
+        return time.time(), processTime()
+
+    def stop(self, phase, command, start):
+        '''Record a phase and pass it to all hooks
+
+        :Parameters:
+            - `phase`: String. Name of phase
+            - `command`: Command class or object
+            - `start`: Return value of `start`
+        '''
+        record = {
+            'phase': phase,
+            'level': self.level,
+            'command': commandName(command),
+            'wall': time.time() - start[0],
+            'cpu': processTime() - start[1],
+        }
+        self.records.append(record)
+        for hook in self.hooks:
+            hook(record)
+        return record
+
+    def startup(self):
+        '''Record the startup phase'''
+        self.stop('startup', '-', (importedAt, 0.0))
+
+    def dispatch(self, parent, name):
+        '''Instantiate subcommand `name` of `parent` one level deeper
+
+        The `run` method of the subcommand is wrapped to record its
+        timing as well.
+        '''
+        level = self.level
+        self.level = level + 1
+        try:
+            start = self.start()
+            cmd = parent.createSubcommand(name)
+            self.stop('dispatch', cmd, start)
+        finally:
+            self.level = level
+        if hasattr(cmd, 'run'):
+            cmd.run = self.timedRun(cmd, cmd.run, level + 1)
+        return cmd
+
+    def timedRun(self, cmd, run, level):
+        '''Wrap the `run` method of `cmd` to record it at `level`'''
+        def timedRun(*args, **kwargs):
+            previous = self.level
+            self.level = level
+            try:
+                start = self.start()
+                return run(*args, **kwargs)
+            finally:
+                self.stop('run', cmd, start)
+                self.level = previous
+        return timedRun
+
+    def summary(self):
+        '''Return a list of totals per (level, command, phase)
+
+        Each item is a dict with the keys of a record and a count. The
+        totals are sorted by level and then by first occurrence.
+        '''
+        totals = OrderedDict()
+        for record in self.records:
+            key = (record['level'], record['command'], record['phase'])
+            total = totals.setdefault(key, dict(record, count=0, wall=0.0,
+                                                cpu=0.0))
+            total['count'] += 1
+            total['wall'] += record['wall']
+            total['cpu'] += record['cpu']
+        return sorted(totals.values(), key=lambda total: total['level'])
+
+    def report(self, stream=None):
+        '''Print a breakdown of the recorded phases'''
+        stream = stream or sys.stderr
+        print('pycommand profile', file=stream)
+        print('{:>5}  {:<24} {:<20} {:>5} {:>10} {:>10}'.format(
+            'level', 'command', 'phase', 'count', 'wall ms', 'cpu ms'),
+            file=stream)
+        for total in self.summary():
+            print('{level:>5}  {command:<24} {phase:<20} {count:>5} '
+                  '{wall:>10.3f} {cpu:>10.3f}'
+                  .format(**dict(total, wall=total['wall'] * 1000,
+                                 cpu=total['cpu'] * 1000)),
+                  file=stream)
+
+    def dump(self, path):
+        '''Write all records and their summary as JSON to `path`'''
+        with open(path, 'w') as output:
+            json.dump({'records': self.records, 'summary': self.summary()},
+                      output, indent=2)
+
+
+def enable(output=None):
+    '''Start recording phase timings and return the `Profiler`
+
+    :Parameters:
+        - `output`: String. Print a breakdown to stderr at exit when
+          ``'-'``, or write JSON to this path at exit. Nothing is
+          written by default.
+    '''
+    if CommandSpec.profiler is None:
+        CommandSpec.profiler = Profiler()
+    if output and output not in _outputs:
+        if not _outputs:
+            atexit.register(writeOutputs)
+        _outputs.append(output)
+    return CommandSpec.profiler
+
+
+def writeOutputs():
+    '''Write the outputs requested by `enable`, once each'''
+    profiler = CommandSpec.profiler
+    if profiler is None:
+        return
+    for output in _outputs:
+        if output == '-':
+            profiler.report()
+        else:
+            profiler.dump(output)
+
+
+def disable():
+    '''Stop recording phase timings and return the `Profiler`, if any'''
+    profiler = CommandSpec.profiler
+    CommandSpec.profiler = None
+    return profiler
+
+
+def addHook(hook):
+    '''Call `hook` with every record, enabling timing if needed
+
+    :Parameters:
+        - `hook`: Callable that takes a record dict with the keys
+          'phase', 'level', 'command', 'wall' and 'cpu'
+    '''
+    enable().hooks.append(hook)
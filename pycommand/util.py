@@ -12,7 +12,7 @@
 # ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
 # OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
-from __future__ import absolute_import
+from __future__ import absolute_import, print_function
 
 '''
 pycommand shell command and generator script.
@@ -22,14 +22,12 @@ This can be run by executing the __main__ module (python -m pycommand).
 
 import os
 import stat
-import string
 
 from pycommand import (
     CommandBase,
     CommandExit,
     __version__,
 )
-from pycommand.templates import templates
 
 try:
     input = raw_input
@@ -44,20 +42,33 @@ class PycommandGenerator(CommandBase):
     description = __doc__
     optionList = (
         ('template', ('t', '<number>', 'use template number')),
-        ('help', ('h', False, 'show this help information')),
+        ('manifest', ('m', '<file>', 'generate all scripts of a manifest')),
+        ('output', ('o', '<dir>', 'output directory of --manifest')),
+        ('force', ('f', False, 'replace existing scripts of --manifest')),
+        ('jobs', ('j', '<n>', 'number of threads [default: CPUs]',
+                  {'type': 'int'})),
+        ('help', ('h', False, 'show this help information',
+                  {'search': True})),
+    )
+    usageTextExtra = (
+        'A manifest is a JSON, INI or YAML file, see pycommand.manifest.'
     )
 
     variables = {
         'name': 'mycommand',
         'classname': 'Command',
+        'options': '',
     }
     template = ''
 
     def run(self):
         if self.flags.help:
-            print(self.usage)
+            self.printHelp()
             return 0
 
+        if self.flags.manifest:
+            return self.generateManifest()
+
         print('pycommand v{} - script generator'.format(__version__))
         if self.flags.template:
             if int(self.flags.template) not in range(1, 5):
@@ -72,24 +83,39 @@ class PycommandGenerator(CommandBase):
         return 0 if self.save() else 1
 
     def setTemplate(self, template_n):
-        template_n = str(template_n)
-        if template_n == '1':
-            self.template = string.Template(
-                templates['basic-with-comments']
-            )
-        elif template_n == '2':
-            self.template = string.Template(templates['basic-no-comments'])
-        elif template_n == '3':
-            self.template = string.Template(
-                templates['full-with-comments']
-            )
-        elif template_n == '4':
-            self.template = string.Template(templates['full-no-comments'])
-        else:
+        # The templates are only imported when generating a script
+        from pycommand.manifest import getTemplate, templateNumbers
+
+        if str(template_n) not in templateNumbers:
             raise Exception('Invalid template choice')
+        self.template = getTemplate(template_n)
+
+    def generateManifest(self):
+        '''Generate all scripts of the manifest and report every file'''
+        from pycommand import manifest
+
+        try:
+            scripts = manifest.loadManifest(self.flags.manifest)
+        except (ValueError, IOError, OSError) as e:
+            print('error: {}'.format(e), file=self.stdout)
+            return 1
+        failed = 0
+        for path, error in manifest.generate(
+                scripts, self.flags.output or os.curdir, self.flags.force,
+                self.flags.jobs):
+            if error:
+                failed += 1
+                print('error: {}: {}'.format(path, error), file=self.stdout)
+            else:
+                print('written: {}'.format(path), file=self.stdout)
+        print('{} written, {} failed'.format(len(scripts) - failed, failed),
+              file=self.stdout)
+        return 1 if failed else 0
 
     def askVar(self, varName, question):
         inp = input(question + ' [{}]: '.format(self.variables[varName]))
+        # Copy the variables, so that the class attribute is never changed
+        self.variables = dict(self.variables)
         self.variables[varName] = inp if inp else self.variables[varName]
 
     def askTemplate(self):
@@ -142,15 +168,196 @@ Full template (uses objects for its subcommands):
         return True
 
 
+class PycommandCompletion(CommandBase):
+    '''Generate a static shell completion script for a command'''
+
+    usagestr = ('usage: python -m pycommand completion [options] '
+                '<shell> <module:Class>')
+    description = (
+        '''Write a bash, zsh or fish completion script for the command tree
+of the CommandBase subclass <module:Class> to stdout.'''
+    )
+    optionList = (
+        ('name', ('n', '<name>',
+                  'name of executable [default: from usagestr]')),
+        ('help', ('h', False, 'show this help information',
+                  {'search': True})),
+    )
+
+    def run(self):
+        from pycommand import completion
+        from pycommand.pycommand import importCommand
+
+        if self.flags.help:
+            self.printHelp()
+            return 0
+        if len(self.args) != 2:
+            print(self.usage, file=self.stdout)
+            return 1
+        shell, target = self.args
+        if shell not in completion.shells:
+            print('error: shell "{}" is not supported, use one of: {}'
+                  .format(shell, ', '.join(sorted(completion.shells))),
+                  file=self.stdout)
+            return 1
+        try:
+            command_class = importCommand(target)
+        except (ImportError, AttributeError) as e:
+            print('error: cannot import {}: {}'.format(target, e),
+                  file=self.stdout)
+            return 1
+        self.stdout.write(completion.generate(shell, command_class,
+                                              self.flags.name))
+        return 0
+
+
+class PycommandRepl(CommandBase):
+    '''Run commands of a command tree interactively'''
+
+    usagestr = 'usage: python -m pycommand repl [options] <module:Class>'
+    description = (
+        '''Start an interactive shell that runs every line that is entered as
+the arguments of the CommandBase subclass <module:Class>.'''
+    )
+    optionList = (
+        ('name', ('n', '<name>', 'name of program [default: from usagestr]')),
+        ('history', ('', '<file>',
+                     'history file [default: ~/.<name>_history]')),
+        ('help', ('h', False, 'show this help information',
+                  {'search': True})),
+    )
+
+    def run(self):
+        from pycommand.pycommand import importCommand
+        from pycommand.repl import repl_and_exit
+
+        if self.flags.help:
+            self.printHelp()
+            return 0
+        if len(self.args) != 1:
+            print(self.usage, file=self.stdout)
+            return 1
+        try:
+            command_class = importCommand(self.args[0])
+        except (ImportError, AttributeError) as e:
+            print('error: cannot import {}: {}'.format(self.args[0], e),
+                  file=self.stdout)
+            return 1
+        repl_and_exit(command_class, self.flags.name, self.flags.history)
+
+
+class PycommandBundle(CommandBase):
+    '''Pack a command script into a single precompiled file'''
+
+    usagestr = 'usage: python -m pycommand bundle [options] <script>'
+    description = (
+        '''Write an executable zip file with the bytecode of <script>,
+pycommand and all modules that its commands import, except for the
+standard library.'''
+    )
+    optionList = (
+        ('output', ('o', '<file>', 'bundle to write [default: <script>.pyz]')),
+        ('python', ('p', '<interpreter>',
+                    'interpreter [default: /usr/bin/env pythonX.Y]')),
+        ('snapshot', ('s', False, 'store the compiled specs of all commands')),
+        ('help', ('h', False, 'show this help information',
+                  {'search': True})),
+    )
+
+    def run(self):
+        from pycommand.bundle import build
+
+        if self.flags.help:
+            self.printHelp()
+            return 0
+        if len(self.args) != 1:
+            print(self.usage, file=self.stdout)
+            return 1
+        script = self.args[0]
+        output = self.flags.output or os.path.splitext(script)[0] + '.pyz'
+        try:
+            modules, skipped = build(script, output, self.flags.python,
+                                     self.flags.snapshot)
+        except (IOError, OSError, SyntaxError, ImportError) as e:
+            print('error: cannot bundle {}: {}'.format(script, e),
+                  file=self.stdout)
+            return 1
+        for name in skipped:
+            print('skipped: {} (not pure Python)'.format(name),
+                  file=self.stdout)
+        print('written: {} ({} modules)'.format(output, len(modules) + 1),
+              file=self.stdout)
+        return 0
+
+
+class PycommandCompile(CommandBase):
+    '''Generate specialized parsers for a command tree'''
+
+    usagestr = 'usage: python -m pycommand compile [options] <module:Class>'
+    description = (
+        '''Write a module with a parser for every command of the tree of the
+CommandBase subclass <module:Class> next to the module of the commands.
+The parsers are used while they are up to date. Instead of a module, the
+path of a script can be given.'''
+    )
+    optionList = (
+        ('help', ('h', False, 'show this help information',
+                  {'search': True})),
+    )
+
+    def run(self):
+        from pycommand import compiler
+        from pycommand.pycommand import importCommand
+
+        if self.flags.help:
+            self.printHelp()
+            return 0
+        if len(self.args) != 1:
+            print(self.usage, file=self.stdout)
+            return 1
+        target = self.args[0]
+        path, _, attr = target.rpartition(':')
+        try:
+            if os.path.isfile(path):
+                from pycommand.bundle import loadScript
+                module = loadScript(path)
+                command_class = getattr(module, attr)
+                modules = {module.__name__: module}
+            else:
+                command_class = importCommand(target)
+                modules = None
+            written = compiler.generate(command_class, modules)
+        except (ImportError, AttributeError, IOError, OSError,
+                ValueError) as e:
+            print('error: cannot compile {}: {}'.format(target, e),
+                  file=self.stdout)
+            return 1
+        for path in written:
+            print('written: {}'.format(path), file=self.stdout)
+        return 0
+
+
 class PycommandShellMain(CommandBase):
     usagestr = 'usage: python -m pycommand [options] <command>'
     description = (
-        'Commands:\n  init - Generate a shell command from a template'
+        'Commands:\n'
+        '  init        - Generate a shell command from a template\n'
+        '  completion  - Generate a shell completion script for a command\n'
+        '  repl        - Run commands of a command tree interactively\n'
+        '  bundle      - Pack a command script into one precompiled file\n'
+        '  compile     - Generate specialized parsers for a command tree'
     )
 
-    commands = {'init': PycommandGenerator}
+    commands = {
+        'init': PycommandGenerator,
+        'completion': PycommandCompletion,
+        'repl': PycommandRepl,
+        'bundle': PycommandBundle,
+        'compile': PycommandCompile,
+    }
     optionList = (
-        ('help', ('h', False, 'show this help information')),
+        ('help', ('h', False, 'show this help information',
+                  {'search': True})),
         ('version', ('v', False, 'show version information')),
     )
     usageTextExtra = (
@@ -160,10 +367,10 @@ class PycommandShellMain(CommandBase):
     def run(self):
         # Handle --version and --help
         if self.flags.version:
-            print('pycommand version ' + __version__)
+            print('pycommand version ' + __version__, file=self.stdout)
             return 0
         elif self.flags.help:
-            print(self.usage)
+            self.printHelp()
             return 0
         # Handle subcommands
         try:
@@ -173,7 +380,8 @@ class PycommandShellMain(CommandBase):
         # Handle errors
         if cmd.error:
             print('python -m pycommand {cmd}: {error}'
-                  .format(cmd=self.args[0], error=cmd.error))
+                  .format(cmd=self.args[0], error=cmd.error),
+                  file=self.stdout)
             return 1
         else:
             return cmd.run()
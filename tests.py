@@ -12,15 +12,42 @@
 # ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
 # OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
-from __future__ import absolute_import
+from __future__ import absolute_import, print_function
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+from unittest import skipUnless
 
 from nose.tools import (
+    assert_raises,
     eq_,
     raises,
 )
 
 import pycommand
 from pycommand import util
+from pycommand.converters import CommaList
+
+try:
+    from StringIO import StringIO  # Python 2, accepts str and unicode
+except ImportError:
+    from io import StringIO
+
+try:
+    import concurrent.futures  # noqa: F401
+    hasFutures = True
+except ImportError:  # Python 2 without the futures package
+    hasFutures = False
+
+if sys.version_info >= (3, 5):
+    # async def is a syntax error before Python 3.5
+    from asynctests import (  # noqa: F401
+        test_async_interrupt,
+        test_async_run,
+    )
 
 
 class BasicTestCommand(pycommand.CommandBase):
@@ -102,7 +129,1120 @@ def test_flags_attribute_not_existing():
     eq_(cmd.flags.tsixetonseod, None)
 
 
+class SlottedTestCommand(pycommand.CommandBase):
+    optionList = (
+        ('dry-run', ('n', False, 'show what would be done')),
+        ('items', ('', '<n>', 'number of items')),
+        ('class', ('', '<name>', 'class name')),
+    )
+
+
+def test_flags_slotted():
+    '''Flags are slots with normalized names and mapping access'''
+    flags = SlottedTestCommand(['-n', '--items', '3', '--class=x']).flags
+    eq_(hasattr(flags, '__dict__'), False)
+    eq_((flags.dry_run, getattr(flags, 'dry-run'), flags['dry-run']),
+        (True, True, True))
+    eq_((flags['items'], getattr(flags, 'class')), ('3', 'x'))
+    eq_(flags, {'dry-run': True, 'items': '3', 'class': 'x'})
+    eq_(list(flags), ['dry-run', 'items', 'class'])
+    flags['items'] = '4'
+    eq_(flags.copy()['items'], '4')
+    eq_(isinstance(flags, dict), False)
+    eq_(json.loads(json.dumps(flags.asDict())),
+        {'dry-run': True, 'items': '4', 'class': 'x'})
+    eq_(getattr(SlottedTestCommand([]).flags, 'dry_run'), None)
+
+
+def test_flags_pickle():
+    '''Flags can be pickled for process pools'''
+    import pickle
+    flags = SlottedTestCommand(['-n']).flags
+    copy = pickle.loads(pickle.dumps(flags))
+    eq_((type(copy), copy), (type(flags), flags))
+
+
 def test_shellmain_no_args():
     '''Util: Help message is printed when no args are given'''
     cmd = util.PycommandShellMain([])
     print(cmd.run())
+
+
+def test_spec_shared_by_instances():
+    '''The compiled spec is built once per class'''
+    spec = BasicTestCommand.getSpec()
+    eq_(BasicTestCommand([]).getSpec() is spec, True)
+    eq_(BasicTestCommand(['-h']).optionList is spec.optionList, True)
+
+
+def test_spec_rebuilt_on_reassignment():
+    '''Reassigning optionList of a subclass invalidates its spec'''
+    class Cmd(BasicTestCommand):
+        pass
+
+    eq_(Cmd(['--version']).flags.version, True)
+    Cmd.optionList = (('verbose', ('v', False, 'more output')), )
+    cmd = Cmd(['-v'])
+    eq_(cmd.flags.verbose, True)
+    eq_('--verbose' in cmd.usage, True)
+    eq_('--version' in cmd.usage, False)
+    eq_('--version' in BasicTestCommand([]).usage, True)
+
+
+def test_flags_long_prefix():
+    '''Unambiguous prefixes of long options are accepted'''
+    cmd = BasicTestCommand(['--fi', 'x.gif', '--vers'])
+    eq_(cmd.flags.file, 'x.gif')
+    eq_(cmd.flags.version, True)
+
+
+def test_parse_errors():
+    '''Invalid options are reported in cmd.error like getopt does'''
+    for argv, msg in ((['-x'], 'option -x not recognized'),
+                      (['--nope'], 'option --nope not recognized'),
+                      (['-f'], 'option -f requires argument'),
+                      (['--file'], 'option --file requires argument'),
+                      (['--version=1'],
+                       'option --version must not have an argument'),
+                      (['-hv'], 'option -v not recognized')):
+        cmd = BasicTestCommand(argv)
+        eq_(cmd.error.msg, msg)
+        eq_(cmd.flags.help, None)
+        eq_(cmd.args, [])
+
+
+def test_usage_lazy():
+    '''Usage is rendered on first access and cached per class'''
+    class Cmd(BasicTestCommand):
+        pass
+
+    cmd = Cmd(['-h'])
+    eq_(Cmd.getSpec()._usage, None)
+    eq_(cmd.usage.startswith('usage: pycommand-test [options]'), True)
+    eq_(Cmd([]).usage is cmd.usage, True)
+    cmd.usage = 'custom'
+    eq_(cmd.usage, 'custom')
+    eq_(Cmd([]).usage is Cmd.usage, True)
+
+
+class HelpTestCommand(pycommand.CommandBase):
+    usagestr = 'usage: helptool [options]'
+    description = 'Test help'
+    optionList = (
+        ('help', ('h', False, 'show this help information',
+                  {'search': True})),
+        ('host', ('', '<host>', 'server to connect to')),
+        ('port', ('p', '<port>', 'port of the server')),
+        ('verbose', ('v', False, 'more output')),
+    )
+    optionGroups = (('Network', ('host', 'port')), )
+    usageTextExtra = 'Extra'
+
+    def run(self):
+        self.printHelp()
+        return 0
+
+
+def test_option_groups():
+    '''Options in optionGroups get a section of the usage text'''
+    eq_(HelpTestCommand.usage,
+        'usage: helptool [options]\n\nTest help\n\n'
+        'Options:\n'
+        '-h, --help                show this help information\n'
+        '-v, --verbose             more output\n\n'
+        'Network:\n'
+        '--host=<host>             server to connect to\n'
+        '-p <port>, --port=<port>  port of the server\n\nExtra')
+
+    class Cmd(HelpTestCommand):
+        optionGroups = (('Missing', ('host', 'nope')), )
+    assert_raises(ValueError, Cmd.getSpec)
+    assert_raises(ValueError, Cmd, ['-v'])
+
+
+def test_help_search():
+    '''--help=<term> lists the matching options in their sections'''
+    from pycommand.testing import invoke
+    eq_(HelpTestCommand(['--help=']).flags.help, True)
+    eq_(HelpTestCommand(['--he=Server']).flags.help, 'Server')
+    eq_(invoke(HelpTestCommand, ['--help=SERVER port']).stdout,
+        'usage: helptool [options]\n\n1 of 4 options match \'SERVER port\'.'
+        '\n\nNetwork:\n-p <port>, --port=<port>  port of the server\n\n')
+    eq_(invoke(HelpTestCommand, ['--help=network']).stdout.count('--'), 2)
+    eq_(invoke(HelpTestCommand, ['--help=nothing']).stdout,
+        "usage: helptool [options]\n\nNo options match 'nothing'.\n\n")
+    eq_(invoke(HelpTestCommand, ['-h']).stdout,
+        HelpTestCommand.usage + '\n')
+
+    # Only options that set 'search' accept a term
+    eq_(BasicTestCommand(['--help=port']).error.msg,
+        'option --help must not have an argument')
+
+    class Cmd(pycommand.CommandBase):
+        optionList = (('help', ('h', '<x>', 'help', {'search': True})), )
+    assert_raises(ValueError, Cmd.getSpec)
+
+
+class LazyTestCommand(pycommand.CommandBase):
+    commands = {
+        'basic': __name__ + ':BasicTestCommand',
+        'missing': ('pycommand_no_such_module:Command', 'not importable'),
+        'test': BasicTestCommand,
+    }
+
+
+def test_commands_lazy_import():
+    '''Import paths in commands are resolved when dispatched to'''
+    cmd = LazyTestCommand(['basic', '-f', 'x.gif']).run()
+    eq_(isinstance(cmd, BasicTestCommand), True)
+    eq_(cmd.flags.file, 'x.gif')
+    eq_(LazyTestCommand.getCommand('basic') is BasicTestCommand, True)
+
+
+def test_commands_list():
+    '''Commands can be listed without importing them'''
+    eq_(LazyTestCommand.commandList(), [
+        ('basic', ''),
+        ('missing', 'not importable'),
+        ('test', 'small description'),
+    ])
+
+
+@raises(ImportError)
+def test_commands_import_error():
+    '''Import errors of the dispatched command are not hidden'''
+    LazyTestCommand(['missing']).run()
+
+
+def test_spec_cache():
+    '''Compiled specs are stored on disk and reused while up to date'''
+    from pycommand import cache
+
+    class Cmd(BasicTestCommand):
+        pass
+
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, 'cache')
+    try:
+        cache.enable(path)
+        usage = Cmd([]).usage
+        eq_(pycommand.CommandSpec.cache.save(), True)
+        eq_(pycommand.CommandSpec.cache.save(), False)
+
+        specCache = cache.SpecCache(path)
+        spec = specCache.getSpec(Cmd)
+        eq_(spec._usage, usage)
+        eq_(spec.longIndex, Cmd.getSpec().longIndex)
+
+        Cmd.optionList = (('verbose', ('v', False, 'more output')), )
+        eq_(specCache.getSpec(Cmd)._usage, None)
+        eq_(Cmd(['-v']).flags.verbose, True)
+    finally:
+        cache.disable()
+        shutil.rmtree(tmpdir)
+
+
+@skipUnless(sys.version_info >= (3, 3), 'server mode requires Python 3.3')
+def test_server_request_roundtrip():
+    '''Server requests survive encoding and decoding'''
+    from pycommand import server
+    argv = ['tool', '--file', 'a b.gif', '']
+    environ = {'HOME': '/home/user', 'EMPTY': '', 'EQ': 'a=b'}
+    request = server.encodeRequest('token', argv, environ, '/tmp')
+    eq_(server.decodeRequest(request[server.HEADER.size:]),
+        ('token', argv, environ, '/tmp'))
+
+
+def test_server_socket_directory():
+    '''Sockets are only used in a private directory of the user'''
+    from pycommand import server
+    tmpdir = tempfile.mkdtemp()
+    runtime = os.environ.get('XDG_RUNTIME_DIR')
+    os.environ['XDG_RUNTIME_DIR'] = tmpdir
+    try:
+        path = server.socketPath('tool.cli:Main')
+        eq_(path, os.path.join(tmpdir, 'pycommand', 'tool-cli-Main.sock'))
+        eq_(os.stat(os.path.dirname(path)).st_mode & 0o777, 0o700)
+        os.chmod(os.path.dirname(path), 0o777)
+        assert_raises(OSError, server.socketPath, 'tool.cli:Main')
+    finally:
+        if runtime is None:
+            del os.environ['XDG_RUNTIME_DIR']
+        else:
+            os.environ['XDG_RUNTIME_DIR'] = runtime
+        shutil.rmtree(tmpdir)
+
+
+SERVER_TEST_TOOL = '''
+import os
+import pycommand
+
+
+class Main(pycommand.CommandBase):
+    def run(self):
+        print(os.getppid(), *self.args)
+        return 3
+'''
+
+SERVER_TEST_CLIENT = '''
+import os
+from pycommand.server import forward_and_exit
+forward_and_exit('servertesttool:Main', path=os.environ['TEST_SOCKET'],
+                 idleTimeout=10)
+'''
+
+
+@skipUnless(sys.version_info >= (3, 3), 'server mode requires Python 3.3')
+def test_server_forward():
+    '''Commands run in a forked worker of a daemon that the client starts'''
+    import subprocess
+    from pycommand import server
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, 'test.sock')
+    # The command is only importable from the directory of the client
+    with open(os.path.join(tmpdir, 'servertesttool.py'), 'w') as tool:
+        tool.write(SERVER_TEST_TOOL)
+    with open(os.path.join(tmpdir, 'client.py'), 'w') as client:
+        client.write(SERVER_TEST_CLIENT)
+    env = dict(os.environ, TEST_SOCKET=path, PYTHONPATH=os.path.dirname(
+        os.path.abspath(pycommand.__file__)) + os.sep + os.pardir)
+    env.pop('PYCOMMAND_SERVER', None)
+
+    def invoke(*args):
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(tmpdir, 'client.py')] + list(args),
+            stdout=subprocess.PIPE, env=env)
+        return process.communicate()[0].decode().split(), process.returncode
+    try:
+        first, status = invoke('a', 'b c')
+        eq_(status, 3)
+        eq_(first[1:], ['a', 'b', 'c'])
+        # The worker is a child of the daemon, not of the client
+        assert int(first[0]) != os.getpid()
+        second, status = invoke('d')
+        eq_((second, status), ([first[0], 'd'], 3))
+    finally:
+        conn = server.connect(path)
+        if conn is not None:
+            # A version mismatch makes the daemon exit
+            conn.sendall(server.encodeRequest('stop', [], {}, '/'))
+            conn.recv(server.STATUS.size)
+            conn.close()
+        shutil.rmtree(tmpdir)
+
+
+def test_parse_many():
+    '''Many command lines can be parsed without creating commands'''
+    results = list(BasicTestCommand.parseMany(
+        iter([['-h', 'arg'], ['--file=x.gif'], ['-x']])
+    ))
+    eq_(results[0][0].help, True)
+    eq_(results[0][1], ['arg'])
+    eq_(results[1][0].file, 'x.gif')
+    eq_(results[1][2], None)
+    eq_(results[2][2].msg, 'option -x not recognized')
+
+
+class FanOutTestCommand(pycommand.CommandBase):
+    optionList = (('fail', ('', '<item>', 'fail on this item')), )
+
+    def runItem(self, item):
+        if item == self.flags.fail:
+            raise ValueError('failed')
+        if item == 'skip':
+            raise pycommand.CommandExit(0)
+        return item.upper()
+
+
+def captureOutput(func, *args):
+    '''Return the result of calling `func` and what it printed'''
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        result = func(*args)
+        return result, sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+
+
+def test_fan_out_options():
+    '''Fan-out commands get a --jobs option'''
+    cmd = FanOutTestCommand(['-j', '4', 'a'])
+    eq_(cmd.flags.jobs, '4')
+    eq_('-j <n>, --jobs=<n>' in cmd.usage, True)
+    eq_(FanOutTestCommand([]).getSpec() is cmd.getSpec(), True)
+
+
+@skipUnless(hasFutures, '--jobs needs concurrent.futures')
+def test_fan_out():
+    '''runItem is called for all items and results keep their order'''
+    items = [str(n) for n in range(100)]
+    for jobs in ('1', '8'):
+        cmd = FanOutTestCommand(['--jobs', jobs] + items)
+        eq_(captureOutput(cmd.run), (0, '\n'.join(items) + '\n'))
+
+
+@skipUnless(hasFutures, '--jobs needs concurrent.futures')
+def test_fan_out_errors():
+    '''Failed items are reported and result in a failed exit status'''
+    cmd = FanOutTestCommand(['-j', '2', '--fail', 'b', 'a', 'b', 'c'])
+    eq_(captureOutput(cmd.fanOut),
+        (1, 'A\nerror: b: ValueError: failed\nC\n'))
+
+    cmd.fanOutFailFast = True
+    eq_(captureOutput(cmd.fanOut, iter(['b', 'c'])),
+        (1, 'error: b: ValueError: failed\n'))
+
+    cmd = FanOutTestCommand(['-j', 'x'])
+    eq_(captureOutput(cmd.run)[0], 2)
+
+    # CommandExit(0) ends an item successfully
+    cmd = FanOutTestCommand(['skip', 'a'])
+    eq_(captureOutput(cmd.run), (0, 'A\n'))
+
+
+class ProcessFanOutTestCommand(FanOutTestCommand):
+    fanOutExecutor = 'process'
+
+
+@skipUnless(sys.version_info >= (3, 4), 'start methods need Python 3.4')
+def test_fan_out_process_spawn():
+    '''Process pools work when workers are spawned instead of forked'''
+    import multiprocessing
+    method = multiprocessing.get_start_method()
+    multiprocessing.set_start_method('spawn', force=True)
+    try:
+        with tempfile.TemporaryFile('w+') as stdout:
+            status = pycommand.execute(ProcessFanOutTestCommand,
+                                       ['-j', '2', 'a', 'skip', 'b'], stdout)
+            stdout.seek(0)
+            eq_((status, stdout.read()), (0, 'A\nB\n'))
+    finally:
+        multiprocessing.set_start_method(method, force=True)
+
+
+def test_timing_hooks():
+    '''Phase timings are passed to hooks for every level'''
+    from pycommand import timing
+    records = []
+    timing.addHook(records.append)
+    try:
+        cmd = LazyTestCommand(['test', '-h']).run()
+        cmd.registerParentFlag('file', None)
+        cmd.usage
+    finally:
+        timing.disable()
+    phases = [(r['level'], r['command'], r['phase']) for r in records]
+    eq_((0, 'LazyTestCommand', 'parse') in phases, True)
+    eq_((1, 'BasicTestCommand', 'parse') in phases, True)
+    eq_((1, 'BasicTestCommand', 'dispatch') in phases, True)
+    eq_((0, 'BasicTestCommand', 'registerParentFlag') in phases, True)
+    eq_(pycommand.CommandSpec.profiler, None)
+
+
+def test_timing_parse_chain():
+    '''execute parses the whole chain with parseChain when profiling'''
+    from pycommand import timing
+    records = []
+    timing.addHook(records.append)
+    try:
+        node = pycommand.execute(ChainRootCommand,
+                                 ['-v', 'node', '-n', 'b', 'leaf'],
+                                 StringIO())
+    finally:
+        timing.disable()
+    eq_([(r['level'], r['command']) for r in records
+         if r['phase'] == 'parse'],
+        [(0, 'ChainRootCommand'), (1, 'ChainNodeCommand'),
+         (2, 'ChainLeafCommand')])
+    eq_(node.parentFlags['verbose'], True)
+
+
+def test_timing_report_once():
+    '''The environment and the argument together give a single report'''
+    import subprocess
+    env = dict(os.environ, PYCOMMAND_PROFILE='1',
+               PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    code = ('import sys, pycommand, tests; sys.argv[1:] = '
+            '["--pycommand-profile"]; pycommand.run_and_exit('
+            'tests.BasicTestCommand)')
+    process = subprocess.Popen([sys.executable, '-c', code], env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               universal_newlines=True)
+    eq_(process.communicate()[1].count('pycommand profile'), 1)
+
+
+class GetoptTestCommand(pycommand.CommandBase):
+    optionList = (
+        ('help', ('h', False, 'show this help information')),
+        ('file', ('f', '<filename>', 'use specified file')),
+        ('filter', ('', '<expr>', 'filter output')),
+        ('verbose', ('v', False, 'more output')),
+        ('version', ('', False, 'show version information')),
+        ('v2', ('2', False, 'use version 2')),
+    )
+
+
+def getoptParse(spec, argv):
+    '''Parse argv with getopt and convert the result like spec.parse'''
+    import getopt
+    try:
+        opts, args = getopt.getopt(argv, spec.shortopts, spec.longopts)
+    except getopt.GetoptError as err:
+        return dict(spec.defaults), [], (err.msg, err.opt)
+    flags = dict(spec.defaults)
+    for opt, optarg in opts:
+        if opt.startswith('--'):
+            flag, hasArg = spec.longIndex[opt[2:]]
+        else:
+            flag, hasArg = spec.shortIndex[opt[1]]
+        flags[flag] = optarg if hasArg else True
+    return flags, args, None
+
+
+def test_parse_getopt_compatible():
+    '''Parsing gives the same results and errors as getopt'''
+    import random
+    tokens = ['-h', '-f', 'x', '-hv', '-vfx', '-fh', '-v2', '-2', '-z',
+              '--file', '--file=a', '--file=', '--fi', '--f', '--filt',
+              '--version=1', '--he', '--ver', '--verb', '--version', '--v',
+              '--nope', '--=x', '---', '-', '--', 'a', '']
+    rand = random.Random(1)
+
+    def check(spec, argv):
+        flags, args, error = spec.parse(argv)
+        if error is not None:
+            error = (error.msg, error.opt)
+        eq_((dict(flags), args, error), getoptParse(spec, argv))
+
+    # An empty optionList has an empty prefix trie
+    for command in (GetoptTestCommand, pycommand.CommandBase):
+        spec = command.getSpec()
+        check(spec, ['--=x'])
+        for n in range(5000):
+            check(spec, [rand.choice(tokens)
+                         for _ in range(rand.randint(0, 6))])
+    eq_(pycommand.CommandBase(['--=x']).error.msg,
+        'option -- not recognized')
+
+
+class ChainLeafCommand(pycommand.CommandBase):
+    optionList = (('force', ('f', False, 'force')), )
+
+
+class ChainNodeCommand(pycommand.CommandBase):
+    optionList = (('node', ('n', '<name>', 'node name')), )
+    commands = {'leaf': ChainLeafCommand}
+
+
+class ChainRootCommand(pycommand.CommandBase):
+    optionList = (('verbose', ('v', False, 'more output')),
+                  ('node', ('', '<name>', 'default node name')))
+    commands = {'node': ChainNodeCommand}
+
+
+def test_parse_chain():
+    '''A chain of subcommands is parsed in one pass'''
+    argv = ['-v', '--node', 'a', 'node', '-n', 'b', 'leaf', '-f', 'x']
+    root, node, leaf = ChainRootCommand.parseChain(argv)
+    eq_(root.flags.verbose, True)
+    eq_(node.flags.node, 'b')
+    eq_((leaf.flags.force, leaf.args), (True, ['x']))
+    eq_(root.run() is node, True)
+    eq_(node.run() is leaf, True)
+
+
+def test_parse_chain_callable():
+    '''Subcommands that are not CommandBase classes are called once'''
+    calls = []
+
+    def deploy(argv):
+        calls.append(argv)
+        return 0
+
+    class Main(pycommand.CommandBase):
+        optionList = (('force', ('f', False, 'force')), )
+        commands = {'deploy': deploy}
+
+        def run(self):
+            if self.flags.force:
+                return super(Main, self).run()
+            return 3
+
+    eq_(Main.parseChain(['deploy', 'x'])[1:], [])
+    eq_(pycommand.execute(Main, ['-f', 'deploy', 'x']), 0)
+    eq_(pycommand.execute(Main, ['deploy', 'x']), 3)
+    eq_(calls, [['x']])
+
+
+def test_parent_flags_layered():
+    '''Subcommands see the options of their parent and registered flags'''
+    argv = ['-v', '--node', 'a', 'node', '-n', 'b', 'leaf']
+    for leaf in (ChainRootCommand.parseChain(argv)[2],
+                 ChainRootCommand(argv).run().run()):
+        eq_(sorted(leaf.parentFlags), ['node'])
+        eq_(leaf.parentFlags['node'], 'b')
+        leaf.registerParentFlag('node', 'c')
+        eq_(leaf.parentFlags['node'], 'c')
+        leaf.registerParentFlag('verbose', True)
+        eq_(sorted(leaf.parentFlags), ['node', 'verbose'])
+
+    root = ChainRootCommand(['node'])
+    node = root.run()
+    node.registerParentFlag('file', 'x.gif')
+    eq_(node.parentFlags['file'], 'x.gif')
+    eq_('file' in root.flags, False)
+
+
+def test_parse_chain_lazy():
+    '''parseChain imports the selected lazy subcommand before run'''
+    chain = LazyTestCommand.parseChain(['basic', '-f', 'x.gif'])
+    eq_([type(cmd) for cmd in chain], [LazyTestCommand, BasicTestCommand])
+    assert_raises(ImportError, LazyTestCommand.parseChain, ['missing'])
+    eq_(len(LazyTestCommand.parseChain(['test'])), 2)
+
+
+def test_import_light():
+    '''Importing pycommand does not load the heavy modules it defers'''
+    import subprocess
+    heavy = ['getopt', 'importlib', 'pycommand.templates']
+    if sys.version_info >= (3, 7):  # OrderedDict is needed before 3.7
+        heavy.append('collections')
+    code = ('import sys; before = set(sys.modules); import pycommand.util; '
+            'pycommand.CommandBase([]); '
+            'print(sorted((set(sys.modules) - before) & set({!r})))'
+            .format(heavy))
+    env = dict(os.environ,
+               PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output([sys.executable, '-c', code], env=env,
+                                     universal_newlines=True)
+    eq_(output.strip(), '[]')
+
+
+class CompletionDeployCommand(pycommand.CommandBase):
+    description = 'deploy the app'
+    optionList = (
+        ('env', ('e', '<env>', 'environment to deploy to')),
+        ('force', ('f', False, "don't ask")),
+        ('branch', ('', '<branch>', 'branch to deploy')),
+    )
+    completers = {'env': ['prod', 'staging'],
+                  'branch': 'printf "main\\ndev\\n"'}
+
+
+class CompletionMainCommand(pycommand.CommandBase):
+    usagestr = 'usage: ctool [options] <command>'
+    optionList = BasicTestCommand.optionList
+    commands = {'deploy': CompletionDeployCommand,
+                'status': ('tests:BasicTestCommand', 'show status')}
+
+
+def test_command_tree():
+    '''The command tree skips callables and cycles and is shared'''
+    from pycommand import cache, compiler
+
+    class Cmd(CompletionMainCommand):
+        pass
+    Cmd.commands = dict(CompletionMainCommand.commands, again=Cmd,
+                        func=lambda argv: 0)
+    eq_(list(Cmd.iterCommandTree()),
+        [((), Cmd), (('deploy', ), CompletionDeployCommand),
+         (('status', ), BasicTestCommand)])
+    eq_(compiler.commandTree(Cmd),
+        [Cmd, CompletionDeployCommand, BasicTestCommand])
+    eq_(cache.warm(Cmd), 3)
+
+
+def test_completion_scripts():
+    '''Completion scripts cover the whole command tree'''
+    from pycommand import completion
+    eq_([path for path, command in completion.commandTree(
+        CompletionMainCommand)], [(), ('deploy', ), ('status', )])
+    zsh = completion.generate('zsh', CompletionMainCommand)
+    eq_("'(-e --env)'{-e+,--env=}'[environment to deploy to]:<env>:"
+        "(prod staging)'" in zsh, True)
+    fish = completion.generate('fish', CompletionMainCommand, 'other')
+    eq_("complete -c other -n '_other_at /deploy/' -s f -l force "
+        "-d 'don\\'t ask'" in fish, True)
+
+
+def test_completion_bash():
+    '''The bash completion script completes the command tree'''
+    import subprocess
+    from pycommand import completion
+    script = completion.generate('bash', CompletionMainCommand)
+    cases = [
+        (['ctool', ''], 'deploy status'),
+        (['ctool', '--f'], '--file='),
+        (['ctool', '-f', 'deploy', ''], 'deploy status'),
+        (['ctool', 'deploy', '--'], '--env= --force --branch='),
+        (['ctool', 'deploy', '-fe', ''], 'prod staging'),
+        (['ctool', 'deploy', '--env', '=', 's'], 'staging'),
+        (['ctool', 'deploy', '--branch', ''], 'main dev'),
+        (['ctool', 'status', '-'], '-h --help -f --file= --version'),
+    ]
+    for words, expected in cases:
+        output = subprocess.check_output(
+            ['bash', '-c', script + '''
+COMP_WORDS=("$@")
+COMP_CWORD=$(($# - 1))
+_ctool
+echo "${COMPREPLY[*]}"''', 'bash'] + words, universal_newlines=True)
+        eq_((words, output.strip()), (words, expected))
+
+
+class InvokeTestCommand(pycommand.CommandBase):
+    optionList = (
+        ('exit', ('e', '<status>', 'raise CommandExit with status')),
+        ('stdin', ('', False, 'echo stdin')),
+    )
+
+    def run(self):
+        if self.flags.exit:
+            raise pycommand.CommandExit(int(self.flags.exit))
+        if self.flags.stdin:
+            sys.stdout.write(sys.stdin.read())
+        sys.stderr.write('args: {}\n'.format(' '.join(self.args)))
+        print(' '.join(reversed(self.args)))
+        return len(self.args)
+
+
+class ArgvTestCommand(pycommand.CommandBase):
+    def run(self):
+        print(sys.argv[1:])
+        return 0
+
+
+def test_invoke():
+    '''Commands can be run in-process with captured output'''
+    from pycommand.testing import invoke
+    result = invoke(InvokeTestCommand, ['a', 'b'])
+    eq_((result.status, result.stdout, result.stderr, result.exception),
+        (2, 'b a\n', 'args: a b\n', None))
+    eq_(invoke(InvokeTestCommand, ['--stdin'], stdin='in\n').stdout, 'in\n\n')
+    result = invoke(InvokeTestCommand, ['-e', '3'])
+    eq_((result.status, result.exception.err), (3, 3))
+    result = invoke(InvokeTestCommand, ['-x'])
+    eq_((result.status, result.stdout),
+        (1, 'error: option -x not recognized\n'))
+    eq_(type(sys.stdout).__name__ == 'ThreadStream', False)
+    argv = sys.argv
+    eq_(invoke(ArgvTestCommand, ['x', '-y']).stdout, "['x', '-y']\n")
+    eq_(sys.argv is argv, True)
+
+
+def test_invoke_threads():
+    '''Concurrent invocations do not see each other's output'''
+    import threading
+    from pycommand.testing import invoke
+    failures = []
+
+    def work(n):
+        for i in range(50):
+            argv = [str(n), str(i)]
+            result = invoke(InvokeTestCommand, argv)
+            if (result.stdout, result.stderr) != (
+                    '{} {}\n'.format(i, n), 'args: {} {}\n'.format(n, i)):
+                failures.append(result)
+    threads = [threading.Thread(target=work, args=(n, )) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    eq_(failures, [])
+
+
+class ReentrantLeafCommand(pycommand.CommandBase):
+    optionList = (('times', ('t', '<n>', 'repeat the arguments')), )
+
+    def run(self):
+        print(' '.join(self.args * int(self.flags.times or 1)),
+              self.parentFlags['name'], file=self.stdout)
+        return int(self.flags.times or 1)
+
+
+class ReentrantRootCommand(pycommand.CommandBase):
+    optionList = (('name', ('n', '<name>', 'name to print')), )
+    commands = {'leaf': ReentrantLeafCommand}
+
+    def run(self):
+        return super(ReentrantRootCommand, self).run().run()
+
+
+def test_execute_threads():
+    '''Commands can be parsed and run from 32 threads at once'''
+    import threading
+    failures = []
+
+    def work(n):
+        for i in range(100):
+            stdout = StringIO()
+            argv = ['-n', str(n), 'leaf', '-t', str(i % 3 + 1), str(i)]
+            status = pycommand.execute(ReentrantRootCommand, argv, stdout)
+            expected = ' '.join([str(i)] * (i % 3 + 1)) + ' {}\n'.format(n)
+            if (status, stdout.getvalue()) != (i % 3 + 1, expected):
+                failures.append((n, i, status, stdout.getvalue()))
+    threads = [threading.Thread(target=work, args=(n, )) for n in range(32)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    eq_(failures, [])
+
+
+def test_argv_default():
+    '''argv defaults to sys.argv at the time of the call'''
+    argv = sys.argv
+    sys.argv = ['prog', '-h', 'arg']
+    try:
+        eq_(BasicTestCommand().args, ['arg'])
+    finally:
+        sys.argv = argv
+
+
+def test_generator_variables():
+    '''Answers of the script generator do not change the class'''
+    util.input = lambda question: 'mytool'
+    try:
+        generator = util.PycommandGenerator([])
+        generator.askVar('name', 'name of executable')
+    finally:
+        del util.input
+    eq_(generator.variables['name'], 'mytool')
+    eq_(util.PycommandGenerator.variables['name'], 'mycommand')
+
+
+def test_repl():
+    '''The REPL runs lines until exit and survives errors'''
+    from pycommand.repl import Repl
+    stdout = StringIO()
+    lines = ['-n me leaf "a b" c', '--bogus leaf', '-n', '"open',
+             '', 'nope', 'leaf -t 2 x', 'exit', 'leaf never']
+    repl = Repl(ReentrantRootCommand, stdin=StringIO('\n'.join(lines)),
+                stdout=stdout)
+    eq_(repl.loop(), 2)
+    eq_(stdout.getvalue().splitlines(), [
+        'a b c me',
+        'error: option --bogus not recognized',
+        'error: option -n requires argument',
+        'error: No closing quotation',
+        'error: command nope does not exist',
+        'x x None',
+    ])
+
+
+def test_repl_completions():
+    '''The REPL completes subcommands and options'''
+    from pycommand.repl import Repl
+    completions = Repl(CompletionMainCommand).completions
+    eq_(completions(''), ['deploy', 'status'])
+    eq_(completions('-f file d'), ['deploy'])
+    eq_(completions('--f'), ['--file='])
+    eq_(completions('deploy -'), ['-e', '--env=', '-f', '--force',
+                                  '--branch='])
+    eq_(completions('deploy --env '), [])
+    eq_(completions('deploy arg '), [])
+
+
+class ArgFilesTestCommand(pycommand.CommandBase):
+    argFiles = True
+
+    def run(self):
+        for arg in self.iterArgs():
+            print(arg, file=self.stdout)
+        return 0
+
+
+def test_argfiles():
+    '''@argfile and - are expanded lazily, with newline or NUL separators'''
+    import io
+    import shutil
+    import tempfile
+    from pycommand.argfiles import readArgs
+    from pycommand.testing import invoke
+    tmpdir = tempfile.mkdtemp()
+    try:
+        lines = os.path.join(tmpdir, 'lines')
+        with io.open(lines, 'wb') as f:
+            f.write(u'a b\r\n\nc\xe9\n'.encode('utf-8'))
+        nul = os.path.join(tmpdir, 'nul')
+        with io.open(nul, 'wb') as f:
+            f.write(b'x\ny\0z\0')
+        result = invoke(ArgFilesTestCommand,
+                        ['first', '@' + lines, '-', '@' + nul, '@'],
+                        stdin='s1\0s2\0')
+        # Files are decoded like sys.argv, which need not be UTF-8
+        ce = u'c\xe9'.encode('utf-8')
+        if sys.version_info[0] >= 3:
+            ce = ce.decode(sys.getfilesystemencoding(), 'surrogateescape')
+        eq_(result.stdout.splitlines(), [
+            'first', 'a b', ce, 's1', 's2', 'x', 'y', 'z', '@'])
+        result = invoke(ArgFilesTestCommand, ['@' + tmpdir + '/missing'])
+        eq_(result.status, 2)
+        assert result.stdout.startswith('error: cannot read argument file')
+    finally:
+        shutil.rmtree(tmpdir)
+
+    # ArgFilesTestCommand reads stdin with an explicit separator
+    ArgFilesTestCommand.argSeparator = '\n'
+    try:
+        eq_(invoke(ArgFilesTestCommand, ['-'], 's1\0s2\n').stdout,
+            's1\0s2\n')
+    finally:
+        del ArgFilesTestCommand.argSeparator
+
+    # Arguments are yielded as soon as they are read, also when blocks
+    # end halfway a separator or a multibyte character
+    stream = io.BytesIO(u'\xe9\xe9\r\n'.encode('utf-8') * 3)
+    args = readArgs(stream, blocksize=1, encoding='utf-8')
+    eq_(next(args), u'\xe9\xe9')
+    eq_(stream.tell(), 6)
+    eq_(list(args), [u'\xe9\xe9'] * 2)
+    eq_(list(pycommand.CommandBase(['@x', '-']).iterArgs()), ['@x', '-'])
+
+
+class TypedTestCommand(pycommand.CommandBase):
+    optionList = (
+        ('jobs', ('j', '<n>', 'number of jobs', {'type': 'int'})),
+        ('timeout', ('', '<time>', 'timeout', {'type': 'duration'})),
+        ('size', ('s', '<size>', 'size', {'type': 'bytes'})),
+        ('ports', ('', '<ports>', 'ports', {'type': CommaList(int)})),
+        ('tag', ('t', '<tag>', 'add a tag', {'action': 'append'})),
+        ('verbose', ('v', False, 'more output', {'action': 'count'})),
+        ('name', ('n', '<name>', 'name')),
+    )
+
+
+def test_typed_options():
+    '''Values are converted while parsing and repeated options collected'''
+    cmd = TypedTestCommand(['-vvj4', '--timeout=1m30s', '-s', '1.5K',
+                            '--ports', '80, 443', '-t', 'a', '-v', '--tag=b',
+                            '-n', 'x', 'arg'])
+    eq_(cmd.error, None)
+    eq_(dict(cmd.flags), {'jobs': 4, 'timeout': 90.0, 'size': 1536,
+                          'ports': [80, 443], 'tag': ['a', 'b'],
+                          'verbose': 3, 'name': 'x'})
+    eq_(cmd.args, ['arg'])
+    eq_(TypedTestCommand([]).flags.tag, None)
+
+    cmd = TypedTestCommand(['-j', 'many'])
+    eq_(str(cmd.error), "option --jobs: invalid int value 'many'")
+    eq_(cmd.flags.jobs, None)
+    eq_(str(TypedTestCommand(['--size=2X']).error),
+        "option --size: invalid bytes value '2X'")
+
+    class BadTypeCommand(pycommand.CommandBase):
+        optionList = (('a', ('', '<a>', '', {'type': 'x'})), )
+    assert_raises(ValueError, BadTypeCommand.getSpec)
+
+
+def test_converters():
+    '''Built-in converters of option values'''
+    from pycommand.converters import converters
+    eq_([converters['duration'](v) for v in ('90', '1.5h', '2m30s', '250ms',
+                                             '1d')],
+        [90.0, 5400.0, 150.0, 0.25, 86400.0])
+    eq_([converters['bytes'](v) for v in ('512', '64k', '1.5MiB', '2GB',
+                                          '3b')],
+        [512, 65536, 1572864, 2000000000, 3])
+    eq_(converters['list'](' a,b, ,c '), ['a', 'b', 'c'])
+    for name, value in (('duration', '1y'), ('duration', ''),
+                        ('duration', 'm'), ('bytes', '1kk'),
+                        ('bytes', 'k')):
+        assert_raises(ValueError, converters[name], value)
+
+
+def test_init_manifest():
+    '''init --manifest generates all scripts of a JSON or INI manifest'''
+    import json
+    from pycommand.testing import invoke
+    tmpdir = tempfile.mkdtemp()
+    try:
+        manifest = os.path.join(tmpdir, 'tools.json')
+        with open(manifest, 'w') as f:
+            json.dump({'defaults': {'template': 2}, 'scripts': [
+                {'name': 'deploy', 'classname': 'Deploy',
+                 'options': ['env e <env> environment',
+                             ['force', '', False, 'do not ask']]},
+                {'name': 'status', 'template': 4, 'path': 'bin/status',
+                 'options': ['verbose v - more output']},
+                {'name': 'broken', 'template': 9},
+            ]}, f)
+        ini = os.path.join(tmpdir, 'tools.ini')
+        with open(ini, 'w') as f:
+            f.write('[DEFAULT]\ntemplate = 1\n\n[check]\nclassname = Check\n'
+                    'options =\n    level l <n> 100% strict\n')
+
+        output = os.path.join(tmpdir, 'out')
+        result = invoke(util.PycommandShellMain,
+                        ['init', '-m', manifest, '-o', output])
+        eq_(result.status, 1)
+        eq_(result.stdout.splitlines(), [
+            'written: {}/deploy'.format(output),
+            'written: {}/bin/status'.format(output),
+            'error: {}/broken: template "9" does not exist'.format(output),
+            '2 written, 1 failed',
+        ])
+        result = invoke(util.PycommandShellMain,
+                        ['init', '-m', manifest, '-o', output])
+        eq_(result.stdout.splitlines()[0],
+            'error: {}/deploy: file already exists'.format(output))
+        eq_(invoke(util.PycommandShellMain,
+                   ['init', '-fj1', '-m', ini, '-o', output]).status, 0)
+
+        for name, classname, options in (
+                ('deploy', 'Deploy', ['help', 'env', 'force']),
+                ('bin/status', 'Command', ['file', 'verbose']),
+                ('check', 'Check', ['help', 'level'])):
+            path = os.path.join(output, name)
+            assert os.access(path, os.X_OK)
+            namespace = {'__name__': 'script'}
+            with open(path) as script:
+                exec(compile(script.read(), path, 'exec'), namespace)
+            eq_(list(namespace[classname].getSpec().optionList), options)
+        eq_(namespace['Check'].getSpec().optionList['level'],
+            ('l', '<n>', '100% strict'))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+BUNDLE_SCRIPT = '''
+import pycommand
+
+
+class Main(pycommand.CommandBase):
+    usagestr = 'usage: bundletool <command>'
+    commands = {'sub': 'bundletool_sub:Sub'}
+
+    def run(self):
+        return super(Main, self).run().run()
+
+
+if __name__ == '__main__':
+    pycommand.run_and_exit(Main)
+'''
+
+BUNDLE_SUBCOMMAND = '''
+import pycommand
+
+
+class Sub(pycommand.CommandBase):
+    optionList = (('name', ('n', '<name>', 'name')), )
+
+    def run(self):
+        spec = pycommand.CommandSpec
+        print(self.flags.name, __file__, type(spec.cache).__name__,
+              Sub.getSpec()._usage is not None)
+'''
+
+
+@skipUnless(sys.version_info >= (3, 4), 'bundles require Python 3.4')
+def test_bundle():
+    '''A bundle runs a script and its subcommand modules from bytecode'''
+    import subprocess
+    import zipfile
+    from pycommand.bundle import build
+    tmpdir = tempfile.mkdtemp()
+    try:
+        source = os.path.join(tmpdir, 'src')
+        os.mkdir(source)
+        with open(os.path.join(source, 'bundletool'), 'w') as f:
+            f.write(BUNDLE_SCRIPT)
+        with open(os.path.join(source, 'bundletool_sub.py'), 'w') as f:
+            f.write(BUNDLE_SUBCOMMAND)
+        bundle = os.path.join(tmpdir, 'bundletool.pyz')
+        modules, skipped = build(os.path.join(source, 'bundletool'), bundle,
+                                 sys.executable, snapshot=True)
+        eq_(modules[:2], ['pycommand', 'pycommand.pycommand'])
+        assert 'bundletool_sub' in modules
+        eq_(skipped, [])
+        names = zipfile.ZipFile(bundle).namelist()
+        eq_([name for name in names if name.endswith('.py')], [])
+        shutil.rmtree(source)
+
+        output = subprocess.check_output([bundle, 'sub', '-n', 'x'],
+                                         cwd=tmpdir)
+        eq_(output.decode().split(), [
+            'x', os.path.join(bundle, 'bundletool_sub.pyc'), 'SpecCache',
+            'True'])
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+class CompiledTestCommand(pycommand.CommandBase):
+    optionList = (
+        ('help', ('h', False, 'show this help information')),
+        ('verbose', ('v', False, 'more output', {'action': 'count'})),
+        ('file', ('f', '<file>', 'use <file>')),
+        ('dry-run', ('n', False, 'only print what would be done')),
+        ('name', ('', '<name>', 'name')),
+        ('jobs', ('j', '<n>', 'number of jobs', {'type': 'int'})),
+        ('tag', ('t', '<tag>', 'add a tag', {'action': 'append'})),
+        ('items', ('i', False, 'reserved name')),
+        ('class', ('', '<class>', 'keyword')),
+        ('fil', ('', False, 'prefix of file')),
+    )
+
+
+def test_compiled_parser_fuzz():
+    '''Generated parsers return the same as the generic parser'''
+    import random
+    from pycommand.compiler import moduleSource
+    namespace = {}
+    exec(moduleSource([CompiledTestCommand], __name__), namespace)
+    parse = namespace['parsers']['CompiledTestCommand'][1]
+    spec = pycommand.CommandSpec(CompiledTestCommand)
+    tokens = ['--help', '-h', '-v', '-vv', '-vh', '--verbose', '--verb',
+              '--file', '--file=x', '-f', '-fx', '-fv', '--fi=y', '--fil',
+              '--dry-run', '--dry', '-n', '--name', '--name=', '--na=z',
+              '--jobs', '--jobs=3', '-j', '-j2', '-jx', '--jobs=x', '-t',
+              '-ta', '--tag=b', '--items', '-i', '--class=c', '--class',
+              '--bogus', '-z', '--', '-', 'arg', '', '--help=1', '-h-',
+              '-nvf']
+    rand = random.Random(23)
+    for n in range(5000):
+        argv = [rand.choice(tokens) for n in range(rand.randint(0, 8))]
+        start = rand.randint(0, 1) if argv else 0
+        expected = pycommand.CommandSpec.parse(spec, argv, start)
+        flags, args, error = parse(spec, argv, start)
+        eq_((dict(flags), args, str(error)),
+            (dict(expected[0]), expected[1], str(expected[2])), argv)
+        eq_(type(error), type(expected[2]))
+
+
+def test_compiled_parser_pickup():
+    '''Generated parsers are used while they are up to date'''
+    from pycommand.testing import invoke
+    tmpdir = tempfile.mkdtemp()
+    sys.path.insert(0, tmpdir)
+    try:
+        with open(os.path.join(tmpdir, 'compiledtool.py'), 'w') as f:
+            f.write('import pycommand\n\n\n'
+                    'class Main(pycommand.CommandBase):\n'
+                    '    optionList = (("file", ("f", "<file>", "file")), )\n'
+                    '    commands = {"sub": "compiledtool:Sub"}\n\n\n'
+                    'class Sub(pycommand.CommandBase):\n'
+                    '    optionList = (("all", ("a", False, "all")), )\n')
+        result = invoke(util.PycommandShellMain,
+                        ['compile', 'compiledtool:Main'])
+        generated = os.path.join(tmpdir, 'compiledtool_pycommand.py')
+        eq_(result.stdout, 'written: {}\n'.format(generated))
+
+        import compiledtool
+        pycommand.pycommand._compiledModules.pop('compiledtool', None)
+        spec = compiledtool.Main.getSpec()
+        assert 'parse' in vars(spec)
+        eq_(spec._usage, pycommand.CommandSpec(compiledtool.Main).usage)
+        chain = compiledtool.Main.parseChain(['-fx', 'sub', '-a', 'arg'])
+        eq_([(dict(cmd.flags), cmd.args) for cmd in chain], [
+            ({'file': 'x'}, ['sub', '-a', 'arg']),
+            ({'all': True}, ['arg'])])
+        assert 'parse' in vars(compiledtool.Sub.getSpec())
+
+        compiledtool.Sub.optionList = (('none', ('n', False, 'none')), )
+        assert 'parse' not in vars(compiledtool.Sub.getSpec())
+    finally:
+        sys.path.remove(tmpdir)
+        sys.modules.pop('compiledtool', None)
+        sys.modules.pop('compiledtool_pycommand', None)
+        shutil.rmtree(tmpdir)